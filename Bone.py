@@ -1,7 +1,5 @@
 #!/usr/bin/env python
 
-import xml.etree.ElementTree as ET
-from enum import Enum
 from collections import namedtuple
 import math
 from math import cos, sin
@@ -9,16 +7,12 @@ import pygame as pg
 import pygame.gfxdraw
 #import pygame.gfxdraw
 import const
+import kinematics
+from skeleton import BoneType, Skeleton, CAP_RADIUS
 
 
 Point = namedtuple("Point", "x y")
 
-class BoneType(Enum):
-    UNDEF = 0
-    LINE = 1
-    CIRCLE = 2
-
-
 
 def get_line_polygon(pos1, pos2, thickness=16):
     # CREDIT: https://stackoverflow.com/a/30599392
@@ -56,6 +50,8 @@ def get_line_polygon(pos1, pos2, thickness=16):
     return (UL, UR, BR, BL)
 
 class Gimbal:
+    __slots__ = ("bone", "pos_x", "pos_y", "rad", "rect", "visible", "selected",
+                 "color_normal", "color_selected", "color", "old_angle", "mouse_prev")
     
     def __init__(self, bone):
         self.bone = bone
@@ -77,16 +73,23 @@ class Gimbal:
 
     def checkPressed(self, mousePos):
         if self.selected:
-            return
+            return False
 
         if self.rect.collidepoint(mousePos):
             self.selected = True
             self.mouse_prev = mousePos
+            return True
+
+        return False
 
     def unselect(self):
         self.selected = False
 
-    def update(self):
+    def update(self, mouse_pos=None):
+        """
+        mouse_pos: cursor position driving a selected gimbal; read from
+                   pygame when not given
+        """
         self.pos_x = self.bone.pos_x2
         self.pos_y = self.bone.pos_y2
         self.rect = pg.Rect(self.pos_x -self.rad, self.pos_y - self.rad, 2*self.rad, 2*self.rad)
@@ -99,7 +102,7 @@ class Gimbal:
         
 
         if self.selected:
-            cur_mouse = pg.mouse.get_pos()
+            cur_mouse = mouse_pos if mouse_pos is not None else pg.mouse.get_pos()
             dx = cur_mouse[0] - self.bone.pos_x1
             dy = cur_mouse[1] - self.bone.pos_y1
             angle = math.atan2(-dy, dx)
@@ -110,12 +113,20 @@ class Gimbal:
             if not self.bone.other_end:
                 self.bone.angle -= self.bone.getPropagatedAngle()
 
-    def draw(self, screen):
-        if self.visible:
+    def draw(self, screen, viewport=None):
+        if not self.visible:
+            return
+        if viewport is None:
             pg.draw.circle(screen, self.color, (int(self.pos_x), int(self.pos_y)), self.rad)
+        else:
+            # the hit area is in stage coordinates, so it zooms with the figure
+            x, y = viewport.toScreen(self.pos_x, self.pos_y)
+            pg.draw.circle(screen, self.color, (int(x), int(y)),
+                           max(2, int(self.rad * viewport.zoom)))
 
 
 class WunderGimbal(Gimbal):
+    __slots__ = ()
 
     def __init__(self, bone):
         super().__init__(bone)
@@ -127,7 +138,7 @@ class WunderGimbal(Gimbal):
 
         self.mouse_prev = [0, 0]
 
-    def update(self):
+    def update(self, mouse_pos=None):
         
         if self.selected:
             self.color = self.color_selected
@@ -136,7 +147,7 @@ class WunderGimbal(Gimbal):
             self.color = self.color_normal
 
         if self.selected:
-            cur_mouse = pg.mouse.get_pos()
+            cur_mouse = mouse_pos if mouse_pos is not None else pg.mouse.get_pos()
             dx = cur_mouse[0] - self.mouse_prev[0]
             dy = cur_mouse[1] - self.mouse_prev[1]
             
@@ -154,6 +165,10 @@ class WunderGimbal(Gimbal):
 
 
 class Bone:
+    __slots__ = ("type", "length", "angle", "pos_x1", "pos_y1", "pos_x2", "pos_y2",
+                 "color", "thickness", "parent", "children", "index", "wunderkind",
+                 "other_end", "gimbal", "wunder_gimbal", "current_frame",
+                 "frame_translations", "frame_angles")
 
     def __init__(self, wunder=True):
         self.type = BoneType.LINE
@@ -168,6 +183,7 @@ class Bone:
     
         self.parent = None
         self.children = []
+        self.index = -1         # position in the figure's pre-order bone list
         self.wunderkind = False # root bone; extra gimbal (translation)
 
         ### e.g. torso is wunderkind, and parent of left_left and leg_right
@@ -175,8 +191,10 @@ class Bone:
         ###   torso despite their hierarchical position
         self.other_end = False  
 
-        self.gimbal = Gimbal(self)
-        self.wunder_gimbal = WunderGimbal(self)
+        # editing handles; only created while the figure is being edited,
+        # see Figure.beginEditing
+        self.gimbal = None
+        self.wunder_gimbal = None
 
         # animation stuff
         self.current_frame = 0
@@ -196,10 +214,10 @@ class Bone:
     
     def addFrame(self):
         if self.wunderkind:
-            self.frame_translations.append((self.pos_x1, self.pos_x2))
+            self.frame_translations.append((self.pos_x1, self.pos_y1))
         self.frame_angles.append(self.angle)
 
-    def update(self):
+    def update(self, mouse_pos=None):
         
         # account for higher/parent nodes
         if (self.parent):
@@ -215,22 +233,22 @@ class Bone:
         if not self.other_end:
             ang_parent = self.getPropagatedAngle()
 
-        ang = math.radians(self.angle + ang_parent)
-        self.pos_x2 = self.pos_x1 + math.cos(ang) * self.length
-        self.pos_y2 = self.pos_y1 - math.sin(ang) * self.length
+        self.pos_x2, self.pos_y2 = kinematics.endPoint(self.pos_x1, self.pos_y1,
+                                                      self.angle + ang_parent, self.length)
 
-        self.gimbal.update()
+        if self.gimbal:
+            self.gimbal.update(mouse_pos)
 
 
-    def updateAll(self):
+    def updateAll(self, mouse_pos=None):
 
-        if self.wunderkind:
-            self.wunder_gimbal.update()
+        if self.wunder_gimbal:
+            self.wunder_gimbal.update(mouse_pos)
 
 
-        self.update()
+        self.update(mouse_pos)
         for child in self.children:
-            child.updateAll()
+            child.updateAll(mouse_pos)
 
         #print("updateAll finished!")
 
@@ -239,61 +257,37 @@ class Bone:
         #for child in self.children:
         #    child.updateGimbals()
 
-    def checkPressed(self, mousePos):
-        self.gimbal.checkPressed(mousePos)
-        if self.wunderkind:
-            self.wunder_gimbal.checkPressed(mousePos)
+    def checkPressed(self, mousePos, grabbed=None):
+        """
+        grabbed: optional list; gimbals that become selected are appended to it
+        """
+        if self.gimbal and self.gimbal.checkPressed(mousePos) and grabbed is not None:
+            grabbed.append(self.gimbal)
+        if self.wunder_gimbal:
+            if self.wunder_gimbal.checkPressed(mousePos) and grabbed is not None:
+                grabbed.append(self.wunder_gimbal)
 
         for child in self.children:
-            child.checkPressed(mousePos)
+            child.checkPressed(mousePos, grabbed)
     
     def unselectGimbals(self):
-        self.gimbal.unselect()
-        if self.wunderkind:
+        if self.gimbal:
+            self.gimbal.unselect()
+        if self.wunder_gimbal:
             self.wunder_gimbal.unselect()
         for child in self.children:
             child.unselectGimbals()
 
     def draw(self, screen):
         #self.update()
-        if self.type == BoneType.CIRCLE:
-            cx = int(self.pos_x2 + self.pos_x1)//2
-            cy = int(self.pos_y2 + self.pos_y1)//2
-            
-            pg.draw.circle(screen, self.color, (cx, cy), int(self.length/2), 15)
-        else:
-            #pg.gfxdraw.line(screen, int(self.pos_x1), int(self.pos_y1), int(self.pos_x2), int(self.pos_y2), self.color)
-
-            if const.ANTIALIAS_LINES:
-                self.drawLineAntiAliased(screen)
-            else:
-                self.drawLine(screen)
- 
-
-            
-              
-        pg.draw.circle(screen, self.color, (int(self.pos_x1), int(self.pos_y1)), 10)
-        pg.draw.circle(screen, self.color, (int(self.pos_x2), int(self.pos_y2)), 10)
-
-
-    def drawLine(self, screen):
-        pg.draw.line(screen, self.color,  (self.pos_x1, self.pos_y1),
-                (self.pos_x2, self.pos_y2), self.thickness)
+        drawBoneShape(screen, self.type, self.color, self.thickness, self.length,
+                      self.pos_x1, self.pos_y1, self.pos_x2, self.pos_y2)
 
-    
-    def drawLineAntiAliased(self, screen):
-        polygon = get_line_polygon((self.pos_x1, self.pos_y1), (self.pos_x2, self.pos_y2), 
-                                   self.thickness)
-        pg.gfxdraw.aapolygon(screen, polygon, self.color)
-        pg.gfxdraw.filled_polygon(screen, polygon, self.color)
-
-
-     
-
-    def drawExtra(self, screen):
-        self.gimbal.draw(screen)
-        if self.wunderkind:
-            self.wunder_gimbal.draw(screen)
+    def drawExtra(self, screen, viewport=None):
+        if self.gimbal:
+            self.gimbal.draw(screen, viewport)
+        if self.wunder_gimbal:
+            self.wunder_gimbal.draw(screen, viewport)
 
 
     def drawAll(self, screen):
@@ -301,10 +295,10 @@ class Bone:
         for child in self.children:
             child.drawAll(screen)
 
-    def drawAllExtra(self, screen):
-        self.drawExtra(screen)
+    def drawAllExtra(self, screen, viewport=None):
+        self.drawExtra(screen, viewport)
         for child in self.children:
-            child.drawAllExtra(screen)
+            child.drawAllExtra(screen, viewport)
 
 
 
@@ -312,28 +306,57 @@ class Bone:
         return f"Bone: Length=>{self.length} Angle=>{self.angle}"
 
 
-def constructBoneFromXMLNode(bone_node):
+def drawBoneShape(screen, bone_type, color, thickness, length, x1, y1, x2, y2,
+                  antialias=const.ANTIALIAS_LINES, caps=True, scale=1.0):
+    """
+    antialias, caps: cheaper variants for lower levels of detail (see lod.py)
+    scale: zoom factor of the fixed-size parts (joint caps, ring width); the
+           other arguments are already in screen units (see viewport.py)
+    """
+    if bone_type == BoneType.CIRCLE:
+        cx = int(x2 + x1)//2
+        cy = int(y2 + y1)//2
+
+        pg.draw.circle(screen, color, (cx, cy), int(length/2), max(1, int(15 * scale)))
+    else:
+        #pg.gfxdraw.line(screen, int(x1), int(y1), int(x2), int(y2), color)
+
+        if antialias:
+            polygon = get_line_polygon((x1, y1), (x2, y2), thickness)
+            pg.gfxdraw.aapolygon(screen, polygon, color)
+            pg.gfxdraw.filled_polygon(screen, polygon, color)
+        else:
+            pg.draw.line(screen, color, (x1, y1), (x2, y2), thickness)
 
-    bone = Bone()
-    bone.length = float(bone_node.attrib["len"])
-    bone.angle = float(bone_node.attrib["angle"])
-    bone.frame_angles.append(bone.angle)
+    if caps:
+        radius = max(1, int(CAP_RADIUS * scale))
+        pg.draw.circle(screen, color, (int(x1), int(y1)), radius)
+        pg.draw.circle(screen, color, (int(x2), int(y2)), radius)
 
-    
-    if "w" in bone_node.attrib.keys():
-        bone.other_end = True
 
-    if "color" in bone_node.attrib.keys():
-        cs = bone_node.attrib["color"].split("|")
-        col = tuple(map(lambda x : int(x), cs))
-        bone.color = col
+def drawPose(screen, pose):
+    """
+    Draws a lightweight figure instance (skeleton.Pose); no gimbals
+    """
+    skel = pose.skeleton
+    for i, (x1, y1, x2, y2) in enumerate(pose.positions()):
+        drawBoneShape(screen, skel.types[i], skel.colors[i], skel.thicknesses[i],
+                      skel.lengths[i], x1, y1, x2, y2)
 
-    type_str = bone_node.attrib["type"]
-    if type_str == "circle":
-        bone.type = BoneType.CIRCLE
-    
-    for child_node in bone_node:
-        child_bone = constructBoneFromXMLNode(child_node)
+
+def constructBoneFromSkeleton(skeleton, index=0):
+
+    bone = Bone()
+    bone.length = skeleton.lengths[index]
+    bone.angle = skeleton.rest_angles[index]
+    bone.frame_angles.append(bone.angle)
+    bone.other_end = skeleton.other_end[index]
+    bone.color = skeleton.colors[index]
+    bone.type = skeleton.types[index]
+    bone.thickness = skeleton.thicknesses[index]
+
+    for child_index in skeleton.children[index]:
+        child_bone = constructBoneFromSkeleton(skeleton, child_index)
         child_bone.parent = bone
         bone.children.append(child_bone)
 
@@ -343,30 +366,142 @@ def constructBoneFromXMLNode(bone_node):
 class Figure:
     def __init__(self, root):
         self.root = root
+        self.skeleton = None    # shared definition, when loaded through one
         self.root.pos_x1 = 200
         self.root.pos_y1 = 240
-        self.root.frame_translations.append((self.root.pos_x1, self.root.pos_x2))
+        self.root.frame_translations.append((self.root.pos_x1, self.root.pos_y1))
+
+        # flat pre-order view of the tree; bone.index points into this
+        self.bones = []
+        self.collectBones(self.root)
+
+        # callables (start, end) told about changes to stored frames;
+        # end is exclusive, None meaning "to the end of the timeline"
+        self.frame_listeners = []
+
+        self.root.updateAll()
+
+    def collectBones(self, bone):
+        bone.index = len(self.bones)
+        self.bones.append(bone)
+        for child in bone.children:
+            self.collectBones(child)
+
+    def frameCount(self):
+        return len(self.root.frame_angles)
+
+    def addFrameListener(self, listener):
+        self.frame_listeners.append(listener)
+
+    def removeFrameListener(self, listener):
+        self.frame_listeners.remove(listener)
+
+    def framesChanged(self, start, end=None):
+        """
+        Call after modifying frame_angles/frame_translations directly
+        """
+        for listener in self.frame_listeners:
+            listener(start, end)
+
+    def getSkeleton(self):
+        """
+        The shared definition this figure was built from; figures built
+        straight from a Bone tree get one derived from their bones
+        """
+        if self.skeleton is None:
+            self.skeleton = Skeleton.fromBones(self.bones)
+        return self.skeleton
+
+    def getPose(self):
+        """
+        Live pose as ([angle per bone], (root_x, root_y))
+        """
+        return ([bone.angle for bone in self.bones],
+                (self.root.pos_x1, self.root.pos_y1))
+
+    def setPose(self, pose):
+        angles, translation = pose
+        for bone, angle in zip(self.bones, angles):
+            bone.angle = angle
+        self.root.pos_x1, self.root.pos_y1 = translation
+        self.root.updateAll()
+
+    def setFrame(self, frame):
+        """
+        Loads stored frame _frame_ into the live pose
+        """
+        for bone in self.bones:
+            bone.angle = bone.frame_angles[frame]
+        self.root.pos_x1, self.root.pos_y1 = self.root.frame_translations[frame]
         self.root.updateAll()
 
     @classmethod
     def fromFile(cls, xml_fname):
+        return cls.fromSkeleton(Skeleton.load(xml_fname))
 
-        tree = ET.parse(xml_fname)
-        root_bone_node  = tree.getroot().find("bone")
-        root_bone = constructBoneFromXMLNode(root_bone_node)
+    @classmethod
+    def fromSkeleton(cls, skeleton):
+        """
+        An editable (full Bone tree) figure; for lightweight instances of
+        the same skeleton use skeleton.newPose() and drawPose()
+        """
+        root_bone = constructBoneFromSkeleton(skeleton)
         root_bone.wunderkind = True
 
-        return cls(root_bone)
+        figure = cls(root_bone)
+        figure.skeleton = skeleton
+        return figure
     
     def addFrame(self):
-        self.root.addFrame()
+        for bone in self.bones:
+            bone.addFrame()
+        self.framesChanged(self.frameCount() - 1)
+
+    def snapshot(self):
+        """
+        A copy with the same skeleton, live pose and stored timeline, and
+        no editing handles or listeners, for work off the main thread
+        """
+        copy = type(self).fromSkeleton(self.getSkeleton())
+        for bone, source in zip(copy.bones, self.bones):
+            bone.color = source.color
+            bone.thickness = source.thickness
+            bone.frame_angles = list(source.frame_angles)
+        copy.root.frame_translations = list(self.root.frame_translations)
+        copy.setPose(self.getPose())
+        return copy
+
+    def isEditing(self):
+        return self.root.gimbal is not None
+
+    def beginEditing(self):
+        """
+        Creates the interactive handles (gimbals). Only the figure being
+        edited needs them; headless and crowd rendering never do.
+        """
+        if self.isEditing():
+            return
+        for bone in self.bones:
+            bone.gimbal = Gimbal(bone)
+        self.root.wunder_gimbal = WunderGimbal(self.root)
+        self.root.updateAll()
+
+    def endEditing(self):
+        for bone in self.bones:
+            bone.gimbal = None
+            bone.wunder_gimbal = None
     
     def checkPressed(self, mouseCoords):
+        """
+        Returns the list of gimbals grabbed by this press
+        """
         #self.root.checkPressedAll(mouseCoords)
-        self.root.checkPressed(mouseCoords)
+        grabbed = []
+        self.root.checkPressed(mouseCoords, grabbed)
+        return grabbed
     
-    def update(self):
-        self.root.updateAll()
+    def update(self, mouse_pos=None):
+        self.root.updateAll(mouse_pos)
 
     def draw(self, screen):
         self.root.drawAll(screen)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Background loading of figure files.
+
+Parsing and building Figures happens on a thread pool; finished figures are
+handed back to the main thread through a queue that the main loop drains
+once per tick, so callbacks never run concurrently with drawing.
+"""
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+import const
+import Bone
+import bvh
+
+
+class AssetLoader:
+
+    def __init__(self, max_workers=const.LOADER_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers,
+                                       thread_name_prefix="asset-loader")
+        self.completed = queue.SimpleQueue()
+        self.total = 0
+        self.finished = 0
+        self.failed = []        # (fname, exception)
+
+    def load(self, fname, callback=None):
+        """
+        Starts loading _fname_ (figure XML, or a BVH capture) into a Figure.
+        callback(figure) is invoked from drain(), i.e. on the main thread.
+        Returns the Future.
+        """
+        if fname.lower().endswith(".bvh"):
+            return self.submit(fname, callback, bvh.loadFigure, fname)
+        return self.submit(fname, callback, Bone.Figure.fromFile, fname)
+
+    def submit(self, label, callback, func, *args):
+        """
+        Runs func(*args) on the pool; callback(result) runs from drain()
+        """
+        self.total += 1
+        future = self.pool.submit(func, *args)
+        future.add_done_callback(lambda f: self.completed.put((label, f, callback)))
+        return future
+
+    def loadMany(self, fnames, callback=None):
+        return [self.load(fname, callback) for fname in fnames]
+
+    def drain(self, budget_ms=const.LOADER_DRAIN_MS):
+        """
+        Runs callbacks of finished loads until the queue is empty or
+        _budget_ms_ is used up; call once per main loop tick
+        """
+        deadline = time.perf_counter() + budget_ms / 1000
+        while time.perf_counter() < deadline:
+            try:
+                fname, future, callback = self.completed.get_nowait()
+            except queue.Empty:
+                break
+
+            self.finished += 1
+            error = future.exception()
+            if error is not None:
+                self.failed.append((fname, error))
+                print(f"Failed to load {fname}: {error}")
+            elif callback:
+                callback(future.result())
+
+    def busy(self):
+        return self.finished < self.total
+
+    def progress(self):
+        """
+        (finished, total)
+        """
+        return (self.finished, self.total)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
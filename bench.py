@@ -0,0 +1,572 @@
+#!/usr/bin/env python
+"""
+Headless micro-benchmarks. Run all of them with `python bench.py`, or
+name some: `python bench.py export_copies`.
+"""
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import math
+import sys
+import tempfile
+import time
+import tracemalloc
+import pygame as pg
+import Bone
+import const
+
+
+def makeAnimatedFigure(n_frames, fname="man_figure.xml"):
+    """
+    A figure with n_frames of smooth procedural motion
+    """
+    figure = Bone.Figure.fromFile(fname)
+    base = [bone.angle for bone in figure.bones]
+    for i in range(1, n_frames):
+        for k, bone in enumerate(figure.bones[1:], 1):
+            bone.angle = base[k] + 20 * math.sin(i / 15 + k)
+        figure.root.pos_x1 = 200 + 60 * math.sin(i / 40)
+        figure.addFrame()
+    return figure
+
+
+def bench_export_copies(n_frames=300):
+    import export
+    from framebuffer import CopyStats
+
+    figure = makeAnimatedFigure(n_frames)
+    rect = pg.Rect(const.EXPORT_RECT)
+    # what reading each frame via surfarray.array2d + tobytes would copy
+    naive = 2 * rect.w * rect.h * 4
+
+    stats = CopyStats()
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        export.exportAnimation(figure, os.path.join(tmp, "bench.png"), stats=stats)
+        elapsed = time.perf_counter() - start
+
+    print(f"export_copies: {stats}; array2d+tobytes would copy {naive} bytes/frame; "
+          f"{elapsed / n_frames * 1000:.2f} ms/frame")
+
+
+def bench_framering(n_frames=300, workers=None):
+    import export
+    import framering
+
+    figure = makeAnimatedFigure(n_frames)
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        export.exportAnimation(figure, os.path.join(tmp, "serial.png"))
+        serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        framering.exportAnimationParallel(figure, os.path.join(tmp, "ring.png"),
+                                          workers=workers)
+        ring = time.perf_counter() - start
+
+    print(f"framering: serial {serial / n_frames * 1000:.2f} ms/frame, "
+          f"{workers or os.cpu_count()} workers {ring / n_frames * 1000:.2f} ms/frame")
+
+
+def allocated(func):
+    """
+    Bytes still allocated after func() returns, plus its result
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def bench_crowd(n=500, fname="man_figure.xml"):
+    from skeleton import Skeleton
+
+    Skeleton.load(fname)    # parse once outside the measurement
+    full, _ = allocated(lambda: [Bone.Figure.fromFile(fname) for _ in range(n)])
+    light, _ = allocated(lambda: [Skeleton.load(fname).newPose(20 * i, 240)
+                                  for i in range(n)])
+    print(f"crowd: editable Figure {full / n:.0f} bytes/instance, "
+          f"shared Skeleton + Pose {light / n:.0f} bytes/instance")
+
+
+def bench_bone_memory(n=200, fname="man_figure.xml"):
+    from skeleton import Skeleton
+
+    n_bones = len(Skeleton.load(fname))
+    plain, _ = allocated(lambda: [Bone.Figure.fromFile(fname) for _ in range(n)])
+
+    def edited():
+        figures = [Bone.Figure.fromFile(fname) for _ in range(n)]
+        for figure in figures:
+            figure.beginEditing()
+        return figures
+    with_handles, _ = allocated(edited)
+
+    per_bone = n * n_bones
+    print(f"bone_memory: {plain / per_bone:.0f} bytes/bone, "
+          f"{with_handles / per_bone:.0f} bytes/bone with editing handles")
+
+
+def bench_motion_paths(n_frames=5000):
+    from motionpath import MotionPaths
+
+    figure = makeAnimatedFigure(n_frames)
+    screen = pg.Surface(const.CANVAS_DIM)
+
+    start = time.perf_counter()
+    paths = MotionPaths(figure)
+    paths.refresh()
+    full = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for frame in range(0, n_frames, n_frames // 20):
+        figure.bones[-1].frame_angles[frame] += 5
+        figure.framesChanged(frame, frame + 1)
+        paths.draw(screen)
+    edit = (time.perf_counter() - start) / 20
+
+    start = time.perf_counter()
+    for _ in range(100):
+        paths.draw(screen)
+    steady = (time.perf_counter() - start) / 100
+
+    print(f"motion_paths: {n_frames} frames, full pass {full * 1000:.1f} ms, "
+          f"edit+redraw {edit * 1000:.2f} ms, steady draw {steady * 1000:.3f} ms")
+
+
+def bench_lod(n=500, fname="man_figure.xml"):
+    from lod import Detail, LODRenderer, poseSegments
+    from skeleton import Skeleton
+
+    skeleton = Skeleton.load(fname)
+    poses = [skeleton.newPose(20 + (i % 25) * 25, 40 + (i // 25) * 20) for i in range(n)]
+    screen = pg.Surface(const.CANVAS_DIM)
+    renderer = LODRenderer()
+    segments = [poseSegments(pose) for pose in poses]
+
+    results = []
+    for level in Detail:
+        renderer.drawOne(screen, segments[0], level, skeleton, poses[0].angles,
+                         (poses[0].x, poses[0].y))    # warm the sprite cache
+        start = time.perf_counter()
+        for pose, segs in zip(poses, segments):
+            renderer.drawOne(screen, segs, level, skeleton, pose.angles, (pose.x, pose.y))
+        results.append(f"{level.name} {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    renderer.draw(screen, poses=poses)
+    auto = (time.perf_counter() - start) * 1000
+    picked = ", ".join(f"{level.name} {count}" for level, count in renderer.counts.items() if count)
+    print(f"lod: {n} figures, " + ", ".join(results) + f"; policy {auto:.1f} ms ({picked})")
+
+
+def bench_viewport(n=5000, stage=20000, fname="man_figure.xml"):
+    import random
+    from lod import LODRenderer
+    from skeleton import Skeleton
+    from viewport import TiledBackground, Viewport
+
+    skeleton = Skeleton.load(fname)
+    rng = random.Random(1)
+    poses = [skeleton.newPose(rng.uniform(0, stage), rng.uniform(0, stage)) for _ in range(n)]
+    screen = pg.Surface(const.CANVAS_DIM)
+    renderer = LODRenderer()
+    background = TiledBackground()
+    viewport = Viewport()
+    viewport.x = viewport.y = stage / 2
+
+    def frame():
+        background.draw(screen, viewport)
+        renderer.draw(screen, poses=poses, viewport=viewport)
+
+    frame()     # fill the tile cache
+    start = time.perf_counter()
+    for _ in range(20):
+        frame()
+    culled = (time.perf_counter() - start) / 20
+    visible = sum(renderer.counts.values())
+
+    start = time.perf_counter()
+    for _ in range(20):
+        viewport.pan(7, 3)
+        frame()
+    panning = (time.perf_counter() - start) / 20
+
+    start = time.perf_counter()
+    renderer.draw(screen, poses=poses)
+    everything = time.perf_counter() - start
+
+    print(f"viewport: {n} figures on a {stage}px stage, {visible} visible: "
+          f"{culled * 1000:.1f} ms/frame, {panning * 1000:.1f} ms/frame panning, "
+          f"{everything * 1000:.1f} ms drawing all without culling")
+
+
+def bench_autosave(n_frames=200000, edits=2000):
+    from history import History
+    from journal import Journal
+
+    figure = makeAnimatedFigure(n_frames)
+    history = History(figure)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.journal")
+
+        start = time.perf_counter()
+        journal = Journal(path, figure, history)
+        attach = time.perf_counter() - start
+
+        # main-thread cost of journaled edits while the writer snapshots
+        worst = total = 0.0
+        for _ in range(edits):
+            start = time.perf_counter()
+            figure.addFrame()
+            history.recordFrameAdded()
+            elapsed = time.perf_counter() - start
+            worst = max(worst, elapsed)
+            total += elapsed
+
+        start = time.perf_counter()
+        journal.close()
+        close = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+    print(f"autosave: {n_frames} frames, attach {attach * 1000:.1f} ms, "
+          f"edit mean {total / edits * 1e6:.1f} us / worst {worst * 1000:.2f} ms, "
+          f"final snapshot {close * 1000:.0f} ms ({size // 1024} KiB)")
+
+
+def bench_playback(n_figures=40, n_frames=600, seconds=3.0, fname="man_figure.xml"):
+    from playback import Playback
+    from viewport import Viewport
+
+    source = makeAnimatedFigure(n_frames, fname)
+    figures = []
+    for i in range(n_figures):
+        figure = Bone.Figure.fromFile(fname)
+        for bone, src in zip(figure.bones, source.bones):
+            # phase-shifted copies, spread over the canvas
+            bone.frame_angles = src.frame_angles[i:] + src.frame_angles[:i]
+        dx, dy = (i % 8) * 70 - 150, (i // 8) * 60 - 100
+        figure.root.frame_translations = [(x + dx, y + dy)
+                                          for x, y in source.root.frame_translations]
+        figures.append(figure)
+    screen = pg.Surface(const.TOTAL_DIM)
+    viewport = Viewport()
+    budget = 1 / const.FPS
+
+    def run(tick):
+        # a main loop capped at const.FPS, like pg.time.Clock.tick
+        times = []
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            tick()
+            elapsed = time.perf_counter() - start
+            times.append(elapsed)
+            time.sleep(max(0.0, budget - elapsed))
+        late = sum(t > budget for t in times)
+        return f"{sum(times) / len(times) * 1000:.2f} ms/tick mean, " \
+               f"{max(times) * 1000:.1f} worst, {late}/{len(times)} over budget"
+
+    playback = Playback(figures, viewport, n_slots=1)
+    playback.close()        # just its renderer: every frame drawn when due
+    direct = run(lambda: playback.render(screen, playback.update(), viewport,
+                                         playback.lod, playback.background))
+
+    playback = Playback(figures, viewport)
+    time.sleep(0.2)         # prefetch, as while the user presses play
+
+    def prefetched():
+        playback.update()
+        playback.draw(screen, viewport)
+    ahead = run(prefetched)
+    playback.close()
+
+    print(f"playback: {n_figures} figures x {n_frames} frames at {const.FPS} fps; "
+          f"direct {direct}; prefetched {ahead} "
+          f"({playback.hits} hits, {playback.misses} misses)")
+
+
+def bench_keyframes(n_frames=20000, bvh_frames=100000):
+    import bvh
+    import keyframes
+
+    figure = makeAnimatedFigure(n_frames)
+    _, report = keyframes.reduceFigure(figure)
+    print(f"keyframes: procedural, {report}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, "capture.bvh")
+        writeSyntheticBVH(fname, bvh_frames)
+        _, timeline, _ = bvh.importBVH(fname)
+    reduced, report = keyframes.reduceChannels(timeline.decodeAll())
+    print(f"keyframes: bvh, {report}; {len(reduced.toBytes())} bytes "
+          f"vs {timeline.nbytes} encoded")
+
+
+def bench_kinematics(n_frames=1000000, fname="man_figure.xml"):
+    import numpy as np
+    import kinematics
+    from skeleton import Skeleton
+
+    skeleton = Skeleton.load(fname)
+    rng = np.random.default_rng(1)
+    angles = rng.uniform(-180, 180, (n_frames, len(skeleton)))
+    translations = rng.uniform(0, 640, (n_frames, 2))
+
+    start = time.perf_counter()
+    for _ in kinematics.iterPositions(skeleton, angles, translations, dtype=np.float32):
+        pass
+    batched = time.perf_counter() - start
+
+    n_scalar = 20000
+    start = time.perf_counter()
+    for frame in range(n_scalar):
+        kinematics.posePositions(skeleton, angles[frame], *translations[frame])
+    scalar = (time.perf_counter() - start) / n_scalar * n_frames
+
+    print(f"kinematics: {n_frames} frames x {len(skeleton)} bones, batched {batched:.2f} s "
+          f"({n_frames / batched / 1e6:.1f} M frames/s), per pose ~{scalar:.1f} s")
+
+
+def bench_raster(n_frames=16, crowds=((1, 1.0), (50, 0.3), (300, 0.2), (1000, 0.1))):
+    import numpy as np
+    import kinematics
+    import raster
+    from framebuffer import FrameBuffer
+
+    source = makeAnimatedFigure(64)
+    rig = source.getSkeleton()
+    angles, translations = kinematics.timelineArrays(source)
+    buffer = FrameBuffer(const.CANVAS_DIM)
+    rasterizer = raster.Rasterizer(const.CANVAS_DIM)
+
+    for n, scale in crowds:
+        rng = np.random.default_rng(0)
+        offsets = rng.uniform(0, 1, (n, 2)) * const.CANVAS_DIM - translations[0] * scale
+        frames = (rng.integers(0, 64, (n, 1)) + np.arange(n_frames)) % 64
+        positions = [kinematics.batchPositions(rig, angles[f], translations[f]) for f in frames]
+
+        start = time.perf_counter()
+        for frame in range(n_frames):
+            buffer.surface.fill(const.BGCOLOR)
+            for offset, p in zip(offsets, positions):
+                for b, (x1, y1, x2, y2) in enumerate((p[frame] * scale + np.tile(offset, 2)).tolist()):
+                    Bone.drawBoneShape(buffer.surface, rig.types[b], rig.colors[b],
+                                       max(1, round(rig.thicknesses[b] * scale)),
+                                       rig.lengths[b] * scale, x1, y1, x2, y2, scale=scale)
+            buffer.pixels()
+            buffer.release()
+        drawn = (time.perf_counter() - start) / n_frames
+
+        start = time.perf_counter()
+        shapes, colors = zip(*(raster.rigShapes(rig, p, offset, scale)
+                               for offset, p in zip(offsets, positions)))
+        rasterizer.render(np.concatenate(shapes, axis=1), np.concatenate(colors))
+        rasterized = (time.perf_counter() - start) / n_frames
+
+        print(f"raster: {n} figures at {scale}x, pygame {drawn * 1000:.1f} ms/frame, "
+              f"numpy {rasterized * 1000:.1f} ms/frame")
+
+
+def bench_secondary(n_figures=300, n_frames=600):
+    import secondary
+
+    figures = [makeAnimatedFigure(n_frames)]
+    figures += [Bone.Figure.fromSkeleton(figures[0].getSkeleton()) for _ in range(n_figures - 1)]
+    for figure in figures[1:]:
+        for bone, source in zip(figure.bones, figures[0].bones):
+            bone.frame_angles = list(source.frame_angles)
+        figure.root.frame_translations = list(figures[0].root.frame_translations)
+
+    start = time.perf_counter()
+    n = secondary.bake(figures)
+    elapsed = time.perf_counter() - start
+    print(f"secondary: {n_figures} figures x {n_frames} frames in {elapsed:.2f} s, "
+          f"{elapsed / n_frames * 1000:.2f} ms per step of the crowd ({n / elapsed:.0f} figure-frames/s)")
+
+
+def bench_updater(n=200, ticks=60, flip_ms=8.0, fname="man_figure.xml"):
+    import random
+    from lod import LODRenderer
+    from updater import PoseUpdater
+
+    rng = random.Random(1)
+    figures = [Bone.Figure.fromFile(fname) for _ in range(n)]
+    for figure in figures:
+        figure.root.pos_x1, figure.root.pos_y1 = rng.uniform(0, 600), rng.uniform(0, 440)
+    screen = pg.Surface(const.CANVAS_DIM)
+    renderer = LODRenderer()
+
+    def wiggle(tick):
+        for figure in figures:
+            figure.bones[3].angle = -90 + 30 * math.sin(tick / 10)
+
+    # main thread time per tick, not counting the flip (a sleep, which lets
+    # the worker run)
+    start = time.perf_counter()
+    for tick in range(ticks):
+        wiggle(tick)
+        for figure in figures:
+            figure.update()
+        renderer.draw(screen, figures)
+    serial = (time.perf_counter() - start) / ticks
+
+    updater = PoseUpdater()
+    busy = 0.0
+    for tick in range(ticks):
+        start = time.perf_counter()
+        state = updater.swap()
+        wiggle(tick)
+        updater.submit(figures)
+        renderer.draw(screen, posed=state.posed)
+        busy += time.perf_counter() - start
+        time.sleep(flip_ms / 1000)
+    updater.close()
+    print(f"updater: {n} figures, serial update+draw {serial * 1000:.1f} ms/tick, "
+          f"double-buffered {busy / ticks * 1000:.1f} ms/tick on the main thread "
+          f"(with a {flip_ms:.0f} ms flip to overlap)")
+
+
+def bench_retarget(n_targets=100, n_frames=100000, fname="man_figure.xml"):
+    import random
+    import numpy as np
+    import retarget
+    from skeleton import Skeleton
+
+    source = Skeleton.load(fname)
+    rng = random.Random(1)
+    targets = [Skeleton("variant", source.parents,
+                        [length * rng.uniform(0.7, 1.4) for length in source.lengths],
+                        source.rest_angles, source.colors, source.types, source.thicknesses,
+                        source.other_end) for _ in range(n_targets)]
+    angles = np.random.default_rng(1).uniform(-180, 180, (n_frames, len(source)))
+    translations = np.zeros((n_frames, 2))
+
+    start = time.perf_counter()
+    for target in targets:
+        retarget.Retargeter(source, target).retarget(angles, translations)
+    elapsed = time.perf_counter() - start
+    print(f"retarget: {n_frames} frames onto {n_targets} unnamed variants in {elapsed:.2f} s "
+          f"({n_frames * n_targets / elapsed / 1e6:.1f} M frames/s)")
+
+
+def bench_svg(n_frames=20000, workers=None):
+    import shutil
+    import svgexport
+
+    figure = makeAnimatedFigure(n_frames)
+    fd, fname = tempfile.mkstemp(suffix=".svg")
+    os.close(fd)
+    start = time.perf_counter()
+    svgexport.exportAnimatedSVG(figure, fname)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    svgexport.exportAnimatedSVG(figure, fname)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    size = os.path.getsize(fname)
+    os.remove(fname)
+    print(f"svg: {n_frames} frames animated in {elapsed:.2f} s ({n_frames / elapsed:.0f} frames/s), "
+          f"{size / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB traced")
+
+    dirname = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        svgexport.exportSVGFrames(figure, dirname, workers=workers)
+        elapsed = time.perf_counter() - start
+        print(f"svg: {n_frames} frame files in {elapsed:.2f} s ({n_frames / elapsed:.0f} frames/s)")
+    finally:
+        shutil.rmtree(dirname)
+
+
+BVH_HIERARCHY = """HIERARCHY
+ROOT Hips
+{
+  OFFSET 0 0 0
+  CHANNELS 6 Xposition Yposition Zposition Zrotation Xrotation Yrotation
+  JOINT Spine
+  {
+    OFFSET 0 20 0
+    CHANNELS 3 Zrotation Xrotation Yrotation
+    JOINT Neck
+    {
+      OFFSET 0 25 0
+      CHANNELS 3 Zrotation Xrotation Yrotation
+      End Site
+      {
+        OFFSET 0 12 0
+      }
+    }
+%(arms)s  }
+%(legs)s}
+MOTION
+Frames: %(frames)d
+Frame Time: 0.0083333
+"""
+
+
+BVH_LIMB = """  JOINT %(name)s
+  {
+    OFFSET %(x)s %(y)s 0
+    CHANNELS 3 Zrotation Xrotation Yrotation
+    JOINT %(name)sLower
+    {
+      OFFSET 0 %(len)s 0
+      CHANNELS 3 Zrotation Xrotation Yrotation
+      End Site
+      {
+        OFFSET 0 %(end)s 0
+      }
+    }
+  }
+"""
+
+
+def writeSyntheticBVH(fname, n_frames):
+    """
+    A 13-bone walking capture (hips, spine, neck, two arms, two legs)
+    """
+    arms = "".join(BVH_LIMB % dict(name=name, x=x, y=20, len=-25, end=-20)
+                   for name, x in (("LeftArm", 15), ("RightArm", -15)))
+    legs = "".join(BVH_LIMB % dict(name=name, x=x, y=-5, len=-40, end=-40)
+                   for name, x in (("LeftLeg", 8), ("RightLeg", -8)))
+    with open(fname, "w") as f:
+        f.write(BVH_HIERARCHY % dict(arms=arms, legs=legs, frames=n_frames))
+        for frame in range(n_frames):
+            phase = frame / 60
+            values = [frame * 0.1, 90 + 2 * math.sin(phase * 2), 0, 0, 0, 0]
+            values += [5 * math.sin(phase), 0, 0] * 2
+            values += [v for k in range(8) for v in (30 * math.sin(phase + k), 0, 0)]
+            f.write(" ".join("%.4f" % v for v in values) + "\n")
+
+
+def bench_bvh(n_frames=100000):
+    import bvh
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, "capture.bvh")
+        writeSyntheticBVH(fname, n_frames)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        skeleton, timeline, _ = bvh.importBVH(fname)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print(f"bvh: {n_frames} frames x {len(skeleton)} bones in {elapsed:.2f} s "
+          f"({n_frames / elapsed:.0f} frames/s), peak {peak / 2 ** 20:.1f} MiB, "
+          f"stored {timeline.nbytes / 2 ** 20:.1f} MiB")
+
+
+BENCHMARKS = {name[len("bench_"):]: func for name, func in list(globals().items())
+              if name.startswith("bench_")}
+
+
+if __name__ == "__main__":
+    pg.init()
+    pg.display.set_mode((1, 1))
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
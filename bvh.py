@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+"""
+BVH motion capture import.
+
+The joint hierarchy becomes a Skeleton: one bone per joint-to-child (or
+joint-to-end-site) segment, lengths taken from the 3D offsets. The root
+joint's branch with the most bones below it becomes the root bone; its
+other branches (legs, usually) become other_end bones, which start where
+the root bone starts.
+
+Motion is read a chunk of frames at a time. For each chunk, forward
+kinematics in 3D, projection onto a plane and the conversion to Bone.angle
+values are vectorized over the frames, and the result goes straight into
+the timeline storage (a Figure's frame lists, or a framecodec
+TimelineWriter), so memory stays bounded by the chunk size plus the
+output.
+
+    python bvh.py capture.bvh [...]
+
+converts captures to encoded timelines (capture.btl, see framecodec.py).
+
+This module deliberately doesn't import pygame.
+"""
+import itertools
+import os
+import sys
+import time
+import numpy as np
+import const
+import framecodec
+from skeleton import BoneType, Skeleton, DEFAULT_COLOR, DEFAULT_ROOT_POS, DEFAULT_THICKNESS
+
+AXES = {"x": 0, "y": 1, "z": 2}
+# (horizontal, vertical) axes of the projection planes
+PLANES = {"xy": (0, 1), "zy": (2, 1), "xz": (0, 2)}
+
+
+class BVHError(ValueError):
+    pass
+
+
+class Joint:
+    __slots__ = ("name", "parent", "offset", "channels", "first_channel", "children", "end_site")
+
+    def __init__(self, name, parent, first_channel):
+        self.name = name
+        self.parent = parent            # Joint or None
+        self.offset = np.zeros(3)
+        self.channels = []              # e.g. ["Xposition", "Zrotation", ...]
+        self.first_channel = first_channel
+        self.children = []
+        self.end_site = None            # offset of the End Site, if any
+
+
+def rotationMatrices(axis, degrees):
+    """
+    (frames, 3, 3) rotations about _axis_ (0, 1, 2)
+    """
+    rad = np.radians(degrees)
+    c, s = np.cos(rad), np.sin(rad)
+    out = np.zeros((len(degrees), 3, 3))
+    i, j = [(1, 2), (2, 0), (0, 1)][axis]
+    out[:, axis, axis] = 1
+    out[:, i, i] = c
+    out[:, j, j] = c
+    out[:, i, j] = -s
+    out[:, j, i] = s
+    return out
+
+
+class BVHReader:
+
+    def __init__(self, fname, plane=const.BVH_PLANE, height=const.BVH_FIGURE_HEIGHT):
+        """
+        Parses the hierarchy and the motion header; motion frames are read
+        on demand by chunks()
+        plane: projection plane, see PLANES
+        height: on-screen height of the rest pose, in pixels
+        """
+        if plane not in PLANES:
+            raise BVHError(f"bvh: unknown projection plane {plane!r}")
+        self.fname = fname
+        self.plane = PLANES[plane]
+        self.file = open(fname)
+        self.joints = []        # depth first
+        self.n_channels = 0
+        try:
+            self.parseHierarchy()
+            self.parseMotionHeader()
+        except BVHError:
+            self.file.close()
+            raise
+        except (StopIteration, IndexError, KeyError, ValueError) as error:
+            self.file.close()
+            raise BVHError(f"bvh: malformed {fname}: {error!r}") from None
+
+        self.buildBones()
+        self.fitToScreen(height)
+
+    def close(self):
+        self.file.close()
+
+    ## parsing
+
+    def tokens(self):
+        for line in self.file:
+            yield from line.split()
+            if self.motion_reached:
+                return
+
+    def parseHierarchy(self):
+        self.motion_reached = False
+        tokens = self.tokens()
+        if next(tokens) != "HIERARCHY":
+            raise BVHError(f"bvh: {self.fname} doesn't start with HIERARCHY")
+
+        stack = []
+        joint = None
+        for token in tokens:
+            if token in ("ROOT", "JOINT"):
+                joint = Joint(next(tokens), stack[-1] if stack else None, self.n_channels)
+                if joint.parent:
+                    joint.parent.children.append(joint)
+                self.joints.append(joint)
+            elif token == "End":
+                next(tokens)    # "Site"
+                if next(tokens) != "{" or next(tokens) != "OFFSET":
+                    raise BVHError("bvh: malformed End Site")
+                stack[-1].end_site = np.array([float(next(tokens)) for _ in range(3)])
+                if next(tokens) != "}":
+                    raise BVHError("bvh: malformed End Site")
+            elif token == "{":
+                stack.append(joint)
+            elif token == "}":
+                stack.pop()
+                if not stack:
+                    self.motion_reached = True
+            elif token == "OFFSET":
+                joint.offset = np.array([float(next(tokens)) for _ in range(3)])
+            elif token == "CHANNELS":
+                joint.channels = [next(tokens) for _ in range(int(next(tokens)))]
+                self.n_channels += len(joint.channels)
+
+        if not self.joints:
+            raise BVHError(f"bvh: {self.fname} has no joints")
+
+    def parseMotionHeader(self):
+        header = {}
+        for line in self.file:
+            line = line.strip()
+            if not line:
+                continue
+            if line == "MOTION":
+                continue
+            key, _, value = line.partition(":")
+            header[key.strip()] = value.strip()
+            if key.strip() == "Frame Time":
+                break
+        self.n_frames = int(header["Frames"])
+        self.frame_time = float(header["Frame Time"])
+
+    ## bones
+
+    def buildBones(self):
+        """
+        Bones as (joint, target offset, child joint or None), pre-order,
+        with parents and other_end flags for the Skeleton
+        """
+        def targets(joint):
+            out = [(child.offset, child) for child in joint.children]
+            if joint.end_site is not None:
+                out.append((joint.end_site, None))
+            return out
+
+        def size(target):
+            child = target[1]
+            return 1 + sum(size(t) for t in targets(child)) if child else 1
+
+        self.bones = []
+        self.parents = []
+        self.other_end = []
+
+        def visit(joint, offset, child, parent, other_end):
+            index = len(self.bones)
+            self.bones.append((joint, offset, child))
+            self.parents.append(parent)
+            self.other_end.append(other_end)
+            if child is not None:
+                for target in targets(child):
+                    visit(child, target[0], target[1], index, False)
+            return index
+
+        root = self.joints[0]
+        root_targets = sorted(targets(root), key=size, reverse=True)
+        if not root_targets:
+            raise BVHError(f"bvh: {self.fname} has a single joint and no end site")
+        root_bone = visit(root, root_targets[0][0], root_targets[0][1], -1, False)
+        for offset, child in root_targets[1:]:
+            visit(root, offset, child, root_bone, True)
+
+        self.lengths = [float(np.linalg.norm(offset)) for _, offset, _ in self.bones]
+
+    def fitToScreen(self, height):
+        rest_values = np.zeros((1, self.n_channels))
+        for joint in self.joints:
+            # rest pose: the root at its offset, nothing rotated
+            for c, name in enumerate(joint.channels):
+                if name.endswith("position"):
+                    rest_values[0, joint.first_channel + c] = joint.offset[AXES[name[0].lower()]]
+
+        starts, ends = self.bonePoints(rest_values)
+        vertical = np.concatenate((starts[0, :, 1], ends[0, :, 1]))
+        extent = vertical.max() - vertical.min()
+        self.scale = height / extent if extent > 0 else 1.0
+        self.rest_angles = self.localAngles(starts, ends)[0]
+        # projected root position that maps to DEFAULT_ROOT_POS; taken from
+        # the first frame, since captures rarely start at the origin
+        self.origin = None
+
+    def skeleton(self):
+        n = len(self.bones)
+        return Skeleton(os.path.splitext(os.path.basename(self.fname))[0], self.parents,
+                        [length * self.scale for length in self.lengths],
+                        self.rest_angles.tolist(), [DEFAULT_COLOR] * n, [BoneType.LINE] * n,
+                        [DEFAULT_THICKNESS] * n, self.other_end,
+                        source=os.path.abspath(self.fname), bone_names=self.boneNames())
+
+    def boneNames(self):
+        """
+        A bone is named after the joint it starts at, plus the joint it ends
+        at when several bones start there
+        """
+        starts = [joint for joint, _, _ in self.bones]
+        return [joint.name if starts.count(joint) == 1
+                else f"{joint.name}/{child.name if child else 'End'}"
+                for joint, _, child in self.bones]
+
+    ## motion
+
+    def jointTransforms(self, values):
+        """
+        values: (frames, channels); returns per-joint (frames, 3) positions
+        and (frames, 3, 3) rotations, in world space
+        """
+        n_frames = len(values)
+        positions, rotations = {}, {}
+        for joint in self.joints:
+            local = np.broadcast_to(np.eye(3), (n_frames, 3, 3))
+            translation = np.broadcast_to(joint.offset, (n_frames, 3)).copy()
+            for c, name in enumerate(joint.channels):
+                column = values[:, joint.first_channel + c]
+                axis = AXES[name[0].lower()]
+                if name.endswith("rotation"):
+                    local = local @ rotationMatrices(axis, column)
+                else:
+                    translation[:, axis] = column
+
+            parent = joint.parent
+            if parent is None:
+                positions[joint] = translation
+                rotations[joint] = local
+            else:
+                positions[joint] = positions[parent] \
+                                   + np.einsum("fij,j->fi", rotations[parent], joint.offset)
+                rotations[joint] = rotations[parent] @ local
+        return positions, rotations
+
+    def bonePoints(self, values):
+        """
+        Projected (frames, bones, 2) start and end points, vertical axis up
+        """
+        positions, rotations = self.jointTransforms(values)
+        h, v = self.plane
+        starts, ends = [], []
+        for joint, offset, child in self.bones:
+            start = positions[joint]
+            end = positions[child] if child is not None \
+                else start + np.einsum("fij,j->fi", rotations[joint], offset)
+            starts.append(start[:, (h, v)])
+            ends.append(end[:, (h, v)])
+        return np.stack(starts, axis=1), np.stack(ends, axis=1)
+
+    def localAngles(self, starts, ends):
+        """
+        Bone.angle values, (frames, bones), from projected bone points
+        """
+        d = ends - starts
+        world = np.degrees(np.arctan2(d[..., 1], d[..., 0]))
+        local = world.copy()
+        for i, parent in enumerate(self.parents):
+            if parent >= 0 and not self.other_end[i]:
+                local[:, i] -= world[:, parent]
+        # keep them in (-180, 180]
+        return 180 - np.mod(180 - local, 360)
+
+    def chunks(self, chunk_frames=const.BVH_CHUNK):
+        """
+        Yields (angles (frames, bones), translations (frames, 2)) per chunk
+        """
+        expected = self.n_channels
+        root_x, root_y = DEFAULT_ROOT_POS
+        while True:
+            lines = list(itertools.islice(self.file, chunk_frames))
+            if not lines:
+                return
+            values = np.array(" ".join(lines).split(), dtype=np.float64)
+            if values.size % expected:
+                raise BVHError(f"bvh: {self.fname}: frame with a wrong number of values")
+            values = values.reshape(-1, expected)
+
+            starts, ends = self.bonePoints(values)
+            if self.origin is None:
+                self.origin = starts[0, 0]
+            root = (starts[:, 0] - self.origin) * self.scale
+            translations = np.column_stack((root_x + root[:, 0], root_y - root[:, 1]))
+            yield self.localAngles(starts, ends), translations
+
+
+def importBVH(fname, codec=None, chunk_frames=const.BVH_CHUNK, **options):
+    """
+    Streams a BVH file into compact timeline storage.
+    Returns (Skeleton, framecodec.EncodedTimeline, frame time in seconds)
+    """
+    reader = BVHReader(fname, **options)
+    try:
+        skeleton = reader.skeleton()
+        writer = framecodec.TimelineWriter(codec or framecodec.FrameCodec(), len(skeleton) + 2)
+        for angles, translations in reader.chunks(chunk_frames):
+            writer.append(np.concatenate((angles, translations), axis=1).T)
+        return skeleton, writer.finish(), reader.frame_time
+    finally:
+        reader.close()
+
+
+def loadFigure(fname, chunk_frames=const.BVH_CHUNK, **options):
+    """
+    An editable Figure holding the whole capture in its frame lists
+    """
+    import Bone
+
+    reader = BVHReader(fname, **options)
+    try:
+        figure = Bone.Figure.fromSkeleton(reader.skeleton())
+        for bone in figure.bones:
+            bone.frame_angles = []
+        xs, ys = [], []
+        for angles, translations in reader.chunks(chunk_frames):
+            for bone, column in zip(figure.bones, angles.T):
+                bone.frame_angles.extend(column.tolist())
+            xs.extend(translations[:, 0].tolist())
+            ys.extend(translations[:, 1].tolist())
+    finally:
+        reader.close()
+
+    if not xs:
+        raise BVHError(f"bvh: {fname} has no motion frames")
+    figure.root.frame_translations = list(zip(xs, ys))
+    figure.setFrame(0)
+    figure.framesChanged(0)
+    return figure
+
+
+def main(argv=None):
+    for fname in argv if argv is not None else sys.argv[1:]:
+        start = time.perf_counter()
+        skeleton, timeline, frame_time = importBVH(fname)
+        elapsed = time.perf_counter() - start
+
+        out = os.path.splitext(fname)[0] + ".btl"
+        timeline.save(out)
+        print(f"{fname}: {timeline.n_frames} frames ({1 / frame_time:.0f} fps), "
+              f"{len(skeleton)} bones, {elapsed:.2f} s -> {out} ({timeline.nbytes} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+Persistent index of figure files.
+
+Metadata (figure name, bone count, rest-pose size, colours) and a small
+PNG thumbnail are extracted once per file and stored in SQLite; later
+scans only stat the files and re-parse the ones whose mtime changed.
+Browsing and searching then never touches the XML.
+"""
+import io
+import os
+import sqlite3
+import xml.etree.ElementTree as ET
+import pygame as pg
+import const
+import Bone
+from skeleton import Skeleton, CAP_RADIUS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS figures (
+    path        TEXT PRIMARY KEY,
+    mtime       REAL NOT NULL,
+    name        TEXT NOT NULL,
+    bone_count  INTEGER NOT NULL,
+    width       REAL NOT NULL,
+    height      REAL NOT NULL,
+    colors      TEXT NOT NULL,
+    thumbnail   BLOB
+);
+CREATE INDEX IF NOT EXISTS figures_name ON figures (name COLLATE NOCASE);
+"""
+
+
+class CatalogEntry:
+    __slots__ = ("path", "name", "bone_count", "width", "height", "colors")
+
+    def __init__(self, path, name, bone_count, width, height, colors):
+        self.path = path
+        self.name = name
+        self.bone_count = bone_count
+        self.width = width
+        self.height = height
+        self.colors = [tuple(map(int, c.split("|"))) for c in colors.split(",") if c]
+
+    def __str__(self):
+        return f"{self.name or os.path.basename(self.path)} ({self.bone_count} bones)"
+
+
+def poseBounds(pose):
+    """
+    (min_x, min_y, max_x, max_y) of a pose, including joint caps
+    """
+    xs, ys = [], []
+    for x1, y1, x2, y2 in pose.positions():
+        xs += (x1, x2)
+        ys += (y1, y2)
+    return (min(xs) - CAP_RADIUS, min(ys) - CAP_RADIUS,
+            max(xs) + CAP_RADIUS, max(ys) + CAP_RADIUS)
+
+
+def renderThumbnail(skeleton, size=const.THUMBNAIL_SIZE):
+    """
+    PNG bytes of the rest pose, scaled to fit _size_
+    """
+    pose = skeleton.newPose(0, 0)
+    min_x, min_y, max_x, max_y = poseBounds(pose)
+    pose.x, pose.y = -min_x, -min_y
+
+    full = pg.Surface((int(max_x - min_x) + 1, int(max_y - min_y) + 1))
+    full.fill(const.BGCOLOR)
+    Bone.drawPose(full, pose)
+
+    scale = min(size[0] / full.get_width(), size[1] / full.get_height())
+    thumb_size = (max(1, int(full.get_width() * scale)), max(1, int(full.get_height() * scale)))
+    thumb = pg.transform.smoothscale(full, thumb_size)
+
+    out = io.BytesIO()
+    pg.image.save(thumb, out, "thumb.png")
+    return out.getvalue()
+
+
+class Catalog:
+
+    def __init__(self, db_fname=const.CATALOG_DB):
+        self.db = sqlite3.connect(db_fname)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def scan(self, dirs=const.LIBRARY_DIRS):
+        """
+        Brings the index up to date with the *.xml files under _dirs_.
+        Returns (added_or_updated, removed).
+        """
+        known = dict(self.db.execute("SELECT path, mtime FROM figures"))
+        seen = set()
+        updated = 0
+
+        for top in dirs:
+            for dirpath, _, fnames in os.walk(top):
+                for fname in fnames:
+                    if not fname.endswith(".xml"):
+                        continue
+                    path = os.path.abspath(os.path.join(dirpath, fname))
+                    seen.add(path)
+                    try:
+                        mtime = os.path.getmtime(path)
+                    except OSError:
+                        continue
+                    if known.get(path) == mtime:
+                        continue
+                    if self.index(path, mtime):
+                        updated += 1
+
+        gone = [(path,) for path in known if path not in seen]
+        self.db.executemany("DELETE FROM figures WHERE path = ?", gone)
+        self.db.commit()
+        return (updated, len(gone))
+
+    def index(self, path, mtime):
+        try:
+            figure_node = ET.parse(path).getroot()
+            if figure_node.tag != "figure":
+                return False
+            skeleton = Skeleton.fromXML(figure_node, path)
+        except (OSError, ET.ParseError, KeyError, ValueError, AttributeError):
+            return False
+
+        min_x, min_y, max_x, max_y = poseBounds(skeleton.newPose(0, 0))
+        colors = ",".join(dict.fromkeys("|".join(map(str, c)) for c in skeleton.colors))
+
+        self.db.execute("INSERT OR REPLACE INTO figures VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (path, mtime, skeleton.name, len(skeleton),
+                         max_x - min_x, max_y - min_y, colors, renderThumbnail(skeleton)))
+        return True
+
+    def search(self, text="", limit=50):
+        """
+        Entries whose figure name or file name contains _text_
+        """
+        # match _text_ literally, wildcards included
+        escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = f"%{escaped}%"
+        rows = self.db.execute(
+            "SELECT path, name, bone_count, width, height, colors FROM figures "
+            "WHERE name LIKE ? ESCAPE '\\' OR path LIKE ? ESCAPE '\\' "
+            "ORDER BY name COLLATE NOCASE LIMIT ?",
+            (pattern, pattern, limit))
+        return [CatalogEntry(*row) for row in rows]
+
+    def thumbnail(self, path, size=None):
+        """
+        The cached thumbnail as a Surface, scaled down to fit _size_ if
+        given, or None
+        """
+        row = self.db.execute("SELECT thumbnail FROM figures WHERE path = ?",
+                              (path,)).fetchone()
+        if not row or row[0] is None:
+            return None
+        thumb = pg.image.load(io.BytesIO(row[0]), "thumb.png")
+        if size is None:
+            return thumb
+        scale = min(1, size[0] / thumb.get_width(), size[1] / thumb.get_height())
+        return pg.transform.smoothscale(thumb, (max(1, int(thumb.get_width() * scale)),
+                                                max(1, int(thumb.get_height() * scale))))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM figures").fetchone()[0]
+
+
+def scanLibrary(db_fname=const.CATALOG_DB, dirs=const.LIBRARY_DIRS):
+    """
+    Scans with a connection of its own, so it can run on a worker thread
+    """
+    catalog = Catalog(db_fname)
+    try:
+        return catalog.scan(dirs)
+    finally:
+        catalog.close()
@@ -30,3 +30,83 @@ COL_BUT_OUTLINE = (74, 195, 154)
 COL_FONT = (16, 16, 16)
 
 ANTIALIAS_LINES =  True
+
+# undo/redo memory cap, in bytes (see history.py)
+HISTORY_BYTE_BUDGET = 4 * 1024 * 1024
+
+# timeline storage codec (see framecodec.py)
+CODEC_ANGLE_PRECISION = 0.01    # degrees
+CODEC_POS_PRECISION = 0.1       # pixels
+CODEC_BLOCK_SIZE = 256          # frames per compressed block
+
+# background figure loading (see assets.py)
+LOADER_WORKERS = 4
+LOADER_DRAIN_MS = 4     # main-thread time per tick spent on finished loads
+
+# figure library index (see catalog.py)
+CATALOG_DB = "catalog.sqlite"
+LIBRARY_DIRS = (".",)
+THUMBNAIL_SIZE = (64, 64)
+LIBRARY_RESULTS = 5     # search results listed in the side panel
+LIBRARY_ICON_SIZE = (18, 18)    # thumbnails beside the results
+
+# joint trajectories (see motionpath.py)
+MOTION_PATH_CHUNK = 256         # frames recomputed together
+COL_MOTION_PATH = (190, 60, 150)
+
+# level of detail (see lod.py); figure heights in on-screen pixels
+LOD_FULL_PX = 120
+LOD_SIMPLE_PX = 60
+LOD_LINES_PX = 20
+LOD_CROWD = 50                  # each multiple of this many figures drops a level
+LOD_SPRITE_CACHE = 256          # cached figure sprites
+LOD_SPRITE_ANGLE_STEP = 2.0     # degrees; poses this close share a sprite
+
+# stage viewport (see viewport.py)
+VIEW_ZOOM_MIN = 0.1
+VIEW_ZOOM_MAX = 8.0
+VIEW_ZOOM_STEP = 1.25           # per mouse wheel notch
+VIEW_CULL_PAD = 10              # stage pixels drawn beyond a bone's line (joint caps)
+TILE_SIZE = 256                 # background tile edge, stage pixels
+TILE_CACHE = 1024               # tiles kept per cache (source, scaled)
+BACKGROUND_TILES = "tiles"      # directory of <tx>_<ty>.png; grid if missing
+COL_STAGE_GRID = (0xcc, 0xcc, 0xcc)
+
+# autosave journal (see journal.py)
+AUTOSAVE_DIR = "autosave"
+AUTOSAVE_FLUSH_S = 1.0          # idle time before queued records are synced to disk
+AUTOSAVE_COMPACT_RECORDS = 10000
+AUTOSAVE_COMPACT_S = 120        # compact at least this often while editing
+
+# BVH motion capture import (see bvh.py)
+BVH_PLANE = "xy"                # projection plane: front view
+BVH_FIGURE_HEIGHT = 300         # rest pose height, pixels
+BVH_CHUNK = 4096                # motion frames converted at once
+
+# timeline playback (see playback.py)
+PLAYBACK_RING = 32              # frames rendered ahead of the playhead
+
+# keyframe reduction (see keyframes.py)
+KEYFRAME_ANGLE_TOLERANCE = 0.5  # degrees
+KEYFRAME_POS_TOLERANCE = 0.5    # pixels
+
+# export rendering (see raster.py)
+EXPORT_BACKEND = "pygame"       # or "numpy": anti-aliased, slower
+RASTER_BATCH = 16               # frames rasterized together by the numpy backend
+
+# secondary motion (see secondary.py)
+SECONDARY_GRAVITY = 1600        # pixels/s^2, about 9.8 m/s^2 for a 300 pixel figure
+SECONDARY_DAMPING = 0.05        # fraction of the velocity lost per frame
+SECONDARY_STIFFNESS = 0.2       # pull towards the animated pose per frame
+
+# SVG export (see svgexport.py)
+SVG_CHUNK = 256                 # frames posed and written per step / per process job
+
+# memory accounting (see memstats.py)
+MEMORY_BUDGET = 256 * 1024 * 1024   # bytes; the overlay's total turns red past it
+MEMORY_OVERLAY_TICKS = FPS      # between refreshes of the overlay's report
+MEMORY_TRACE_TICKS = 30         # between tracemalloc snapshots
+MEMORY_TRACE_TOP = 5            # growing lines listed per diff
+COL_MEMORY_TEXT = (240, 240, 240)
+COL_MEMORY_OVER = (255, 90, 90)
+COL_MEMORY_BG = (0, 0, 0, 170)
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+"""
+Animated GIF / APNG export of a figure's stored timeline.
+
+Frames are rendered one at a time, mapped onto a single shared palette and
+diffed against the previous frame; only the bounding box of the changed
+pixels is encoded, with unchanged pixels inside it left transparent.
+Encoded frames go straight to the output file, so memory use does not
+depend on the length of the animation.
+"""
+import struct
+import zlib
+import numpy as np
+import pygame as pg
+import const
+import raster
+from framebuffer import FrameBuffer, CopyStats
+
+TRANSPARENT = 255       # palette index reserved for "unchanged"
+CUBE_LEVELS = 6         # 6x6x6 colour cube fills the rest of the palette
+# channel value -> nearest cube level
+CUBE_LEVEL_OF = np.rint(np.arange(256) * (CUBE_LEVELS - 1) / 255).astype(np.uint16)
+
+
+class Palette:
+    """
+    Up to 39 exact colours (background, bone colours) followed by a
+    colour cube for anti-aliased edges. Index 255 is transparent.
+    """
+
+    def __init__(self, exact_colors):
+        exact = list(dict.fromkeys(tuple(c[:3]) for c in exact_colors))
+        n_cube = CUBE_LEVELS ** 3
+        exact = exact[:TRANSPARENT - n_cube]
+
+        self.n_exact = len(exact)
+        levels = np.linspace(0, 255, CUBE_LEVELS).round().astype(np.uint8)
+        cube = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), -1).reshape(-1, 3)
+
+        colors = np.zeros((256, 3), np.uint8)
+        if exact:
+            colors[:self.n_exact] = exact
+        colors[self.n_exact:self.n_exact + n_cube] = cube
+        self.colors = colors
+
+        packed = [(r << 16) | (g << 8) | b for r, g, b in exact]
+        order = np.argsort(packed) if exact else np.zeros(0, np.intp)
+        self.exact_keys = np.asarray(packed, np.uint32)[order]
+        self.exact_indices = order.astype(np.uint8)
+
+    @classmethod
+    def forFigure(cls, figure):
+        return cls([const.BGCOLOR] + [bone.color for bone in figure.bones])
+
+    def quantize(self, pixels):
+        """
+        pixels: uint32 array of 0x..RRGGBB pixels (see framebuffer.FRAME_MASKS);
+        returns uint8 palette indices of the same shape
+        """
+        rgb = pixels & 0xffffff
+        out = (self.n_exact + CUBE_LEVEL_OF[rgb >> 16] * (CUBE_LEVELS ** 2)
+               + CUBE_LEVEL_OF[(rgb >> 8) & 0xff] * CUBE_LEVELS
+               + CUBE_LEVEL_OF[rgb & 0xff]).astype(np.uint8)
+
+        if len(self.exact_keys):
+            pos = np.searchsorted(self.exact_keys, rgb).clip(0, len(self.exact_keys) - 1)
+            hit = self.exact_keys[pos] == rgb
+            out[hit] = self.exact_indices[pos[hit]]
+        return out
+
+    def rgbBytes(self):
+        return self.colors.tobytes()
+
+
+def changedRect(prev, cur):
+    """
+    Bounding box (x, y, w, h) of the pixels that differ between two
+    (w, h) pixel arrays, or None if they are identical
+    """
+    diff = prev != cur
+    cols = np.flatnonzero(diff.any(axis=1))
+    if not len(cols):
+        return None
+    rows = np.flatnonzero(diff.any(axis=0))
+    x, y = cols[0], rows[0]
+    return (int(x), int(y), int(cols[-1] - x + 1), int(rows[-1] - y + 1))
+
+
+def deltaPixels(prev, cur, rect, palette, stats):
+    """
+    Row-major (h, w) palette indices of _rect_ in _cur_, with the pixels
+    that are unchanged since _prev_ made transparent. Only the changed
+    pixels are gathered and quantized.
+    """
+    x, y, w, h = rect
+    region = cur[x:x + w, y:y + h].T
+    changed = prev[x:x + w, y:y + h].T != region
+    indices = np.full((h, w), TRANSPARENT, np.uint8)
+    gathered = region[changed]
+    indices[changed] = palette.quantize(gathered)
+    stats.add(gathered.nbytes + indices.nbytes)
+    return indices
+
+
+### GIF
+
+def lzwEncode(data, min_code_size=8):
+    """
+    Greedy LZW, GIF flavour. Runs of one byte (the transparent "unchanged"
+    pixels of delta frames, background rows) are matched whole: per byte,
+    the codes of the strings c, cc, ccc, ... are kept in order, so the
+    longest match inside a run is looked up instead of walked a byte at a
+    time. Output is the same as matching byte by byte.
+    """
+    data = bytes(data)
+    n = len(data)
+    out = bytearray()
+    if not n:
+        return bytes(out)
+
+    clear = 1 << min_code_size
+    eoi = clear + 1
+    bitbuf = 0
+    nbits = 0
+
+    def reset():
+        # table: (prefix code << 8 | byte) -> code; runs[c]: codes of c * k, k = 1, 2, ...
+        return {}, [[c] for c in range(clear)], eoi + 1, min_code_size + 1
+
+    table, runs, next_code, code_size = reset()
+    bitbuf |= clear << nbits
+    nbits += code_size
+
+    # ends of the runs of equal bytes; ends[j] is past the run holding i
+    values = np.frombuffer(data, np.uint8)
+    ends = np.append(np.flatnonzero(values[1:] != values[:-1]) + 1, n).tolist()
+    j = 0
+
+    i = 0
+    while True:
+        while ends[j] <= i:
+            j += 1
+        c = data[i]
+        known = runs[c]
+        left = ends[j] - i
+        k = min(left, len(known))
+        w = known[k - 1]
+        i += k
+        # the run goes on past the longest known one: c * k is the match;
+        # otherwise the match may go on past the run
+        if k == left:
+            while i < n:
+                code = table.get((w << 8) | data[i])
+                if code is None:
+                    break
+                w = code
+                i += 1
+        if i == n:
+            break
+
+        bitbuf |= w << nbits
+        nbits += code_size
+        while nbits >= 8:
+            out.append(bitbuf & 0xff)
+            bitbuf >>= 8
+            nbits -= 8
+
+        if next_code < 4096:
+            c = data[i]
+            table[(w << 8) | c] = next_code
+            if runs[c][-1] == w:
+                runs[c].append(next_code)
+            if next_code == (1 << code_size) and code_size < 12:
+                code_size += 1
+            next_code += 1
+        else:
+            bitbuf |= clear << nbits
+            nbits += code_size
+            table, runs, next_code, code_size = reset()
+
+    for code in (w, eoi):
+        bitbuf |= code << nbits
+        nbits += code_size
+        if next_code == (1 << code_size) and code_size < 12:
+            code_size += 1
+        next_code += 1
+    while nbits > 0:
+        out.append(bitbuf & 0xff)
+        bitbuf >>= 8
+        nbits -= 8
+    return bytes(out)
+
+
+class GifWriter:
+
+    def __init__(self, fname, size, palette, fps=const.FPS, loop=0):
+        self.file = open(fname, "wb")
+        self.size = size
+        # GIF delays are in centiseconds; most viewers clamp anything below 2
+        self.delay = max(2, round(100 / fps))
+
+        f = self.file
+        f.write(b"GIF89a")
+        f.write(struct.pack("<HHBBB", size[0], size[1], 0xf7, 0, 0))
+        f.write(palette.rgbBytes())
+        f.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+
+    def writeFrame(self, pixels, rect):
+        """
+        pixels: (h, w) uint8 indices covering _rect_ = (x, y, w, h)
+        """
+        f = self.file
+        x, y, w, h = rect
+        # graphic control: disposal 1 (keep), transparent index set
+        f.write(struct.pack("<BBBBHBB", 0x21, 0xf9, 4, 0x05, self.delay, TRANSPARENT, 0))
+        f.write(struct.pack("<BHHHHB", 0x2c, x, y, w, h, 0))
+
+        data = lzwEncode(memoryview(np.ascontiguousarray(pixels)).cast("B"))
+        f.write(b"\x08")
+        for i in range(0, len(data), 255):
+            chunk = data[i:i + 255]
+            f.write(bytes((len(chunk),)) + chunk)
+        f.write(b"\x00")
+
+    def close(self):
+        self.file.write(b"\x3b")
+        self.file.close()
+
+
+### APNG
+
+def pngChunk(tag, data):
+    return (struct.pack(">I", len(data)) + tag + data
+            + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+
+class ApngWriter:
+
+    def __init__(self, fname, size, palette, n_frames, fps=const.FPS, loop=0):
+        self.file = open(fname, "wb")
+        self.size = size
+        self.fps = fps
+        self.seq = 0
+        self.first = True
+
+        f = self.file
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(pngChunk(b"IHDR", struct.pack(">IIBBBBB", size[0], size[1], 8, 3, 0, 0, 0)))
+        f.write(pngChunk(b"PLTE", palette.rgbBytes()))
+        f.write(pngChunk(b"tRNS", b"\xff" * TRANSPARENT + b"\x00"))
+        f.write(pngChunk(b"acTL", struct.pack(">II", n_frames, loop)))
+
+    def writeFrame(self, pixels, rect):
+        """
+        pixels: (h, w) uint8 indices covering _rect_ = (x, y, w, h)
+        """
+        f = self.file
+        x, y, w, h = rect
+        blend = 0 if self.first else 1      # SOURCE for the key frame, OVER after
+        f.write(pngChunk(b"fcTL", struct.pack(">IIIIIHHBB", self.seq, w, h, x, y,
+                                              1, self.fps, 0, blend)))
+        self.seq += 1
+
+        # filter type 0 for every scanline
+        rows = np.zeros((h, w + 1), np.uint8)
+        rows[:, 1:] = pixels
+        data = zlib.compress(rows, 6)
+
+        if self.first:
+            f.write(pngChunk(b"IDAT", data))
+            self.first = False
+        else:
+            f.write(pngChunk(b"fdAT", struct.pack(">I", self.seq) + data))
+            self.seq += 1
+
+    def close(self):
+        self.file.write(pngChunk(b"IEND", b""))
+        self.file.close()
+
+
+### rendering
+
+class FrameEncoder:
+    """
+    Diffs consecutive frames and hands the changed regions to a writer.
+    The array passed to push() is only read during the call and the next
+    one, so it may be a view onto a buffer that is reused afterwards.
+    """
+
+    def __init__(self, writer, palette, size, stats=None):
+        self.writer = writer
+        self.palette = palette
+        self.size = size
+        self.stats = stats if stats is not None else CopyStats()
+        self.prev = None
+
+    def push(self, cur):
+        """
+        cur: (w, h) uint32 pixels of the export rect
+        """
+        if self.prev is None:
+            indices = np.ascontiguousarray(self.palette.quantize(cur.T))
+            self.stats.add(indices.nbytes)
+            self.writer.writeFrame(indices, (0, 0) + tuple(self.size))
+        else:
+            delta = changedRect(self.prev, cur) or (0, 0, 1, 1)
+            self.writer.writeFrame(deltaPixels(self.prev, cur, delta, self.palette,
+                                               self.stats), delta)
+        self.stats.frameDone()
+        self.prev = cur
+
+
+def openWriter(fname, fmt, size, palette, n_frames, fps=const.FPS):
+    if fmt is None:
+        fmt = fname.rsplit(".", 1)[-1].lower()
+
+    if fmt == "gif":
+        return GifWriter(fname, size, palette, fps)
+    elif fmt in ("png", "apng"):
+        return ApngWriter(fname, size, palette, n_frames, fps)
+    raise ValueError(f"export: unknown format '{fmt}'")
+
+
+def renderFrame(figure, frame, surface):
+    figure.setFrame(frame)
+    surface.fill(const.BGCOLOR)
+    figure.root.drawAll(surface)
+
+
+def exportAnimation(figure, fname, fmt=None, frames=None, rect=const.EXPORT_RECT,
+                    fps=const.FPS, stats=None, backend=const.EXPORT_BACKEND, progress=None):
+    """
+    Renders _frames_ (default: the whole timeline) of _figure_, cropped to
+    _rect_, into an animated GIF or APNG. fmt defaults to the file extension.
+    The figure's live pose is restored afterwards.
+
+    Frames alternate between two FrameBuffers, so the previous frame is
+    still in place to diff against and no pixels are copied out of either.
+    stats: optional CopyStats, filled with the bytes copied per frame
+    backend: "pygame" draws each frame like the editor does; "numpy"
+             draws anti-aliased edges, and is slower (see raster.py)
+    progress: optional callable (frames done, total), called after each frame
+    """
+    if frames is None:
+        frames = range(figure.frameCount())
+    frames = list(frames)
+    if backend not in ("pygame", "numpy"):
+        raise ValueError(f"export: unknown backend '{backend}'")
+
+    rect = pg.Rect(rect)
+    palette = Palette.forFigure(figure)
+    writer = openWriter(fname, fmt, rect.size, palette, len(frames), fps)
+    encoder = FrameEncoder(writer, palette, rect.size, stats)
+
+    if backend == "numpy":
+        try:
+            for i, pixels in enumerate(raster.renderTimeline(figure, frames, rect), 1):
+                encoder.push(pixels)
+                if progress:
+                    progress(i, len(frames))
+        finally:
+            writer.close()
+        return
+
+    buffers = (FrameBuffer(const.CANVAS_DIM), FrameBuffer(const.CANVAS_DIM))
+    saved_pose = figure.getPose()
+
+    try:
+        for i, frame in enumerate(frames):
+            target = buffers[i % 2]
+            renderFrame(figure, frame, target.surface)
+            encoder.push(target.pixels(rect))
+            if progress:
+                progress(i + 1, len(frames))
+    finally:
+        writer.close()
+        figure.setPose(saved_pose)
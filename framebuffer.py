@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Render targets whose pixels can be read in place.
+
+Exporters, encoders and hashing read a FrameBuffer through numpy views
+(pg.surfarray.pixels2d) or the buffer protocol (Surface.get_view), never
+through pg.surfarray.array*/tobytes, which copy the whole frame.
+"""
+import hashlib
+import pygame as pg
+
+# 0x00RRGGBB, so a pixel compares and quantizes as a single integer
+FRAME_MASKS = (0xff0000, 0xff00, 0xff, 0)
+
+
+class CopyStats:
+    """
+    Tallies bytes that had to be copied out of (or derived from) frame
+    pixels. Anything reading a FrameBuffer should report its copies here.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes_copied = 0
+
+    def add(self, nbytes):
+        self.bytes_copied += nbytes
+
+    def frameDone(self):
+        self.frames += 1
+
+    @property
+    def bytes_per_frame(self):
+        return self.bytes_copied / self.frames if self.frames else 0
+
+    def __str__(self):
+        return f"{self.frames} frames, {self.bytes_per_frame:.0f} bytes copied/frame"
+
+
+class FrameBuffer:
+
+    def __init__(self, size):
+        self.size = size
+        self.surface = pg.Surface(size, 0, 32, FRAME_MASKS)
+        self._pixels = None
+
+    def pixels(self, rect=None):
+        """
+        (w, h) uint32 numpy view onto the surface; slicing to _rect_ is
+        still a view. The surface stays locked while views exist, which
+        rules out blitting onto it, but pg.draw and fill still work.
+        """
+        if self._pixels is None:
+            self._pixels = pg.surfarray.pixels2d(self.surface)
+        if rect is None:
+            return self._pixels
+        x, y, w, h = rect
+        return self._pixels[x:x + w, y:y + h]
+
+    def buffer(self):
+        """
+        The raw pixel bytes (rows padded to the surface pitch) as a
+        BufferProxy; usable anywhere the buffer protocol is accepted
+        """
+        return self.surface.get_view("1")
+
+    def digest(self):
+        return hashlib.blake2b(self.buffer(), digest_size=16).digest()
+
+    def release(self):
+        """
+        Drops the cached view, unlocking the surface (e.g. before a blit)
+        """
+        self._pixels = None
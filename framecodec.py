@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""
+Compact storage for animation timelines.
+
+A timeline is a set of channels (one angle channel per bone, followed by
+the root's x and y translation channels), each holding one value per frame.
+Values are quantized to a fixed precision, delta-encoded along the time
+axis and zlib-compressed in blocks of block_size frames. Every block starts
+with absolute values, so any block (and hence any frame) can be decoded on
+its own.
+"""
+import struct
+import sys
+import zlib
+from array import array
+import numpy as np
+import const
+
+MAGIC = b"BTL1"
+HEADER = struct.Struct("<4sIIIIdd")     # magic, channels, pos channels, frames, block size, precisions
+BLOCK_ENTRY = struct.Struct("<QI")      # offset, length
+
+# narrowest array typecode first; 'q' always fits
+DELTA_TYPECODES = (("b", 1 << 7), ("h", 1 << 15), ("i", 1 << 31), ("q", 1 << 63))
+
+
+def pickTypecode(values):
+    if not values:
+        return "b"
+    peak = max(max(values), -min(values) - 1)
+    for typecode, limit in DELTA_TYPECODES:
+        if peak < limit:
+            return typecode
+    raise OverflowError("frame codec: delta out of range")
+
+
+def toLittleEndian(arr):
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+class FrameCodec:
+    """
+    angle_precision: quantization step for angle channels (degrees)
+    pos_precision: quantization step for translation channels (pixels)
+    """
+
+    def __init__(self, angle_precision=const.CODEC_ANGLE_PRECISION,
+                 pos_precision=const.CODEC_POS_PRECISION,
+                 block_size=const.CODEC_BLOCK_SIZE, level=6):
+        self.angle_precision = angle_precision
+        self.pos_precision = pos_precision
+        self.block_size = block_size
+        self.level = level
+
+    def encode(self, channels, pos_channels=2):
+        """
+        channels: sequence of equal-length per-frame value sequences; the last
+                  pos_channels of them are translations
+        Returns an EncodedTimeline
+        """
+        n_channels = len(channels)
+        n_frames = len(channels[0]) if channels else 0
+        steps = [self.angle_precision] * (n_channels - pos_channels) \
+                + [self.pos_precision] * pos_channels
+
+        quantized = [[round(v / step) for v in channel]
+                     for channel, step in zip(channels, steps)]
+
+        blocks = []
+        for start in range(0, n_frames, self.block_size):
+            end = min(start + self.block_size, n_frames)
+            blocks.append(self.encodeBlock(quantized, start, end))
+
+        return EncodedTimeline(n_channels, pos_channels, n_frames, self.block_size,
+                               self.angle_precision, self.pos_precision, blocks)
+
+    def encodeBlock(self, quantized, start, end):
+        firsts = array("q")
+        deltas = []
+        # channel-major, so runs of small deltas of one bone sit together
+        for channel in quantized:
+            firsts.append(channel[start])
+            prev = channel[start]
+            for q in channel[start + 1:end]:
+                deltas.append(q - prev)
+                prev = q
+
+        typecode = pickTypecode(deltas)
+        payload = typecode.encode() + toLittleEndian(firsts).tobytes() \
+                  + toLittleEndian(array(typecode, deltas)).tobytes()
+        return zlib.compress(payload, self.level)
+
+    def encodeFigure(self, figure):
+        return self.encode(figureChannels(figure))
+
+
+class TimelineWriter:
+    """
+    Encodes a timeline handed over a chunk of frames at a time, holding at
+    most one block of raw values; the output is the same as encode()'s.
+    Vectorized with numpy, for importers of long captures.
+    """
+
+    def __init__(self, codec, n_channels, pos_channels=2):
+        self.codec = codec
+        self.n_channels = n_channels
+        self.pos_channels = pos_channels
+        self.steps = np.array([codec.angle_precision] * (n_channels - pos_channels)
+                              + [codec.pos_precision] * pos_channels)[:, None]
+        self.pending = np.empty((n_channels, 0), dtype=np.int64)
+        self.n_frames = 0
+        self.blocks = []
+
+    def append(self, channels):
+        """
+        channels: (channels, frames) array of values
+        """
+        quantized = np.round(np.asarray(channels, dtype=np.float64) / self.steps).astype(np.int64)
+        self.pending = np.concatenate((self.pending, quantized), axis=1)
+        self.n_frames += quantized.shape[1]
+
+        size = self.codec.block_size
+        while self.pending.shape[1] >= size:
+            self.blocks.append(self.encodeBlock(self.pending[:, :size]))
+            self.pending = self.pending[:, size:]
+
+    def encodeBlock(self, quantized):
+        deltas = np.diff(quantized, axis=1)
+        typecode = pickTypecode([int(deltas.max()), int(deltas.min())] if deltas.size else [])
+        dtype = np.dtype(typecode).newbyteorder("<")
+        payload = typecode.encode() + quantized[:, 0].astype("<i8").tobytes() \
+                  + deltas.astype(dtype).tobytes()
+        return zlib.compress(payload, self.codec.level)
+
+    def finish(self):
+        """
+        Returns the EncodedTimeline
+        """
+        if self.pending.shape[1]:
+            self.blocks.append(self.encodeBlock(self.pending))
+            self.pending = self.pending[:, :0]
+        codec = self.codec
+        return EncodedTimeline(self.n_channels, self.pos_channels, self.n_frames,
+                               codec.block_size, codec.angle_precision, codec.pos_precision,
+                               self.blocks)
+
+
+class EncodedTimeline:
+
+    def __init__(self, n_channels, pos_channels, n_frames, block_size,
+                 angle_precision, pos_precision, blocks):
+        self.n_channels = n_channels
+        self.pos_channels = pos_channels
+        self.n_frames = n_frames
+        self.block_size = block_size
+        self.angle_precision = angle_precision
+        self.pos_precision = pos_precision
+        self.blocks = blocks    # list of compressed bytes
+
+        # the last decoded block, so sequential seeking stays cheap
+        self.cached_index = -1
+        self.cached_block = None
+
+    @property
+    def nbytes(self):
+        return sum(map(len, self.blocks))
+
+    def steps(self):
+        return [self.angle_precision] * (self.n_channels - self.pos_channels) \
+               + [self.pos_precision] * self.pos_channels
+
+    def blockLength(self, index):
+        return min(self.block_size, self.n_frames - index * self.block_size)
+
+    def decodeBlock(self, index):
+        """
+        Returns the block as a list of per-channel value lists
+        """
+        if index == self.cached_index:
+            return self.cached_block
+
+        payload = zlib.decompress(self.blocks[index])
+        typecode = chr(payload[0])
+        n = self.n_channels
+
+        firsts = array("q")
+        firsts.frombytes(payload[1:1 + 8 * n])
+        deltas = array(typecode)
+        deltas.frombytes(payload[1 + 8 * n:])
+        toLittleEndian(firsts)
+        toLittleEndian(deltas)
+
+        span = self.blockLength(index) - 1
+        channels = []
+        for c, step in enumerate(self.steps()):
+            q = firsts[c]
+            values = [q * step]
+            for d in deltas[c * span:(c + 1) * span]:
+                q += d
+                values.append(q * step)
+            channels.append(values)
+
+        self.cached_index = index
+        self.cached_block = channels
+        return channels
+
+    def frame(self, frame_index):
+        """
+        Values of every channel at one frame; decodes a single block
+        """
+        if not 0 <= frame_index < self.n_frames:
+            raise IndexError("frame index out of range")
+
+        block_index, offset = divmod(frame_index, self.block_size)
+        return [channel[offset] for channel in self.decodeBlock(block_index)]
+
+    def decodeAll(self):
+        channels = [[] for _ in range(self.n_channels)]
+        for index in range(len(self.blocks)):
+            for out, values in zip(channels, self.decodeBlock(index)):
+                out.extend(values)
+        return channels
+
+    def toBytes(self):
+        header = HEADER.pack(MAGIC, self.n_channels, self.pos_channels, self.n_frames,
+                             self.block_size, self.angle_precision, self.pos_precision)
+        offset = len(header) + BLOCK_ENTRY.size * len(self.blocks)
+        table = []
+        for block in self.blocks:
+            table.append(BLOCK_ENTRY.pack(offset, len(block)))
+            offset += len(block)
+        return b"".join([header] + table + self.blocks)
+
+    @classmethod
+    def fromBytes(cls, data):
+        magic, n_channels, pos_channels, n_frames, block_size, angle_prec, pos_prec = \
+            HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("not an encoded timeline")
+
+        n_blocks = (n_frames + block_size - 1) // block_size
+        blocks = []
+        for i in range(n_blocks):
+            offset, length = BLOCK_ENTRY.unpack_from(data, HEADER.size + i * BLOCK_ENTRY.size)
+            blocks.append(bytes(data[offset:offset + length]))
+
+        return cls(n_channels, pos_channels, n_frames, block_size,
+                   angle_prec, pos_prec, blocks)
+
+    def save(self, fname):
+        with open(fname, "wb") as f:
+            f.write(self.toBytes())
+
+    @classmethod
+    def load(cls, fname):
+        with open(fname, "rb") as f:
+            return cls.fromBytes(f.read())
+
+    def applyToFigure(self, figure):
+        """
+        Replaces the figure's frame lists with the decoded timeline
+        """
+        setFigureChannels(figure, self.decodeAll())
+
+
+def figureChannels(figure):
+    """
+    The figure's timeline as codec channels: one per bone, then root x and y
+    """
+    channels = [bone.frame_angles for bone in figure.bones]
+    channels.append([t[0] for t in figure.root.frame_translations])
+    channels.append([t[1] for t in figure.root.frame_translations])
+    return channels
+
+
+def setFigureChannels(figure, channels):
+    """
+    Inverse of figureChannels
+    """
+    for bone, values in zip(figure.bones, channels):
+        bone.frame_angles = list(values)
+    figure.root.frame_translations = list(zip(channels[-2], channels[-1]))
+    figure.framesChanged(0)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Multi-process export through a ring of shared-memory frame slots.
+
+Render workers rasterize straight into a slot of a SharedMemory block and
+a single writer process encodes the slots in frame order, so no pixels are
+pickled between processes. Each slot has a `free` and a `ready` semaphore:
+a worker blocks on `free` until the writer is done with the slot, which
+keeps the workers at most n_slots frames ahead and peak memory constant.
+
+Frame k always lands in slot k % n_slots, and n_slots is a multiple of the
+worker count, so every slot is only ever written by one worker, in order.
+"""
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import pygame as pg
+import const
+import export
+
+
+class FrameRing:
+
+    def __init__(self, n_slots, size, ctx=mp):
+        self.n_slots = n_slots
+        self.size = tuple(size)
+        self.slot_bytes = self.size[0] * self.size[1] * 4
+        self.shm = shared_memory.SharedMemory(create=True, size=n_slots * self.slot_bytes)
+        self.owner = True
+
+        self.free = [ctx.Semaphore(1) for _ in range(n_slots)]
+        self.ready = [ctx.Semaphore(0) for _ in range(n_slots)]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["shm"] = self.shm.name
+        state["owner"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=state["shm"])
+
+    def slotOf(self, k):
+        return k % self.n_slots
+
+    def slotMemory(self, slot):
+        start = slot * self.slot_bytes
+        return self.shm.buf[start:start + self.slot_bytes]
+
+    def slotSurface(self, slot):
+        """
+        A Surface drawing directly into the slot. Byte order BGRA makes the
+        pixels 0xAARRGGBB, i.e. the same layout as framebuffer.FRAME_MASKS
+        with alpha on top.
+        """
+        return pg.image.frombuffer(self.slotMemory(slot), self.size, "BGRA")
+
+    def slotPixels(self, slot):
+        """
+        (w, h) uint32 view of the slot, as pg.surfarray.pixels2d would give
+        """
+        w, h = self.size
+        return np.ndarray((h, w), np.uint32, buffer=self.shm.buf,
+                          offset=slot * self.slot_bytes).T
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def renderWorker(ring, figure, frames, worker, n_workers):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pg.init()
+
+    surfaces = [ring.slotSurface(slot) if slot % n_workers == worker else None
+                for slot in range(ring.n_slots)]
+
+    for k in range(worker, len(frames), n_workers):
+        slot = ring.slotOf(k)
+        ring.free[slot].acquire()
+        export.renderFrame(figure, frames[k], surfaces[slot])
+        ring.ready[slot].release()
+
+    # surfaces hold exports of the shared buffer; drop them before closing it
+    del surfaces
+    ring.close()
+
+
+def writerProcess(ring, fname, fmt, n_frames, palette, rect, fps):
+    rect = pg.Rect(rect)
+    writer = export.openWriter(fname, fmt, rect.size, palette, n_frames, fps)
+    encoder = export.FrameEncoder(writer, palette, rect.size)
+
+    prev_slot = None
+    for k in range(n_frames):
+        slot = ring.slotOf(k)
+        ring.ready[slot].acquire()
+        encoder.push(ring.slotPixels(slot)[rect.x:rect.right, rect.y:rect.bottom])
+
+        # the previous slot was only kept around to diff against
+        if prev_slot is not None:
+            ring.free[prev_slot].release()
+        prev_slot = slot
+    writer.close()
+
+    encoder = None
+    ring.close()
+
+
+def exportAnimationParallel(figure, fname, fmt=None, frames=None, rect=const.EXPORT_RECT,
+                            fps=const.FPS, workers=None, depth=2):
+    """
+    Same output as export.exportAnimation, rendered by _workers_ processes
+    into a ring of workers * depth slots (at least 2)
+    """
+    if frames is None:
+        frames = range(figure.frameCount())
+    frames = list(frames)
+    workers = workers or os.cpu_count() or 1
+    n_slots = workers * max(depth, 1 if workers > 1 else 2)
+
+    ctx = mp.get_context("spawn")
+    ring = FrameRing(n_slots, const.CANVAS_DIM, ctx)
+    palette = export.Palette.forFigure(figure)
+
+    procs = [ctx.Process(target=renderWorker, args=(ring, figure, frames, i, workers))
+             for i in range(workers)]
+    procs.append(ctx.Process(target=writerProcess,
+                             args=(ring, fname, fmt, len(frames), palette, tuple(rect), fps)))
+    try:
+        for proc in procs:
+            proc.start()
+
+        # a dead worker would leave the writer waiting forever
+        while any(proc.is_alive() for proc in procs):
+            for proc in procs:
+                proc.join(0.1)
+                if proc.exitcode not in (None, 0):
+                    raise RuntimeError(f"framering: {proc.name} exited with {proc.exitcode}")
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+        ring.close()
@@ -305,15 +305,15 @@ class TextInput(GUIElem):
             return
         
 
-        keys = pg.key.get_pressed()
-
         if event.type == pg.KEYDOWN:
 
-            capslock_pressed = pygame.key.get_mods() & pygame.KMOD_CAPS
+            # modifiers from the event, not the keyboard's current state,
+            # so recorded sessions replay the same text
+            capslock_pressed = event.mod & pg.KMOD_CAPS
 
             # alphanumeric input
             if event.key >= ord('a') and event.key <= ord('z'):
-                if capslock_pressed or keys[pg.K_LSHIFT] or keys[pg.K_RSHIFT]:
+                if capslock_pressed or event.mod & pg.KMOD_SHIFT:
                     self.text += chr(event.key - 32)
                 else:
                     self.text += chr(event.key)
@@ -325,7 +325,7 @@ class TextInput(GUIElem):
                 self.text += ' '
             
             # backspace
-            if keys[pg.K_BACKSPACE]:
+            if event.key == pg.K_BACKSPACE:
                 self.text = self.text[:-1]
             
             # invoke callback on keydown
@@ -391,7 +391,15 @@ class TextButton(Button):
     def __init__(self, screen, pos, width, height, text):
         super().__init__(screen, pos, width, height)
         self.text = text
+        self.icon = None
         self.font = self.make_pygame_font()
+
+    def set_icon(self, surface):
+        """
+        Returns self; the icon is drawn left of the text
+        """
+        self.icon = surface
+        return self
     
     def set_font(self, font_name, font_bold=False, font_italic=False):
         self.style.font = font_name
@@ -411,8 +419,15 @@ class TextButton(Button):
         super().draw()
         text_surface = self.font.render(self.text, False, self.style.font_color.raw)
 
+        left, width = self.pos[0], self.rect.width
+        if self.icon is not None:
+            icon_y = int( self.pos[1] + (self.rect.height - self.icon.get_height())/2 )
+            self.screen.blit(self.icon, (left + icon_y - self.pos[1], icon_y))
+            used = self.icon.get_width() + 2 * (icon_y - self.pos[1])
+            left, width = left + used, width - used
+
         # center the text
-        textpos_x = int( self.pos[0] + (self.rect.width - text_surface.get_rect().width)/2 )
+        textpos_x = int( left + (width - text_surface.get_rect().width)/2 )
         textpos_y = int( self.pos[1] + (self.rect.height - text_surface.get_rect().height)/2 )
 
         
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+import sys
+from collections import deque
+import const
+from Bone import WunderGimbal
+
+# delta kinds; a delta is a plain tuple (kind, bone_index, old, new)
+ANGLE = 0           # live angle of a bone
+TRANSLATION = 1     # live (x, y) of the root bone; bone_index is always 0
+FRAME = 2           # a frame appended to the timeline; new = (angles, translation)
+CHANNEL = 3         # stored angles of a bone replaced; old/new are frame_angles lists
+
+
+def deltaSize(delta):
+    """
+    Rough byte cost of one delta, counting the tuple and the values it
+    references. Floats/ints shared with the figure are counted anyway,
+    which errs on the side of evicting early.
+    """
+    size = sys.getsizeof(delta)
+    for value in delta[2:]:
+        size += sys.getsizeof(value)
+        if isinstance(value, (tuple, list)):
+            for item in value:
+                size += sys.getsizeof(item)
+    return size
+
+
+class HistoryEntry:
+    __slots__ = ("deltas", "size")
+
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.size = sys.getsizeof(self) + sys.getsizeof(deltas) \
+                    + sum(map(deltaSize, deltas))
+
+
+class History:
+    """
+    Undo/redo stacks of pose deltas for a single Figure.
+
+    Only the values that actually changed are stored, so undo/redo cost
+    is proportional to the size of the edit. A gimbal drag (press..release)
+    becomes a single entry. When the stored entries exceed byte_budget,
+    the oldest undo entries are dropped.
+    """
+
+    def __init__(self, figure, byte_budget=const.HISTORY_BYTE_BUDGET):
+        self.figure = figure
+        self.byte_budget = byte_budget
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.bytes_used = 0
+
+        # (kind, bone_index) -> value at the start of the current drag
+        self.drag_start = {}
+
+        # callables (deltas, forward) told about every applied entry:
+        # new edits and redos are forward, undos are not
+        self.listeners = []
+
+    ## recording
+
+    def beginDrag(self, gimbals):
+        """
+        gimbals: the gimbals grabbed by the press, see Figure.checkPressed
+        """
+        for gimbal in gimbals:
+            bone = gimbal.bone
+            if isinstance(gimbal, WunderGimbal):
+                self.drag_start[(TRANSLATION, bone.index)] = (bone.pos_x1, bone.pos_y1)
+            else:
+                self.drag_start[(ANGLE, bone.index)] = bone.angle
+
+    def endDrag(self):
+        if not self.drag_start:
+            return
+
+        deltas = []
+        for (kind, index), old in self.drag_start.items():
+            new = self.readValue(kind, index)
+            if new != old:
+                deltas.append((kind, index, old, new))
+        self.drag_start = {}
+
+        if deltas:
+            self.push(deltas)
+
+    def recordFrameAdded(self):
+        """
+        Call after Figure.addFrame
+        """
+        figure = self.figure
+        last = figure.frameCount() - 1
+        angles = tuple(bone.frame_angles[last] for bone in figure.bones)
+        translation = figure.root.frame_translations[last]
+        self.push([(FRAME, last, None, (angles, translation))])
+
+    def replaceChannels(self, channels):
+        """
+        Replaces the stored angles of bones, {bone index: angles}, as a
+        single entry
+        """
+        bones = self.figure.bones
+        deltas = [(CHANNEL, index, bones[index].frame_angles, list(angles))
+                  for index, angles in channels.items()]
+        if deltas:
+            self.applyDeltas(deltas, True)
+            self.push(deltas)
+
+    def addListener(self, listener):
+        self.listeners.append(listener)
+
+    def removeListener(self, listener):
+        self.listeners.remove(listener)
+
+    def notify(self, deltas, forward):
+        for listener in self.listeners:
+            listener(deltas, forward)
+
+    def push(self, deltas):
+        entry = HistoryEntry(deltas)
+        self.undo_stack.append(entry)
+        self.bytes_used += entry.size
+
+        # a new edit invalidates everything that could have been redone
+        for old_entry in self.redo_stack:
+            self.bytes_used -= old_entry.size
+        self.redo_stack.clear()
+
+        self.evict()
+        self.notify(deltas, True)
+
+    def evict(self):
+        # always keep the newest entry, even if it alone exceeds the budget
+        while self.bytes_used > self.byte_budget and len(self.undo_stack) > 1:
+            self.bytes_used -= self.undo_stack.popleft().size
+
+    ## applying
+
+    def readValue(self, kind, index):
+        bone = self.figure.bones[index]
+        if kind == TRANSLATION:
+            return (bone.pos_x1, bone.pos_y1)
+        return bone.angle
+
+    def applyDelta(self, delta, forward):
+        kind, index, old, new = delta
+        value = new if forward else old
+        figure = self.figure
+
+        if kind == ANGLE:
+            figure.bones[index].angle = value
+        elif kind == TRANSLATION:
+            figure.root.pos_x1, figure.root.pos_y1 = value
+        elif kind == FRAME:
+            if forward:
+                angles, translation = new
+                for bone, angle in zip(figure.bones, angles):
+                    bone.frame_angles.append(angle)
+                figure.root.frame_translations.append(translation)
+            else:
+                for bone in figure.bones:
+                    del bone.frame_angles[index]
+                del figure.root.frame_translations[index]
+            figure.framesChanged(index)
+        elif kind == CHANNEL:
+            # a copy: the entry's list must not follow later edits
+            figure.bones[index].frame_angles = list(value)
+
+    def applyDeltas(self, deltas, forward):
+        for delta in deltas if forward else reversed(deltas):
+            self.applyDelta(delta, forward)
+        # one notification for all the replaced channels
+        if any(delta[0] == CHANNEL for delta in deltas):
+            self.figure.framesChanged(0)
+
+    def canUndo(self):
+        return bool(self.undo_stack)
+
+    def canRedo(self):
+        return bool(self.redo_stack)
+
+    def undo(self):
+        if not self.undo_stack:
+            return False
+
+        entry = self.undo_stack.pop()
+        self.applyDeltas(entry.deltas, False)
+        self.redo_stack.append(entry)
+        self.notify(entry.deltas, False)
+        return True
+
+    def redo(self):
+        if not self.redo_stack:
+            return False
+
+        entry = self.redo_stack.pop()
+        self.applyDeltas(entry.deltas, True)
+        self.undo_stack.append(entry)
+        self.evict()
+        self.notify(entry.deltas, True)
+        return True
+
+    def __len__(self):
+        return len(self.undo_stack)
@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+"""
+Append-only autosave journal.
+
+The main thread only packs small edit records and queues them, and for
+changed frames just their range; a writer thread reads those frames off
+the figure, appends the records to the journal file and keeps a shadow
+copy of the figure's state up to date. Compaction rewrites the journal as a single
+snapshot of that shadow state, so it never touches the figure and never
+blocks the main loop, however long the timeline.
+
+A journal file is MAGIC, the bone count, then records of
+
+    kind (u8), payload length (u32), crc32 of payload (u32), payload
+
+and always starts with a SNAPSHOT. On startup the snapshot and every
+intact record after it are replayed; a torn record at the end (from a
+crash mid-write) ends the replay.
+"""
+import hashlib
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+import const
+import framecodec
+import history
+
+MAGIC = b"BJN1"
+FILE_HEADER = struct.Struct("<4sI")     # magic, bones
+RECORD = struct.Struct("<BII")          # kind, payload length, crc32
+
+# record kinds
+SNAPSHOT = 0        # channel count, channel lengths, channel values, live pose
+ANGLE = 1           # live angle of one bone
+TRANSLATION = 2     # live root position
+FRAMES = 3          # stored frames [start, end) replaced, timeline now `total` long
+
+ANGLE_RECORD = struct.Struct("<Id")
+TRANSLATION_RECORD = struct.Struct("<dd")
+FRAMES_HEADER = struct.Struct("<III")   # start, end, total
+
+READ_CHUNK = 1 << 14    # values copied per step when reading a figure
+
+
+def journalPath(figure_file, dirname=const.AUTOSAVE_DIR):
+    """
+    Journal of a figure file; the path hash keeps equally named files apart
+    """
+    path = os.path.abspath(figure_file)
+    digest = hashlib.sha1(path.encode()).hexdigest()[:8]
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(dirname, f"{name}-{digest}.journal")
+
+
+def doubles(values):
+    return framecodec.toLittleEndian(array("d", values)).tobytes()
+
+
+def readDoubles(data):
+    values = array("d")
+    values.frombytes(data)
+    return framecodec.toLittleEndian(values)
+
+
+def toArray(values, chunk=READ_CHUNK):
+    """
+    array("d") of _values_, built in chunks that each end by yielding the
+    GIL, so a long timeline never stalls the main loop
+    """
+    if isinstance(values, array):
+        return array("d", values)
+    out = array("d")
+    for i in range(0, len(values), chunk):
+        out.extend(values[i:i + chunk])
+        time.sleep(0)
+    return out
+
+
+def readChannels(figure, start=0, end=None, chunk=READ_CHUNK):
+    """
+    Frames [start, end) of the figure's timeline channels (see
+    framecodec.figureChannels) as arrays, read a chunk at a time, each
+    ending by yielding the GIL, so a long timeline never stalls the main
+    loop. Channels changing meanwhile can come out of different lengths.
+    """
+    def read(values, pick=None):
+        stop = len(values) if end is None else min(end, len(values))
+        out = array("d")
+        for i in range(start, stop, chunk):
+            part = values[i:min(i + chunk, stop)]
+            out.extend(part if pick is None else [t[pick] for t in part])
+            if i + chunk < stop:
+                time.sleep(0)
+        return out
+
+    channels = [read(bone.frame_angles) for bone in figure.bones]
+    translations = figure.root.frame_translations
+    return channels + [read(translations, 0), read(translations, 1)]
+
+
+class JournalState:
+    """
+    What a journal describes: the timeline channels (see
+    framecodec.figureChannels) and the live pose
+    """
+
+    def __init__(self, channels, angles, translation):
+        self.channels = [toArray(c) for c in channels]
+        self.angles = array("d", angles)
+        self.translation = tuple(translation)
+
+    @classmethod
+    def fromFigure(cls, figure):
+        """
+        Reads the figure a chunk at a time. Meant for the writer thread:
+        the figure may change while it is read, but every change is also
+        queued as a record of absolute values, and replaying those over
+        the result makes it exact. Copying up front on the main thread
+        would instead stall it, if only for the GC scanning the copies.
+        """
+        angles, translation = figure.getPose()
+        return cls(readChannels(figure), angles, translation)
+
+    def frameCount(self):
+        return len(self.channels[0]) if self.channels else 0
+
+    def applyToFigure(self, figure):
+        framecodec.setFigureChannels(figure, self.channels)
+        figure.setPose((list(self.angles), self.translation))
+
+    def apply(self, kind, payload):
+        if kind == ANGLE:
+            index, value = ANGLE_RECORD.unpack(payload)
+            self.angles[index] = value
+        elif kind == TRANSLATION:
+            self.translation = TRANSLATION_RECORD.unpack(payload)
+        elif kind == FRAMES:
+            start, end, total = FRAMES_HEADER.unpack_from(payload)
+            values = readDoubles(payload[FRAMES_HEADER.size:])
+            span = end - start
+            self.applyFrames(start, end, total,
+                             [values[c * span:(c + 1) * span] for c in range(len(self.channels))])
+
+    def applyFrames(self, start, end, total, values):
+        """
+        values: the new frames [start, end) of each channel
+        """
+        for channel, new in zip(self.channels, values):
+            del channel[total:]
+            channel.extend([0.0] * (total - len(channel)))
+            channel[start:end] = new
+
+    def snapshot(self):
+        """
+        SNAPSHOT payload as a list of buffers, so a long timeline is never
+        copied into one big bytes object
+        """
+        # channels read off a changing figure can briefly differ in length,
+        # until the records queued meanwhile are applied; store each one
+        lengths = [len(self.channels)] + [len(c) for c in self.channels]
+        parts = [struct.pack(f"<{len(lengths)}I", *lengths)]
+        for channel in self.channels:
+            if sys.byteorder == "big":
+                channel = framecodec.toLittleEndian(array("d", channel))
+            parts.append(memoryview(channel).cast("B"))
+        parts.append(doubles(list(self.angles) + list(self.translation)))
+        # not compressed: animation curves barely shrink under zlib, and it
+        # would make compaction an order of magnitude slower
+        return parts
+
+    @classmethod
+    def fromSnapshot(cls, payload):
+        n_channels, = struct.unpack_from("<I", payload)
+        lengths = struct.unpack_from(f"<{n_channels}I", payload, 4)
+        values = readDoubles(payload[4 * (n_channels + 1):])
+
+        channels, offset = [], 0
+        for length in lengths:
+            channels.append(values[offset:offset + length])
+            offset += length
+        pose = values[offset:]
+        return cls(channels, pose[:-2], pose[-2:])
+
+
+def writeRecord(f, kind, parts):
+    """
+    Writes a record whose payload is the concatenation of _parts_
+    """
+    crc = 0
+    for part in parts:
+        crc = zlib.crc32(part, crc)
+    f.write(RECORD.pack(kind, sum(map(len, parts)), crc))
+    for part in parts:
+        f.write(part)
+
+
+def readJournal(path):
+    """
+    Replays a journal file; returns (JournalState, records applied) or
+    None if it has no intact snapshot
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if len(data) < FILE_HEADER.size or data[:4] != MAGIC:
+        return None
+
+    state = None
+    applied = 0
+    offset = FILE_HEADER.size
+    while offset + RECORD.size <= len(data):
+        kind, length, crc = RECORD.unpack_from(data, offset)
+        payload = data[offset + RECORD.size:offset + RECORD.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break   # torn write; everything before it is good
+        offset += RECORD.size + length
+
+        if state is None:
+            if kind != SNAPSHOT:
+                return None
+            state = JournalState.fromSnapshot(payload)
+        else:
+            state.apply(kind, payload)
+        applied += 1
+
+    return (state, applied) if state else None
+
+
+class Journal:
+
+    def __init__(self, path, figure, history=None):
+        """
+        Starts journaling _figure_ to _path_, replacing whatever is there;
+        see recover() to pick up an existing journal first.
+        history: the figure's History; live pose edits are journaled
+                 as its entries are applied
+        """
+        self.path = path
+        self.figure = figure
+        self.history = history
+        self.queue = queue.SimpleQueue()
+        self.error = None
+
+        # writer thread only
+        self.state = None
+        self.file = None
+        self.records = 0        # since the last snapshot
+        self.compacted_at = 0.0
+        self.dirty = False
+
+        figure.addFrameListener(self.onFramesChanged)
+        if history is not None:
+            history.addListener(self.onHistory)
+
+        self.thread = threading.Thread(target=self.run, name="autosave", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def recover(cls, path, figure):
+        """
+        Loads the state saved in the journal at _path_ into _figure_, if
+        there is one that fits it; returns the number of frames recovered
+        or None
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            result = readJournal(path)
+        except (OSError, ValueError, struct.error) as error:
+            print(f"Autosave: could not read {path}: {error}")
+            return None
+        if result is None:
+            return None
+
+        state, _ = result
+        if len(state.channels) != len(figure.bones) + 2:
+            print(f"Autosave: {path} is for a different figure, ignored")
+            return None
+        # a crash can separate a snapshot from the records evening it out
+        n_frames = min(map(len, state.channels))
+        for channel in state.channels:
+            del channel[n_frames:]
+        state.applyToFigure(figure)
+        return state.frameCount()
+
+    ## main thread
+
+    def onFramesChanged(self, start, end=None):
+        # the writer thread reads the frames (see appendFrames); a whole
+        # timeline changed at once would stall the main loop to copy here
+        self.queue.put((FRAMES, (start, end)))
+
+    def onHistory(self, deltas, forward):
+        for kind, index, old, new in deltas:
+            value = new if forward else old
+            if kind == history.ANGLE:
+                self.queue.put((ANGLE, ANGLE_RECORD.pack(index, value)))
+            elif kind == history.TRANSLATION:
+                self.queue.put((TRANSLATION, TRANSLATION_RECORD.pack(*value)))
+            # FRAME and CHANNEL deltas reach us through onFramesChanged
+
+    def close(self):
+        """
+        Writes out everything queued as a final snapshot and stops
+        """
+        self.figure.removeFrameListener(self.onFramesChanged)
+        if self.history is not None:
+            self.history.removeListener(self.onHistory)
+        self.queue.put(None)
+        self.thread.join()
+
+    ## writer thread
+
+    def run(self):
+        self.state = JournalState.fromFigure(self.figure)
+        self.compact()
+        while True:
+            try:
+                item = self.queue.get(timeout=const.AUTOSAVE_FLUSH_S)
+            except queue.Empty:
+                self.sync()
+                if self.records and \
+                        time.monotonic() - self.compacted_at > const.AUTOSAVE_COMPACT_S:
+                    self.compact()
+                continue
+
+            if item is None:
+                break
+            if item[0] == FRAMES:
+                self.appendFrames(*item[1])
+            else:
+                self.append(*item)
+            if self.records >= const.AUTOSAVE_COMPACT_RECORDS:
+                self.compact()
+
+        self.compact()
+        if self.file:
+            self.file.close()
+
+    def append(self, kind, payload):
+        self.state.apply(kind, payload)
+        self.write(kind, [payload])
+
+    def appendFrames(self, start, end):
+        """
+        Records frames [start, end) as the figure has them by now. Any
+        change after this one queues a record of its own, read later
+        still, so the journal ends up exact however late this reads.
+        """
+        total = self.figure.frameCount()
+        end = total if end is None else min(end, total)
+        start = min(start, end)
+        channels = readChannels(self.figure, start, end)
+        # a change under way can leave some channels short; the record it
+        # queues when done rewrites them
+        end = start + min(map(len, channels))
+        for channel in channels:
+            del channel[end - start:]
+
+        self.state.applyFrames(start, end, total, channels)
+        self.write(FRAMES, [FRAMES_HEADER.pack(start, end, total)]
+                   + [memoryview(framecodec.toLittleEndian(c)).cast("B") for c in channels])
+
+    def write(self, kind, parts):
+        self.records += 1
+        if self.file is None:
+            return
+        try:
+            writeRecord(self.file, kind, parts)
+            self.dirty = True
+        except OSError as error:
+            self.fail(error)
+
+    def sync(self):
+        if not (self.dirty and self.file):
+            return
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError as error:
+            self.fail(error)
+        self.dirty = False
+
+    def compact(self):
+        """
+        Replaces the journal with one snapshot of the shadow state; written
+        to a temporary file first, so a crash leaves either journal intact
+        """
+        tmp = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(FILE_HEADER.pack(MAGIC, len(self.state.channels) - 2))
+                writeRecord(f, SNAPSHOT, self.state.snapshot())
+                f.flush()
+                os.fsync(f.fileno())
+            if self.file:
+                self.file.close()
+            os.replace(tmp, self.path)
+            self.file = open(self.path, "ab")
+        except OSError as error:
+            self.fail(error)
+            return
+
+        self.records = 0
+        self.dirty = False
+        self.compacted_at = time.monotonic()
+
+    def fail(self, error):
+        # keep the shadow state going; the next compaction retries the disk
+        if self.error is None:
+            print(f"Autosave: writing {self.path} failed: {error}")
+        self.error = error
+        if self.file:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+        self.file = None
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+Keyframe reduction of dense timelines.
+
+A dense timeline stores every channel (see framecodec.figureChannels) at
+every frame. Reduction keeps, per channel, only the frames that linear
+interpolation between the kept ones can't reconstruct within a tolerance.
+Starting from every frame, each pass tries to drop every other remaining
+key of every channel at once, and keeps a key only if a frame of the span
+it would merge ends up off by more than the tolerance. Passes alternate
+between odd and even keys until neither drops any more; each one is a
+handful of array operations over the whole timeline.
+
+Angle channels are unwrapped first, so a bone turning through 180 degrees
+interpolates the short way round; reconstructed angles can therefore
+differ from the stored ones by multiples of 360, which draw the same.
+
+    python keyframes.py capture.btl [...]
+
+reduces encoded timelines (see framecodec.py) to capture.bkf files.
+"""
+import os
+import struct
+import sys
+import time
+import zlib
+import numpy as np
+import const
+import framecodec
+import kinematics
+
+MAGIC = b"BKF1"
+HEADER = struct.Struct("<4sIII")    # magic, channels, pos channels, frames
+
+
+def interpolate(values, keys):
+    """
+    values: (channels, frames); keys: same-shape bool mask, True at least
+    at the first and last frame. Returns values rebuilt from the keys alone.
+    """
+    n_channels, n_frames = values.shape
+    frames = np.arange(n_frames)
+    prev = np.maximum.accumulate(np.where(keys, frames, 0), axis=1)
+    nxt = np.minimum.accumulate(np.where(keys, frames, n_frames - 1)[:, ::-1], axis=1)[:, ::-1]
+    rows = np.arange(n_channels)[:, None]
+    start, end = values[rows, prev], values[rows, nxt]
+    span = nxt - prev
+    t = np.divide(frames - prev, span, out=np.zeros(values.shape), where=span > 0)
+    return start + (end - start) * t
+
+
+class ReductionReport:
+
+    def __init__(self, n_frames, n_channels, n_keys, angle_error, pos_error,
+                 joint_error=None, seconds=0.0):
+        self.n_frames = n_frames
+        self.n_channels = n_channels
+        self.n_keys = n_keys
+        self.angle_error = angle_error      # degrees, worst over all bones and frames
+        self.pos_error = pos_error          # pixels, root translation
+        self.joint_error = joint_error      # pixels, worst bone end point, if known
+        self.seconds = seconds
+
+    @property
+    def ratio(self):
+        return self.n_frames * self.n_channels / self.n_keys if self.n_keys else 0
+
+    def __str__(self):
+        out = f"{self.n_frames} frames x {self.n_channels} channels -> {self.n_keys} keys " \
+              f"({self.ratio:.1f}x), max error {self.angle_error:.3f} deg, {self.pos_error:.3f} px"
+        if self.joint_error is not None:
+            out += f" ({self.joint_error:.2f} px at the joints)"
+        return out + f", {self.seconds:.2f} s"
+
+
+class Keyframes:
+    """
+    A timeline as per-channel keys; frames in between are interpolated
+    """
+
+    def __init__(self, n_frames, pos_channels, frames, values):
+        """
+        frames: per channel, increasing int array of key frames, starting
+                at 0 and ending at n_frames - 1
+        values: per channel, float array of the values at those frames
+        """
+        self.n_frames = n_frames
+        self.pos_channels = pos_channels
+        self.frames = frames
+        self.values = values
+
+    @property
+    def n_channels(self):
+        return len(self.frames)
+
+    @property
+    def n_keys(self):
+        return sum(map(len, self.frames))
+
+    def sample(self, start=0, end=None):
+        """
+        Values at frames [start, end), as a (channels, frames) array
+        """
+        at = np.arange(start, self.n_frames if end is None else end)
+        return np.array([np.interp(at, f, v) for f, v in zip(self.frames, self.values)])
+
+    def decodeAll(self):
+        return [channel.tolist() for channel in self.sample()]
+
+    def applyToFigure(self, figure):
+        """
+        Replaces the figure's frame lists with the interpolated timeline
+        """
+        framecodec.setFigureChannels(figure, self.decodeAll())
+
+    def toBytes(self):
+        counts = np.array([len(f) for f in self.frames], dtype="<u4")
+        payload = counts.tobytes() \
+                  + np.concatenate(self.frames).astype("<u4").tobytes() \
+                  + np.concatenate(self.values).astype("<f8").tobytes()
+        return HEADER.pack(MAGIC, self.n_channels, self.pos_channels, self.n_frames) \
+               + zlib.compress(payload, 6)
+
+    @classmethod
+    def fromBytes(cls, data):
+        magic, n_channels, pos_channels, n_frames = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("not a keyframe timeline")
+
+        payload = zlib.decompress(data[HEADER.size:])
+        counts = np.frombuffer(payload, "<u4", n_channels)
+        n_keys = int(counts.sum())
+        frames = np.frombuffer(payload, "<u4", n_keys, 4 * n_channels).astype(np.int64)
+        values = np.frombuffer(payload, "<f8", n_keys, 4 * (n_channels + n_keys)).astype(np.float64)
+        bounds = np.cumsum(counts)[:-1]
+        return cls(n_frames, pos_channels, np.split(frames, bounds), np.split(values, bounds))
+
+    def save(self, fname):
+        with open(fname, "wb") as f:
+            f.write(self.toBytes())
+
+    @classmethod
+    def load(cls, fname):
+        with open(fname, "rb") as f:
+            return cls.fromBytes(f.read())
+
+
+def reduceChannels(channels, pos_channels=2, angle_tolerance=const.KEYFRAME_ANGLE_TOLERANCE,
+                   pos_tolerance=const.KEYFRAME_POS_TOLERANCE):
+    """
+    channels: (channels, frames) values, the last pos_channels of them
+              translations
+    Returns (Keyframes, ReductionReport)
+    """
+    start = time.perf_counter()
+    values = np.array(channels, dtype=np.float64, ndmin=2)
+    n_channels, n_frames = values.shape
+    n_angles = n_channels - pos_channels
+    if n_frames == 0:
+        raise ValueError("keyframes: empty timeline")
+    values[:n_angles] = np.unwrap(values[:n_angles], period=360, axis=1)
+    tolerance = np.array([angle_tolerance] * n_angles + [pos_tolerance] * pos_channels)[:, None]
+
+    keys = np.ones(values.shape, dtype=bool)
+    parity, idle = 1, 0
+    while idle < 2:
+        # try dropping every other key of every channel at once; the span
+        # each candidate would merge holds no other candidate, so the spans
+        # are checked independently
+        order = np.cumsum(keys, axis=1) - 1
+        last = keys.sum(axis=1, keepdims=True) - 1
+        candidates = keys & (order % 2 == parity) & (order > 0) & (order < last)
+        trial = keys & ~candidates
+
+        excess = (np.abs(interpolate(values, trial) - values) - tolerance).ravel()
+        # flattened row-major, each kept key starts the run of frames up to
+        # the next one
+        flat_trial = trial.ravel()
+        span = np.cumsum(flat_trial) - 1
+        worst = np.maximum.reduceat(excess, np.flatnonzero(flat_trial))
+        removable = candidates.ravel() & (worst[span] <= 0)
+
+        keys = keys & ~removable.reshape(keys.shape)
+        idle = 0 if removable.any() else idle + 1
+        parity ^= 1
+
+    error = np.abs(interpolate(values, keys) - values)
+    frames = [np.flatnonzero(row) for row in keys]
+    result = Keyframes(n_frames, pos_channels, frames,
+                       [values[c, f] for c, f in enumerate(frames)])
+    report = ReductionReport(n_frames, n_channels, int(keys.sum()),
+                             float(error[:n_angles].max(initial=0)),
+                             float(error[n_angles:].max(initial=0)),
+                             seconds=time.perf_counter() - start)
+    return result, report
+
+
+def jointError(rig, dense, reduced, chunk=kinematics.CHUNK_FRAMES):
+    """
+    Worst distance between bone end points posed from two timelines, each
+    a (channels, frames) array of angle channels, then root x and y
+    """
+    worst = 0.0
+    for start in range(0, dense.shape[1], chunk):
+        a, b = (kinematics.batchPositions(rig, t[:-2, start:start + chunk].T,
+                                          t[-2:, start:start + chunk].T)
+                for t in (dense, reduced))
+        worst = max(worst, float(np.hypot(a[..., 2] - b[..., 2], a[..., 3] - b[..., 3]).max()))
+    return worst
+
+
+def reduceFigure(figure, angle_tolerance=const.KEYFRAME_ANGLE_TOLERANCE,
+                 pos_tolerance=const.KEYFRAME_POS_TOLERANCE):
+    """
+    Reduces a Bone-tree figure's stored frames; the report includes the
+    resulting error at the joints. Returns (Keyframes, ReductionReport)
+    """
+    dense = np.array(framecodec.figureChannels(figure), dtype=np.float64)
+    result, report = reduceChannels(dense, 2, angle_tolerance, pos_tolerance)
+    report.joint_error = jointError(figure.getSkeleton(), dense, result.sample())
+    return result, report
+
+
+def main(argv=None):
+    for fname in argv if argv is not None else sys.argv[1:]:
+        timeline = framecodec.EncodedTimeline.load(fname)
+        result, report = reduceChannels(timeline.decodeAll(), timeline.pos_channels)
+        out = os.path.splitext(fname)[0] + ".bkf"
+        result.save(out)
+        print(f"{fname}: {report} -> {out} ({os.path.getsize(out)} bytes, "
+              f"from {os.path.getsize(fname)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+Forward kinematics of 2D bone trees, without pygame.
+
+A rig is anything with per-bone `parents` (-1 for the root; parents come
+before their children), `other_end` flags and `lengths`, e.g. a
+skeleton.Skeleton. Angles mean what Bone.angle means:
+
+    - the root and other_end bones: absolute angle, degrees, y axis up
+    - any other bone: relative to its parent's world angle
+
+A bone starts at its parent's end point, except other_end bones, which
+start at their parent's start point (legs hanging off the torso's far
+end). The root starts at the figure's translation. A circle bone spans
+its two end points like a line bone; it is drawn as a circle through
+both (see circleShapes), and its children start at its far end.
+
+Positions are (x1, y1, x2, y2) per bone, screen coordinates (y down).
+"""
+from math import cos, sin, radians
+import numpy as np
+
+CHUNK_FRAMES = 65536    # frames per step of iterPositions
+
+
+def endPoint(x1, y1, world_angle, length):
+    """
+    Far end of a bone starting at (x1, y1)
+    """
+    ang = radians(world_angle)
+    return x1 + cos(ang) * length, y1 - sin(ang) * length
+
+
+def posePositions(rig, angles, x, y):
+    """
+    Positions of a single pose: [(x1, y1, x2, y2)] per bone. Plain Python;
+    for one pose that beats setting up numpy arrays.
+    """
+    parents, lengths, other_end = rig.parents, rig.lengths, rig.other_end
+    world = [0.0] * len(parents)
+    out = []
+
+    for i, angle in enumerate(angles):
+        parent = parents[i]
+        if parent < 0:
+            x1, y1 = x, y
+        elif other_end[i]:
+            x1, y1 = out[parent][0], out[parent][1]
+        else:
+            x1, y1 = out[parent][2], out[parent][3]
+            angle += world[parent]
+
+        world[i] = angle
+        out.append((x1, y1) + endPoint(x1, y1, angle, lengths[i]))
+    return out
+
+
+def worldAngles(rig, angles):
+    """
+    (frames, bones) Bone.angle values to absolute angles, degrees
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    world = angles.copy()
+    for i, parent in enumerate(rig.parents):
+        if parent >= 0 and not rig.other_end[i]:
+            world[:, i] += world[:, parent]
+    return world
+
+
+def batchPositions(rig, angles, translations, out=None):
+    """
+    Forward kinematics for many frames at once.
+
+    angles: (frames, bones) array of Bone.angle values
+    translations: (frames, 2) root positions
+    out: optional (frames, bones, 4) array to fill, e.g. float32 to halve
+         the memory of long timelines
+    Returns the (frames, bones, 4) array of x1, y1, x2, y2
+    """
+    rad = np.radians(worldAngles(rig, angles))
+    lengths = np.asarray(rig.lengths, dtype=np.float64)
+    # every bone's offset from its start point, all frames in one go
+    dx = np.cos(rad) * lengths
+    dy = np.sin(rad) * -lengths
+
+    if out is None:
+        out = np.empty(rad.shape + (4,))
+    # parents precede children, so one pass over the bones suffices;
+    # every step is vectorized over the frames
+    for i, parent in enumerate(rig.parents):
+        if parent < 0:
+            out[:, i, :2] = translations
+        elif rig.other_end[i]:
+            out[:, i, :2] = out[:, parent, :2]
+        else:
+            out[:, i, :2] = out[:, parent, 2:]
+        out[:, i, 2] = out[:, i, 0] + dx[:, i]
+        out[:, i, 3] = out[:, i, 1] + dy[:, i]
+    return out
+
+
+def iterPositions(rig, angles, translations, chunk=CHUNK_FRAMES, dtype=np.float64):
+    """
+    batchPositions over a long timeline in bounded memory: yields
+    (first frame, (frames, bones, 4) positions) per chunk. The yielded
+    array is reused, copy it to keep it.
+    """
+    n_frames = len(angles)
+    buffer = np.empty((min(chunk, n_frames), len(rig.parents), 4), dtype=dtype)
+    for start in range(0, n_frames, chunk):
+        end = min(start + chunk, n_frames)
+        yield start, batchPositions(rig, angles[start:end], translations[start:end],
+                                    buffer[:end - start])
+
+
+def circleShapes(rig, positions, types):
+    """
+    Circle bones as drawn: returns (bone indices, (frames, circles, 3)
+    array of centre x, centre y, radius)
+    types: per-bone skeleton.BoneType
+    """
+    indices = [i for i, bone_type in enumerate(types) if bone_type.name == "CIRCLE"]
+    ends = positions[:, indices]
+    shapes = np.empty(ends.shape[:2] + (3,), dtype=positions.dtype)
+    shapes[..., 0] = (ends[..., 0] + ends[..., 2]) / 2
+    shapes[..., 1] = (ends[..., 1] + ends[..., 3]) / 2
+    shapes[..., 2] = np.asarray(rig.lengths, dtype=positions.dtype)[indices] / 2
+    return indices, shapes
+
+
+def timelineArrays(figure, start=0, end=None):
+    """
+    Stored frames [start, end) of a Bone-tree figure as arrays:
+    ((frames, bones) angles, (frames, 2) root translations)
+    """
+    angles = np.array([bone.frame_angles[start:end] for bone in figure.bones],
+                      dtype=np.float64).T
+    translations = np.array(figure.root.frame_translations[start:end],
+                            dtype=np.float64).reshape(-1, 2)
+    return angles, translations
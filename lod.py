@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+Level-of-detail rendering for many figures.
+
+Each figure is drawn at a detail level picked from its on-screen height,
+then lowered further when many figures are visible at once:
+
+    FULL    anti-aliased bones, joint caps, gimbals (edited figure only)
+    SIMPLE  plain thick lines with joint caps
+    LINES   1 px lines, no caps
+    SPRITE  a cached image of the whole figure, shared by equal poses
+"""
+from collections import OrderedDict
+from enum import IntEnum
+from itertools import chain
+import pygame as pg
+import const
+from Bone import drawBoneShape
+from skeleton import BoneType
+
+# transparent colour of sprites; colour-keyed RLE surfaces blit far faster
+# than per-pixel alpha ones
+SPRITE_KEY = (255, 0, 255)
+
+
+class Detail(IntEnum):
+    SPRITE = 0
+    LINES = 1
+    SIMPLE = 2
+    FULL = 3
+
+
+class LODPolicy:
+
+    def __init__(self, full_px=const.LOD_FULL_PX, simple_px=const.LOD_SIMPLE_PX,
+                 lines_px=const.LOD_LINES_PX, crowd=const.LOD_CROWD):
+        """
+        *_px: minimum on-screen figure height for each level
+        crowd: every multiple of this many visible figures drops one level
+        """
+        self.full_px = full_px
+        self.simple_px = simple_px
+        self.lines_px = lines_px
+        self.crowd = crowd
+
+    def pick(self, height_px, n_visible=1):
+        if height_px >= self.full_px:
+            level = Detail.FULL
+        elif height_px >= self.simple_px:
+            level = Detail.SIMPLE
+        elif height_px >= self.lines_px:
+            level = Detail.LINES
+        else:
+            level = Detail.SPRITE
+
+        drop = n_visible // self.crowd if self.crowd else 0
+        return Detail(max(Detail.SPRITE, level - drop))
+
+
+def figureSegments(figure):
+    """
+    Drawable bones of a Bone-tree Figure:
+    [(type, color, thickness, length, x1, y1, x2, y2)]
+    """
+    return [(b.type, b.color, b.thickness, b.length, b.pos_x1, b.pos_y1, b.pos_x2, b.pos_y2)
+            for b in figure.bones]
+
+
+def poseSegments(pose, positions=None):
+    """
+    positions: the pose's bone positions, if already known (e.g. from
+               kinematics.batchPositions)
+    """
+    skel = pose.skeleton
+    if positions is None:
+        positions = pose.positions()
+    return [(skel.types[i], skel.colors[i], skel.thicknesses[i], skel.lengths[i]) + tuple(p)
+            for i, p in enumerate(positions)]
+
+
+def segmentBounds(segments):
+    xs = [s[4] for s in segments] + [s[6] for s in segments]
+    ys = [s[5] for s in segments] + [s[7] for s in segments]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def drawSegments(screen, segments, level, offset=(0, 0), scale=1.0):
+    """
+    scale: viewport zoom the segments were transformed with
+    """
+    ox, oy = offset
+    if level >= Detail.SIMPLE:
+        antialias = level == Detail.FULL and const.ANTIALIAS_LINES
+        for bone_type, color, thickness, length, x1, y1, x2, y2 in segments:
+            drawBoneShape(screen, bone_type, color, thickness, length,
+                          x1 + ox, y1 + oy, x2 + ox, y2 + oy, antialias=antialias, scale=scale)
+        return
+
+    for bone_type, color, thickness, length, x1, y1, x2, y2 in segments:
+        if bone_type == BoneType.CIRCLE:
+            center = (int((x1 + x2) / 2 + ox), int((y1 + y2) / 2 + oy))
+            pg.draw.circle(screen, color, center, max(1, int(length / 2)), 1)
+        else:
+            pg.draw.line(screen, color, (x1 + ox, y1 + oy), (x2 + ox, y2 + oy), 1)
+
+
+class SpriteCache:
+    """
+    Rendered figures keyed by skeleton, zoom and pose, with angles rounded
+    to const.LOD_SPRITE_ANGLE_STEP so near-identical poses share a sprite
+    """
+
+    def __init__(self, capacity=const.LOD_SPRITE_CACHE):
+        self.capacity = capacity
+        self.sprites = OrderedDict()    # key -> (surface, offset from root)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, skeleton, angles, zoom):
+        step = const.LOD_SPRITE_ANGLE_STEP
+        return (id(skeleton), zoom) + tuple(round(a / step) for a in angles)
+
+    def get(self, skeleton, angles, segments, root, zoom=1.0):
+        key = self.key(skeleton, angles, zoom)
+        entry = self.sprites.get(key)
+        if entry:
+            self.hits += 1
+            self.sprites.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        min_x, min_y, max_x, max_y = segmentBounds(segments)
+        margin = max(s[2] for s in segments) // 2 + 1
+        surface = pg.Surface((int(max_x - min_x) + 2 * margin, int(max_y - min_y) + 2 * margin))
+        surface.fill(SPRITE_KEY)
+        surface.set_colorkey(SPRITE_KEY, pg.RLEACCEL)
+        drawSegments(surface, segments, Detail.LINES, (margin - min_x, margin - min_y))
+
+        entry = (surface, (min_x - margin - root[0], min_y - margin - root[1]))
+        self.sprites[key] = entry
+        if len(self.sprites) > self.capacity:
+            self.sprites.popitem(last=False)
+        return entry
+
+
+class LODRenderer:
+
+    def __init__(self, policy=None):
+        self.policy = policy or LODPolicy()
+        self.sprites = SpriteCache()
+        self.counts = {level: 0 for level in Detail}    # last frame's levels
+        self.viewport = None    # of the current draw() call
+
+    def draw(self, screen, figures=(), poses=(), editing=None, viewport=None, posed=()):
+        """
+        figures: Bone-tree Figures; poses: skeleton.Pose instances
+        posed: (Pose, segments) pairs whose segments are already computed
+               (see poseSegments)
+        editing: the figure whose gimbals should show (at FULL detail)
+        viewport: stage-to-screen mapping (see viewport.py); figures and
+                  bones outside it are skipped, and levels are picked from
+                  the zoomed size
+        Figures are drawn over poses.
+        """
+        if viewport is not None:
+            figures = viewport.cullFigures(figures)
+            poses = viewport.cullPoses(poses)
+            posed = [entry for entry in posed
+                     if viewport.sees(entry[0].x, entry[0].y, entry[0].skeleton.reach)]
+        self.viewport = viewport
+
+        n_visible = len(figures) + len(poses) + len(posed)
+        for level in self.counts:
+            self.counts[level] = 0
+
+        for pose, segments in chain(((pose, poseSegments(pose)) for pose in poses), posed):
+            segments = self.toScreen(segments)
+            if segments:
+                self.drawOne(screen, segments, self.pick(segments, n_visible),
+                             pose.skeleton, pose.angles, (pose.x, pose.y))
+
+        for figure in figures:
+            segments = self.toScreen(figureSegments(figure))
+            if segments:
+                level = self.pick(segments, n_visible)
+                if figure is editing:
+                    # never hide the handles of the figure being edited
+                    level = max(level, Detail.SIMPLE)
+                self.drawOne(screen, segments, level, figure.getSkeleton(),
+                             [b.angle for b in figure.bones],
+                             (figure.root.pos_x1, figure.root.pos_y1))
+            if figure is editing:
+                figure.root.drawAllExtra(screen, viewport)
+
+    def toScreen(self, segments):
+        if self.viewport is None:
+            return segments
+        return self.viewport.transformSegments(segments)
+
+    def pick(self, segments, n_visible):
+        min_x, min_y, max_x, max_y = segmentBounds(segments)
+        return self.policy.pick(max(max_x - min_x, max_y - min_y), n_visible)
+
+    def drawOne(self, screen, segments, level, skeleton, angles, root):
+        """
+        segments: in screen coordinates; root: the stage position of the root
+        """
+        zoom = 1.0
+        if self.viewport is not None:
+            zoom = self.viewport.zoom
+            root = self.viewport.toScreen(*root)
+
+        if level == Detail.SPRITE and len(segments) < len(skeleton):
+            # partly off screen; a sprite of the visible part can't be shared
+            level = Detail.LINES
+
+        self.counts[level] += 1
+        if level == Detail.SPRITE:
+            surface, (dx, dy) = self.sprites.get(skeleton, angles, segments, root, zoom)
+            screen.blit(surface, (int(root[0] + dx), int(root[1] + dy)))
+        else:
+            drawSegments(screen, segments, level, scale=zoom)
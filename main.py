@@ -1,25 +1,70 @@
 #!/usr/bin/env python
 import pygame as pg
-import Bone
 import const
-import os
-from gui.gui import GUI, Orientation
+from history import History
+from journal import Journal, journalPath
+import export
+import svgexport
+import secondary
+from assets import AssetLoader
+import catalog
+from replay import Recorder
+from motionpath import MotionPaths
+from lod import LODRenderer
+from viewport import DirectoryTiles, TiledBackground, Viewport
+from playback import Playback
+from updater import PoseUpdater
+from memstats import MemoryOverlay
+import sys
+import time
+from gui.gui import GUI, ElemState, Orientation
 from gui.const import POS_UNDEF
 
 # last change: 2020-11-22
 class MainApplication:
 
-    def __init__(self):
+    def __init__(self, figure_files=None, library=True, autosave=True):
+        """
+        figure_files: figures to load (default: command line, or man_figure.xml)
+        library: index and offer the figure library
+        autosave: journal edits of the edited figure, and recover them on start
+        """
         self.running = True
         self.current_frame = 0
         self.mouse_pos = (0, 0)
         
-        self.figure_def = Bone.Figure.fromFile("man_figure.xml")
-        self.current_figure = self.figure_def
+        # the first figure to finish loading becomes the edited one
+        self.figure_def = None
+        self.current_figure = None
+        self.history = None
+        self.autosave = autosave
+        self.journal = None
+        self.figures = []
         self.ctrl_rect: pg.Rect | None = None
+        self.recorder = None
+        self.motion_paths = None
+        self.lod = LODRenderer()
+        self.viewport = Viewport()
+        self.background = TiledBackground(DirectoryTiles(const.BACKGROUND_TILES))
+        self.pan_from = None    # mouse position while middle-dragging the stage
+        self.playback = None
+        # poses of the figures not being edited, computed a tick ahead
+        self.updater = PoseUpdater()
+        self.memory = None      # MemoryOverlay while shown (F3)
+        # running exports: fname -> (Future, [frames done, total])
+        self.exports = {}
 
         self.init_pg()
         self.init_gui()
+
+        self.loader = AssetLoader()
+        self.figure_files = figure_files or sys.argv[1:] or ["man_figure.xml"]
+        self.loader.loadMany(self.figure_files, self.onFigureLoaded)
+
+        self.catalog = None
+        if library:
+            self.catalog = catalog.Catalog()
+            self.loader.submit("library scan", self.onLibraryScanned, catalog.scanLibrary)
         
     def init_pg(self):
         pg.init()
@@ -42,55 +87,363 @@ class MainApplication:
                                     )
         
         but_frame = self.gui.make_text_button(POS_UNDEF, 160, 20, "Add Frame", self.addFrame, ())
-        self.ctrl_container.push_item(but_frame)
+        but_undo = self.gui.make_text_button(POS_UNDEF, 160, 20, "Undo", self.undo, ())
+        but_redo = self.gui.make_text_button(POS_UNDEF, 160, 20, "Redo", self.redo, ())
+        but_gif = self.gui.make_text_button(POS_UNDEF, 160, 20, "Export GIF",
+                                            self.exportAnimation, ("export.gif",))
+        but_apng = self.gui.make_text_button(POS_UNDEF, 160, 20, "Export APNG",
+                                             self.exportAnimation, ("export.png",))
+        but_svg = self.gui.make_text_button(POS_UNDEF, 160, 20, "Export SVG",
+                                            self.exportSVG, ("export.svg",))
+        self.ctrl_container.push_items(but_frame, but_undo, but_redo, but_gif, but_apng, but_svg)
+
+        self.lbl_loading = self.gui.make_label(POS_UNDEF, 160, 16, "")
+        self.ctrl_container.push_item(self.lbl_loading)
+
+        ## figure library: search box followed by the matching figures
+        lib_top = 300
+        self.lib_rect = pg.Rect(const.CANVAS_DIM[0], lib_top,
+                                const.TOTAL_DIM[0] - const.CANVAS_DIM[0],
+                                const.TOTAL_DIM[1] - lib_top)
+        self.lib_container = self.gui.make_container_from_rect(
+                                        self.lib_rect,
+                                        Orientation.VERTICAL
+                                    )
+        self.inp_search = self.gui.make_text_input(POS_UNDEF, 160, 20)\
+                                  .connect(self.searchLibrary)
+        self.lib_container.push_item(self.inp_search)
 
         self.surf_canvas = pg.Surface(list(const.CANVAS_DIM), pg.SRCALPHA, 32)
         self.surf_canvas = self.surf_canvas.convert_alpha()
 
 
         self.gui.add_elem(self.ctrl_container)
+        self.gui.add_elem(self.lib_container)
+
+    def onFigureLoaded(self, figure):
+        self.figures.append(figure)
+        if self.figure_def is None:
+            figure.beginEditing()
+            self.figure_def = figure
+            self.current_figure = figure
+            self.history = History(figure)
+            if self.autosave and figure.getSkeleton().source:
+                self.startJournal(figure)
+
+    def startJournal(self, figure):
+        path = journalPath(figure.getSkeleton().source)
+        frames = Journal.recover(path, figure)
+        if frames is not None:
+            self.current_frame = frames - 1
+            print(f"Recovered {frames} frames from {path}")
+        self.journal = Journal(path, figure, self.history)
+
+    def onLibraryScanned(self, counts):
+        print("Library: %d indexed, %d removed" % counts)
+        self.searchLibrary(self.inp_search.text)
+
+    def searchLibrary(self, text):
+        if self.catalog is None:
+            return
+
+        # keep the search box, replace the results
+        while len(self.lib_container.items) > 1:
+            self.lib_container.pop_item()
+
+        for entry in self.catalog.search(text, const.LIBRARY_RESULTS):
+            but = self.gui.make_text_button(POS_UNDEF, 160, 20, str(entry),
+                                            self.insertFigure, (entry.path,))
+            but.set_icon(self.catalog.thumbnail(entry.path, const.LIBRARY_ICON_SIZE))
+            self.lib_container.push_item(but)
+
+    def insertFigure(self, fname):
+        self.loader.load(fname, self.onFigureLoaded)
+
+    def updateLoadingLabel(self):
+        for fname in [f for f, (future, _) in self.exports.items() if future.done()]:
+            del self.exports[fname]
+        if self.exports:
+            done = sum(state[0] for _, state in self.exports.values())
+            total = sum(state[1] for _, state in self.exports.values())
+            self.lbl_loading.set_text(f"Exporting {done}/{total}")
+        elif self.loader.busy():
+            done, total = self.loader.progress()
+            self.lbl_loading.set_text(f"Loading {done}/{total}")
+        elif self.lbl_loading.text:
+            self.lbl_loading.set_text("")
 
     def addFrame(self):
+        if self.current_figure is None:
+            return
         self.current_figure.addFrame()
+        self.history.recordFrameAdded()
         self.current_frame += 1
         print("FRAMESSSSS")
 
-    def mainloop (self):
+    def undo(self):
+        if self.history is None:
+            return
+        self.history.endDrag()
+        if self.history.undo():
+            self.current_frame = self.current_figure.frameCount() - 1
 
-        while self.running:
-            self.mouse_pos = pg.mouse.get_pos()
+    def redo(self):
+        if self.history is None:
+            return
+        self.history.endDrag()
+        if self.history.redo():
+            self.current_frame = self.current_figure.frameCount() - 1
 
-            for event in pg.event.get():
-                if event.type == pg.QUIT:
-                    self.running = False
-                    break
-                else:
-                    self.gui.update(event, self.mouse_pos)
+    def bakeSecondaryMotion(self):
+        if self.current_figure is None:
+            return
+        self.history.endDrag()
+        n_frames = secondary.bake([self.current_figure], history=self.history)
+        print(f"Baked secondary motion into {n_frames} frames")
 
-                
-                ## TODO: replace this with a scene manager or soemthing
-                if event.type == pg.MOUSEBUTTONDOWN:
-                    self.figure_def.checkPressed(self.mouse_pos)
+    def exportAnimation(self, fname):
+        self.startExport(fname, export.exportAnimation)
 
-                if event.type == pg.MOUSEBUTTONUP:
-                    self.figure_def.root.unselectGimbals()
+    def exportSVG(self, fname):
+        self.startExport(fname, svgexport.exportAnimatedSVG)
+
+    def startExport(self, fname, exporter):
+        """
+        Runs exporter(figure, fname, progress=...) on the loader's pool, on
+        a snapshot of the current figure, so editing goes on meanwhile
+        """
+        if self.current_figure is None or fname in self.exports:
+            return
+        self.history.endDrag()
+        figure = self.current_figure.snapshot()
+        state = [0, figure.frameCount()]
+
+        def progress(done, total):
+            state[0] = done
+
+        def run():
+            exporter(figure, fname, progress=progress)
+            return fname, state[1]
+        self.exports[fname] = (self.loader.submit(fname, self.onExported, run), state)
+
+    def onExported(self, result):
+        fname, n_frames = result
+        print(f"Exported {n_frames} frames to {fname}")
+
+    def toggleMemoryOverlay(self):
+        if self.memory:
+            self.memory.close()
+            self.memory = None
+        else:
+            self.memory = MemoryOverlay(self)
+
+    def toggleRecording(self):
+        if self.recorder:
+            self.recorder.stop(self.figure_def)
+            print(f"Recording saved to {self.recorder.fname}")
+            self.recorder = None
+        elif self.figure_def is not None:
+            # the edited figure is whichever loaded first, not figure_files[0]
+            source = self.figure_def.getSkeleton().source
+            if source is None:
+                print("Can't record: the edited figure wasn't loaded from a file")
+                return
+            fname = "session-%d.jsonl" % int(time.time())
+            self.recorder = Recorder(fname, source, self.figure_def, self.viewport)
+            print(f"Recording to {fname}")
+
+    def toggleMotionPaths(self):
+        if self.motion_paths:
+            self.motion_paths.detach()
+            self.motion_paths = None
+        elif self.figure_def is not None:
+            self.motion_paths = MotionPaths(self.figure_def)
+
+    def togglePlayback(self):
+        if self.playback:
+            self.playback.close()
+            print(f"Playback: {self.playback.hits} frames prefetched, {self.playback.misses} missed")
+            self.playback = None
+        elif self.figures:
+            if self.history is not None:
+                self.history.endDrag()
+            self.playback = Playback(self.figures, self.viewport,
+                                     DirectoryTiles(const.BACKGROUND_TILES))
+
+    def handlePlaybackKey(self, event):
+        """
+        Space pauses, arrows scrub by a frame (a second with shift)
+        """
+        step = const.FPS if event.mod & pg.KMOD_SHIFT else 1
+        if event.key == pg.K_SPACE:
+            self.playback.togglePause()
+        elif event.key == pg.K_LEFT:
+            self.playback.step(-step)
+        elif event.key == pg.K_RIGHT:
+            self.playback.step(step)
+
+    def handleView(self, event):
+        """
+        Mouse wheel zooms around the cursor, middle drag pans, Home resets
+        """
+        over_stage = self.viewport.rect.collidepoint(self.mouse_pos)
+
+        if event.type == pg.MOUSEWHEEL and over_stage:
+            self.viewport.zoomAt(self.mouse_pos, const.VIEW_ZOOM_STEP ** event.y)
+        elif event.type == pg.MOUSEBUTTONDOWN and event.button == 2 and over_stage:
+            self.pan_from = self.mouse_pos
+        elif event.type == pg.MOUSEBUTTONUP and event.button == 2:
+            self.pan_from = None
+        elif event.type == pg.KEYDOWN and event.key == pg.K_HOME:
+            self.viewport.reset()
+
+    def handleKey(self, event):
+        if event.key == pg.K_F9:
+            self.toggleRecording()
+        elif event.key == pg.K_F3:
+            self.toggleMemoryOverlay()
+        elif self.inp_search.state.test(ElemState.FOCUSED):
+            # typed into the search box; only F keys and Ctrl shortcuts apply
+            pass
+        elif event.key == pg.K_m and not event.mod & pg.KMOD_CTRL:
+            self.toggleMotionPaths()
+        elif event.key == pg.K_p and not event.mod & pg.KMOD_CTRL:
+            self.togglePlayback()
+        elif event.key == pg.K_b and not event.mod & pg.KMOD_CTRL:
+            self.bakeSecondaryMotion()
+        elif self.playback:
+            self.handlePlaybackKey(event)
+
+        if not event.mod & pg.KMOD_CTRL:
+            return
+
+        if event.key == pg.K_z and event.mod & pg.KMOD_SHIFT:
+            self.redo()
+        elif event.key == pg.K_z:
+            self.undo()
+        elif event.key == pg.K_y:
+            self.redo()
+
+    def tick(self, events, mouse_pos):
+        """
+        One iteration of the main loop, minus waiting for the next frame
+        """
+        self.mouse_pos = mouse_pos
+        if self.memory:
+            self.memory.tick()
+        # poses of the other figures, computed while the last tick drew;
+        # waits for the worker to be done reading them before anything
+        # can change them
+        poses = self.updater.swap()
+        # figures and their gimbals live in stage coordinates
+        stage_pos = self.viewport.toWorld(*mouse_pos)
+        self.loader.drain()
+        self.updateLoadingLabel()
+
+        if self.recorder:
+            self.recorder.recordTick(mouse_pos, events)
+
+        for event in events:
+            if event.type == pg.QUIT:
+                self.running = False
+                break
+            else:
+                self.gui.update(event, self.mouse_pos)
 
             
-            ### Wipe/Fill screen, and draw GUI
-            self.main_screen.fill(const.BGCOLOR)
-            pg.draw.rect(self.main_screen, const.GREY, self.ctrl_rect)
-            self.gui.draw()
-
-            self.figure_def.update()
-            #print("UPDATE FIN===================")
-            self.figure_def.draw(self.main_screen)
-            
+            ## TODO: replace this with a scene manager or soemthing
+            self.handleView(event)
+
+            if self.figure_def is None:
+                continue
+
+            if event.type == pg.KEYDOWN:
+                self.handleKey(event)
+
+            if self.playback:
+                # nothing to edit while playing
+                continue
+
+            if event.type == pg.MOUSEBUTTONDOWN and event.button == 1:
+                grabbed = self.figure_def.checkPressed(stage_pos)
+                self.history.beginDrag(grabbed)
+
+            if event.type == pg.MOUSEBUTTONUP and event.button == 1:
+                self.figure_def.root.unselectGimbals()
+                self.history.endDrag()
+
+        if self.pan_from is not None:
+            self.viewport.pan(mouse_pos[0] - self.pan_from[0], mouse_pos[1] - self.pan_from[1])
+            self.pan_from = mouse_pos
+        stage_pos = self.viewport.toWorld(*mouse_pos)
+        
+        if self.memory:
+            self.memory.mark("draw")
+        ### Wipe/Fill screen, and draw GUI
+        self.main_screen.fill(const.BGCOLOR)
+        pg.draw.rect(self.main_screen, const.GREY, self.ctrl_rect)
+        self.gui.draw()
+
+        if self.playback:
+            self.playback.update()
+            self.playback.draw(self.main_screen, self.viewport)
+            if self.memory:
+                self.memory.draw(self.main_screen)
             pg.display.update()
+            return
+
+        ### stage: only what the viewport shows is updated and drawn
+        self.main_screen.set_clip(self.viewport.rect)
+        self.background.draw(self.main_screen, self.viewport)
+
+        if self.motion_paths:
+            self.motion_paths.draw(self.main_screen, self.viewport)
+
+        if self.memory:
+            self.memory.mark("update")
+        # the next tick's poses are computed while this one draws
+        self.updater.submit(self.viewport.cullFigures(
+            [figure for figure in self.figures if figure is not self.figure_def]))
+        editing = []
+        if self.figure_def is not None:
+            # a drag may carry it back into view, so it's always updated
+            self.figure_def.update(stage_pos)
+            editing.append(self.figure_def)
+        if self.memory:
+            self.memory.mark("draw")
+        self.lod.draw(self.main_screen, editing, editing=self.figure_def,
+                      viewport=self.viewport, posed=poses.posed)
+        self.main_screen.set_clip(None)
+        if self.memory:
+            self.memory.draw(self.main_screen)
+        
+        pg.display.update()
+
+    def mainloop (self):
+
+        while self.running:
+            self.tick(pg.event.get(), pg.mouse.get_pos())
             self.clock.tick(const.FPS)
 
+        self.shutdown()
+
+    def shutdown(self):
+        if self.recorder:
+            self.toggleRecording()
+        if self.playback:
+            self.togglePlayback()
+        self.loader.shutdown()
+        self.updater.close()
+        if self.memory:
+            self.memory.close()
+        if self.journal:
+            self.journal.close()
+        if self.catalog:
+            self.catalog.close()
+
 
 
 
-m_app = MainApplication()
 if __name__ == "__main__":
+    m_app = MainApplication()
     m_app.mainloop()
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+"""
+Memory accounting of the editor, and allocation tracing between ticks.
+
+Sizes are what Python objects and pixel buffers take: sys.getsizeof of
+every object reached, each counted once (a float shared by two frames,
+a skeleton shared by two figures), plus the pixels of Surfaces and the
+data of arrays. Skeletons are counted first, then figures (their bones,
+timelines and gimbals), then caches. Memory held inside SDL (fonts, the
+display) isn't visible from Python and isn't counted.
+
+AllocationTracer follows tracemalloc through the ticks of the main loop.
+The traced peak of each phase of a tick (input, update, draw), over what
+was traced when the phase began, is what the phase allocates and frees
+again: per-frame churn. Snapshots taken every few ticks and diffed,
+grouped by the allocating line, show what grows.
+
+MemoryOverlay shows both over the stage (F3 in the editor), turning red
+past const.MEMORY_BUDGET.
+
+    python memstats.py [--frames N] [--ticks N] [--trace] [--budget MB] [figure.xml ...]
+
+runs the editor headless on the figures and prints the same report;
+it exits with 1 if the total is over the budget.
+"""
+import argparse
+import fnmatch
+import math
+import os
+import re
+import sys
+import time
+import tracemalloc
+from collections import deque
+from itertools import chain
+import pygame as pg
+import const
+from skeleton import Pose, Skeleton
+
+# the tracer's own allocations, and compiling its filters
+TRACE_IGNORE = (tracemalloc.__file__, __file__, fnmatch.__file__,
+                os.path.join(os.path.dirname(re.__file__), "*"),
+                "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>",
+                "<unknown>")
+
+
+def surfaceBytes(surface):
+    return surface.get_pitch() * surface.get_height()
+
+
+def deepBytes(seen, *objs):
+    """
+    Bytes of _objs_ and the containers, Surfaces, arrays, Poses and
+    Skeletons they hold, not counting objects whose id is in _seen_ (which
+    is updated). Other objects are counted, but not followed.
+    """
+    # _seen_ only ever holds ids of live objects: a temporary's id may be
+    # reused, so wrappers made for the call are never passed as _obj_
+    total = 0
+    stack = list(objs)
+    while stack:
+        obj = stack.pop()
+        if obj is None or id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, pg.Surface):
+            total += surfaceBytes(obj)
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (Pose, Skeleton)):
+            stack.extend(getattr(obj, slot) for slot in obj.__slots__)
+        # arrays: getsizeof includes the data they own
+    return total
+
+
+def flatBytes(seen, values, temporary=False):
+    """
+    deepBytes of a list of scalars, without a Python level loop over it:
+    a long timeline is millions of floats
+    temporary: _values_ was made for the call; only its items count
+    """
+    total = 0
+    if not temporary and id(values) not in seen:
+        seen.add(id(values))
+        total += sys.getsizeof(values)
+    unique = dict(zip(map(id, values), values))
+    new = unique.keys() - seen
+    seen.update(new)
+    total += sum(map(sys.getsizeof, map(unique.__getitem__, new)))
+    return total
+
+
+def timelineBytes(seen, bone, cache=None):
+    """
+    Bytes of a bone's stored frames
+    cache: optional dict kept between calls; timelines whose length hasn't
+           changed since aren't walked again (nor their floats added to
+           _seen_)
+    """
+    lengths = (len(bone.frame_angles), len(bone.frame_translations))
+    if cache is not None and id(bone) in cache and cache[id(bone)][1] == lengths:
+        return cache[id(bone)][2]
+
+    total = flatBytes(seen, bone.frame_angles)
+    if bone.frame_translations:
+        total += flatBytes(seen, bone.frame_translations)
+        total += flatBytes(seen, list(chain.from_iterable(bone.frame_translations)), True)
+    if cache is not None:
+        # holding the bone keeps its id from being reused
+        cache[id(bone)] = (bone, lengths, total)
+    return total
+
+
+def figureBytes(figure, seen, cache=None):
+    """
+    {"bones", "timeline", "gimbals"} bytes of a Bone-tree figure
+    cache: see timelineBytes
+    """
+    bones = deepBytes(seen, figure, figure.__dict__, figure.bones, figure.frame_listeners)
+    timeline = gimbals = 0
+    for bone in figure.bones:
+        bones += deepBytes(seen, bone, bone.children, bone.color)
+        timeline += timelineBytes(seen, bone, cache)
+        for gimbal in (bone.gimbal, bone.wunder_gimbal):
+            if gimbal is not None:
+                gimbals += deepBytes(seen, gimbal, gimbal.rect, gimbal.mouse_prev)
+    return {"bones": bones, "timeline": timeline, "gimbals": gimbals}
+
+
+def guiElements(elems):
+    for elem in elems:
+        yield elem
+        yield from guiElements(getattr(elem, "items", ()))
+
+
+class MemoryReport:
+    """
+    Bytes per figure, per cache and of the GUI, as of when it was made
+    """
+
+    def __init__(self, app, cache=None):
+        """
+        app: a main.MainApplication
+        cache: see timelineBytes; pruned to the app's current figures
+        """
+        # the display surface's pixels belong to SDL
+        seen = {id(app.main_screen)}
+        skeletons = {id(figure.getSkeleton()): figure.getSkeleton() for figure in app.figures}
+        self.caches = {"skeletons": deepBytes(seen, Skeleton._cache, *skeletons.values())}
+
+        self.figures = []   # (label, frames, {"bones", "timeline", "gimbals"})
+        for i, figure in enumerate(app.figures):
+            label = f"{i} {figure.getSkeleton().name or 'figure'}"
+            if figure is app.figure_def:
+                label += " (editing)"
+            self.figures.append((label, figure.frameCount(), figureBytes(figure, seen, cache)))
+        if cache is not None:
+            current = {id(bone) for figure in app.figures for bone in figure.bones}
+            for key in cache.keys() - current:
+                del cache[key]
+
+        self.caches["sprites"] = deepBytes(seen, app.lod.sprites.sprites)
+        self.caches["tiles"] = deepBytes(seen, app.background.source_tiles,
+                                         app.background.scaled_tiles)
+        # the worker may be filling the back buffer; only the front is read
+        self.caches["pose buffers"] = deepBytes(seen, app.updater.front.posed)
+        if app.history is not None:
+            self.caches["history"] = deepBytes(seen, app.history.undo_stack,
+                                               app.history.redo_stack)
+        if app.motion_paths:
+            paths = app.motion_paths
+            self.caches["motion paths"] = deepBytes(seen, paths.points, paths.polylines,
+                                                    paths.surface)
+        if app.playback:
+            playback = app.playback
+            with playback.lock:
+                rendered = list(playback.ready.values()) + playback.free
+            self.caches["playback"] = deepBytes(
+                seen, *rendered, playback.lod.sprites.sprites, playback.worker_lod.sprites.sprites,
+                playback.background.source_tiles, playback.background.scaled_tiles,
+                playback.worker_background.source_tiles, playback.worker_background.scaled_tiles)
+
+        elems = list(guiElements(app.gui.elems))
+        self.fonts = len({id(elem.font) for elem in elems if hasattr(elem, "font")})
+        self.gui = deepBytes(seen, *elems, *(elem.__dict__ for elem in elems), app.surf_canvas)
+
+    def total(self):
+        return sum(sum(parts.values()) for _, _, parts in self.figures) \
+            + sum(self.caches.values()) + self.gui
+
+    def lines(self, budget=const.MEMORY_BUDGET):
+        total = self.total()
+        out = [f"total {formatBytes(total)} of {formatBytes(budget)} budget"]
+        timelines = sum(parts["timeline"] for _, _, parts in self.figures)
+        out.append(f"figures: {len(self.figures)}, timelines {formatBytes(timelines)}")
+        for label, frames, parts in self.figures:
+            out.append(f"  {label}: {formatBytes(sum(parts.values()))} = bones "
+                       f"{formatBytes(parts['bones'])} + timeline {formatBytes(parts['timeline'])} "
+                       f"({frames} frames) + gimbals {formatBytes(parts['gimbals'])}")
+        out.append("caches:")
+        for name, size in sorted(self.caches.items(), key=lambda item: -item[1]):
+            out.append(f"  {name}: {formatBytes(size)}")
+        out.append(f"gui: {formatBytes(self.gui)}, {self.fonts} fonts (not counted)")
+        return out
+
+
+def formatBytes(n):
+    for unit in ("B", "KB", "MB"):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+class AllocationTracer:
+    """
+    tracemalloc per phase of a tick, and snapshot diffs between ticks
+    """
+
+    def __init__(self, interval=const.MEMORY_TRACE_TICKS, top=const.MEMORY_TRACE_TOP):
+        """
+        interval: ticks between snapshots
+        top: growing lines kept from each diff
+        """
+        self.interval = interval
+        self.top = top
+        self.started = False    # whether tracemalloc was started here (and stopped here)
+        self.snapshot = None
+        self.ticks = 0
+        self.phase = None
+        self.phase_start = 0    # traced bytes when the phase began
+        self.churn = {}         # phase -> bytes allocated and freed again, last tick
+        self.current = {}       # being filled this tick
+        self.growth = []        # tracemalloc.StatisticDiff, largest first
+        self.rate = 0.0         # net traced bytes per tick over the last interval
+
+    def start(self, frames=1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self.started = True
+
+    def stop(self):
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+        self.snapshot = None
+
+    def tick(self):
+        """
+        Call first thing in a tick: closes the last one, opens "input"
+        """
+        if not tracemalloc.is_tracing():
+            return
+        if self.phase is not None:
+            self.mark(None)
+            self.churn, self.current = self.current, {}
+            self.ticks += 1
+            if self.ticks % self.interval == 0:
+                self.diff()
+        self.mark("input")
+
+    def mark(self, phase):
+        """
+        Ends the current phase of the tick and begins _phase_
+        """
+        if not tracemalloc.is_tracing():
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        if self.phase is not None:
+            self.current[self.phase] = self.current.get(self.phase, 0) + peak - self.phase_start
+        tracemalloc.reset_peak()
+        self.phase, self.phase_start = phase, current
+
+    def diff(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, name) for name in TRACE_IGNORE])
+        if self.snapshot is not None:
+            stats = snapshot.compare_to(self.snapshot, "lineno")
+            self.rate = sum(stat.size_diff for stat in stats) / self.interval
+            self.growth = [stat for stat in stats if stat.size_diff > 0][:self.top]
+        self.snapshot = snapshot
+
+    def lines(self):
+        if not tracemalloc.is_tracing():
+            return ["tracing off"]
+        churn = ", ".join(f"{phase} {formatBytes(size)}" for phase, size in self.churn.items())
+        out = [f"churn per tick: {churn or '-'}",
+               f"traced {formatBytes(tracemalloc.get_traced_memory()[0])}, "
+               f"{self.rate:+.0f} B/tick over the last {self.interval} ticks"]
+        for stat in self.growth:
+            frame = stat.traceback[0]
+            out.append(f"  {formatBytes(stat.size_diff / self.interval)}/tick "
+                       f"{os.path.basename(frame.filename)}:{frame.lineno}")
+        return out
+
+
+class MemoryOverlay:
+    """
+    The memory report and the tracer's findings over the stage; the report
+    is remade and the text rendered again every const.MEMORY_OVERLAY_TICKS
+    ticks, not every tick
+    """
+
+    def __init__(self, app, trace=True, budget=const.MEMORY_BUDGET):
+        self.app = app
+        self.budget = budget
+        self.tracer = AllocationTracer()
+        if trace:
+            self.tracer.start()
+        self.font = pg.font.Font(None, 18)
+        self.ticks = 0
+        self.surface = None
+        self.report = None
+        self.timelines = {}     # see timelineBytes
+
+    def close(self):
+        self.tracer.stop()
+
+    def tick(self):
+        self.tracer.tick()
+
+    def mark(self, phase):
+        self.tracer.mark(phase)
+
+    def refresh(self):
+        self.report = MemoryReport(self.app, self.timelines)
+        lines = self.report.lines(self.budget) + self.tracer.lines()
+        over = self.report.total() > self.budget
+        rendered = [self.font.render(line, True, const.COL_MEMORY_OVER if over and i == 0
+                                     else const.COL_MEMORY_TEXT)
+                    for i, line in enumerate(lines)]
+        height = self.font.get_linesize()
+        self.surface = pg.Surface((max(r.get_width() for r in rendered) + 8,
+                                   height * len(rendered) + 8), pg.SRCALPHA, 32)
+        self.surface.fill(const.COL_MEMORY_BG)
+        for i, r in enumerate(rendered):
+            self.surface.blit(r, (4, 4 + i * height))
+
+    def draw(self, screen):
+        self.mark("overlay")
+        if self.ticks % const.MEMORY_OVERLAY_TICKS == 0:
+            self.refresh()
+        self.ticks += 1
+        screen.blit(self.surface, self.app.viewport.rect.topleft)
+
+
+## command line
+
+def addFrames(figure, n_frames):
+    """
+    Appends n_frames of procedural motion, every angle a float of its own
+    like an edited timeline's
+    """
+    base = [bone.angle for bone in figure.bones]
+    x = figure.root.pos_x1
+    for i in range(n_frames):
+        for k, bone in enumerate(figure.bones[1:], 1):
+            bone.angle = base[k] + 20 * math.sin(i / 15 + k)
+        figure.root.pos_x1 = x + 60 * math.sin(i / 40)
+        figure.addFrame()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory report of the editor, run headless")
+    parser.add_argument("figures", nargs="*", default=["man_figure.xml"])
+    parser.add_argument("--frames", type=int, default=0, help="frames added to every figure")
+    parser.add_argument("--ticks", type=int, default=2 * const.FPS, help="main loop ticks run")
+    parser.add_argument("--trace", action="store_true", help="trace allocations (tracemalloc)")
+    parser.add_argument("--budget", type=float, default=const.MEMORY_BUDGET / 2 ** 20, help="MB")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    from main import MainApplication
+
+    app = MainApplication(args.figures, library=False, autosave=False)
+    deadline = time.perf_counter() + 30
+    while len(app.figures) < len(args.figures) and time.perf_counter() < deadline:
+        app.tick([], (0, 0))
+        time.sleep(0.01)
+    for figure in app.figures:
+        addFrames(figure, args.frames)
+
+    budget = int(args.budget * 2 ** 20)
+    app.memory = MemoryOverlay(app, args.trace, budget)
+    for _ in range(args.ticks):
+        app.tick(pg.event.get(), (0, 0))
+    report = MemoryReport(app)
+    print("\n".join(report.lines(budget)))
+    if args.trace:
+        print("\n".join(app.memory.tracer.lines()))
+    app.shutdown()
+    return 1 if report.total() > budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
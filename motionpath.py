@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Trajectories of selected joints across the stored timeline.
+
+World positions for all frames come from one batched forward kinematics
+pass (kinematics.batchPositions). Frames are grouped in chunks; when frames
+change (Figure.framesChanged) only the affected chunks are recomputed and
+their polylines rebuilt. The drawn paths are cached on an overlay surface,
+so a frame without timeline edits or viewport changes costs a single blit.
+"""
+import numpy as np
+import pygame as pg
+import const
+import kinematics
+from skeleton import BoneType
+
+
+def defaultJoints(skeleton):
+    """
+    End points of leaf line bones, i.e. hands and feet
+    """
+    return [i for i, children in enumerate(skeleton.children)
+            if not children and skeleton.types[i] == BoneType.LINE]
+
+
+class MotionPaths:
+
+    def __init__(self, figure, joints=None, chunk=const.MOTION_PATH_CHUNK,
+                 size=const.CANVAS_DIM):
+        """
+        joints: bone indices whose far end (x2, y2) is traced
+        """
+        self.figure = figure
+        self.skeleton = figure.getSkeleton()
+        self.joints = list(joints) if joints is not None else defaultJoints(self.skeleton)
+        self.chunk = chunk
+
+        self.points = np.zeros((0, len(self.joints), 2))   # (frames, joints, xy)
+        self.polylines = []     # per chunk: per joint, (frames, 2) stage coordinates
+        self.dirty = set()      # chunk indices
+
+        self.surface = pg.Surface(size, pg.SRCALPHA, 32)
+        self.surface_dirty = True
+        self.view_state = None  # viewport the overlay was drawn for
+
+        figure.addFrameListener(self.invalidate)
+        self.invalidate(0)
+
+    def detach(self):
+        self.figure.removeFrameListener(self.invalidate)
+
+    def invalidate(self, start, end=None):
+        if end is None:
+            end = max(self.figure.frameCount(), len(self.points), start + 1)
+        # a chunk's polyline runs into the first frame of the next one
+        first = max(start - 1, 0) // self.chunk
+        last = (max(end, start + 1) - 1) // self.chunk
+        self.dirty.update(range(first, last + 1))
+
+    def refresh(self):
+        """
+        Recomputes dirty chunks; returns True if anything changed
+        """
+        if not self.dirty:
+            return False
+
+        n = self.figure.frameCount()
+        n_chunks = -(-n // self.chunk)
+
+        if len(self.points) != n:
+            points = np.zeros((n, len(self.joints), 2))
+            keep = min(n, len(self.points))
+            points[:keep] = self.points[:keep]
+            self.points = points
+        del self.polylines[n_chunks:]
+        self.polylines += [None] * (n_chunks - len(self.polylines))
+
+        dirty = sorted(c for c in self.dirty if c < n_chunks)
+        self.dirty.clear()
+
+        # runs of consecutive dirty chunks -> one kinematics pass each
+        run_start = None
+        for i, c in enumerate(dirty):
+            if run_start is None:
+                run_start = c
+            if i + 1 == len(dirty) or dirty[i + 1] != c + 1:
+                self.computeFrames(run_start * self.chunk, min((c + 1) * self.chunk, n))
+                run_start = None
+
+        for c in dirty:
+            # overlap by one frame so consecutive chunks join up
+            span = self.points[c * self.chunk:min((c + 1) * self.chunk + 1, n)]
+            self.polylines[c] = [span[:, j].copy() for j in range(len(self.joints))]
+
+        self.surface_dirty = True
+        return True
+
+    def computeFrames(self, start, end):
+        angles, translations = kinematics.timelineArrays(self.figure, start, end)
+        positions = kinematics.batchPositions(self.skeleton, angles, translations)
+        self.points[start:end] = positions[:, self.joints, 2:4]
+
+    def redraw(self, viewport=None):
+        self.surface.fill((0, 0, 0, 0))
+        for chunk in self.polylines:
+            for line in chunk:
+                if len(line) > 1:
+                    if viewport is not None:
+                        line = viewport.toScreenArray(line)
+                    pg.draw.lines(self.surface, const.COL_MOTION_PATH, False,
+                                  line.round().astype(int).tolist(), 2)
+        self.surface_dirty = False
+        self.view_state = viewport.state() if viewport is not None else None
+
+    def draw(self, screen, viewport=None):
+        self.refresh()
+        view_state = viewport.state() if viewport is not None else None
+        if self.surface_dirty or view_state != self.view_state:
+            self.redraw(viewport)
+        screen.blit(self.surface, (0, 0))
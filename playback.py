@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+Real-time playback of the stored timelines of a scene.
+
+A worker thread renders the frames just ahead of the playhead into a
+bounded pool of Surfaces; the main loop only blits the one for the current
+frame. Frames are rendered from the stored frame lists (never the live
+pose), with the view as it was when playback's copy of the viewport was
+last updated, so the worker never reads anything the main loop is in the
+middle of changing.
+
+Editing a stored frame drops its rendering through the figures' frame
+listeners; changing the view drops them all. A frame that isn't ready when
+it's due is drawn directly (a miss), so playback never shows stale frames.
+"""
+import threading
+import time
+import pygame as pg
+import const
+from lod import LODRenderer
+from skeleton import Pose
+from viewport import TiledBackground, gridTile
+
+
+class Playback:
+
+    def __init__(self, figures, viewport, tiles=gridTile, fps=const.FPS,
+                 n_slots=const.PLAYBACK_RING, loop=True):
+        """
+        figures: Bone-tree Figures to play; shorter timelines hold their
+                 last frame
+        viewport: the application's Viewport, followed by draw()
+        tiles: background tile source (see viewport.TiledBackground)
+        n_slots: Surfaces rendered ahead, including the current frame
+        """
+        self.figures = list(figures)
+        self.fps = fps
+        self.n_slots = n_slots
+        self.loop = loop
+        # tile and sprite caches aren't thread safe: one set per thread
+        self.background = TiledBackground(tiles)
+        self.lod = LODRenderer()
+        self.worker_background = TiledBackground(tiles)
+        self.worker_lod = LODRenderer()
+
+        self.lock = threading.Condition()
+        # guarded by lock
+        self.frame = 0              # playhead
+        self.playing = True
+        self.started_at = time.perf_counter()
+        self.started_frame = 0
+        self.ready = {}             # frame -> rendered Surface
+        self.free = []
+        self.allocated = 0
+        self.epoch = 0              # bumped whenever renderings are dropped
+        self.view = None
+        self.view_state = None
+        self.running = True
+
+        self.hits = 0
+        self.misses = 0
+        self.rendered = 0
+
+        self.sync(viewport)
+        for figure in self.figures:
+            figure.addFrameListener(self.onFramesChanged)
+
+        self.thread = threading.Thread(target=self.run, name="playback", daemon=True)
+        self.thread.start()
+
+    def frameCount(self):
+        return max((figure.frameCount() for figure in self.figures), default=0)
+
+    ## main thread
+
+    def sync(self, viewport):
+        """
+        Follows changes of the view; every rendered frame is dropped if
+        there are any
+        """
+        if viewport.state() == self.view_state:
+            return
+        with self.lock:
+            self.view_state = viewport.state()
+            # the worker renders onto Surfaces of the rect's size, at (0, 0)
+            self.view = viewport.copy(pg.Rect((0, 0), viewport.rect.size))
+            self.free.extend(self.ready.values())
+            self.ready.clear()
+            self.epoch += 1
+            self.lock.notify()
+
+    def onFramesChanged(self, start, end=None):
+        with self.lock:
+            for frame in list(self.ready):
+                if frame >= start and (end is None or frame < end):
+                    self.free.append(self.ready.pop(frame))
+            self.epoch += 1
+            self.lock.notify()
+
+    def seek(self, frame):
+        """
+        Moves the playhead (scrubbing); playback continues from there
+        """
+        n_frames = self.frameCount()
+        with self.lock:
+            self.frame = frame % n_frames if self.loop else min(max(frame, 0), n_frames - 1)
+            self.started_frame = self.frame
+            self.started_at = time.perf_counter()
+            self.lock.notify()
+
+    def step(self, frames):
+        self.seek(self.frame + frames)
+
+    def togglePause(self):
+        self.playing = not self.playing
+        self.seek(self.frame)
+
+    def update(self):
+        """
+        Advances the playhead by the time passed, at self.fps; returns the
+        current frame
+        """
+        if not self.playing:
+            return self.frame
+
+        n_frames = self.frameCount()
+        frame = self.started_frame + int((time.perf_counter() - self.started_at) * self.fps)
+        if self.loop:
+            frame %= n_frames
+        elif frame >= n_frames:
+            frame = n_frames - 1
+            self.playing = False
+
+        if frame != self.frame:
+            with self.lock:
+                self.frame = frame
+                self.lock.notify()
+        return frame
+
+    def draw(self, screen, viewport):
+        """
+        Blits the current frame; renders it in place if the worker hasn't
+        got to it yet
+        """
+        self.sync(viewport)
+        with self.lock:
+            # blit under the lock, so the worker can't recycle the Surface
+            surface = self.ready.get(self.frame)
+            if surface is not None:
+                screen.blit(surface, viewport.rect)
+                self.hits += 1
+                return
+            frame = self.frame
+
+        self.misses += 1
+        clip = screen.get_clip()
+        screen.set_clip(viewport.rect)
+        self.render(screen, frame, viewport, self.lod, self.background)
+        screen.set_clip(clip)
+
+    def close(self):
+        for figure in self.figures:
+            figure.removeFrameListener(self.onFramesChanged)
+        with self.lock:
+            self.running = False
+            self.lock.notify()
+        self.thread.join()
+
+    ## rendering
+
+    def posesAt(self, frame):
+        poses = []
+        for figure in self.figures:
+            k = min(frame, figure.frameCount() - 1)
+            x, y = figure.root.frame_translations[k]
+            poses.append(Pose(figure.getSkeleton(), [b.frame_angles[k] for b in figure.bones], x, y))
+        return poses
+
+    def render(self, surface, frame, view, lod, background):
+        surface.fill(const.BGCOLOR)
+        background.draw(surface, view)
+        lod.draw(surface, poses=self.posesAt(frame), viewport=view)
+
+    ## worker thread
+
+    def window(self):
+        """
+        Frames the ring should hold, nearest first
+        """
+        n_frames = self.frameCount()
+        frames = []
+        for i in range(min(self.n_slots, n_frames)):
+            frame = self.frame + i
+            if frame >= n_frames:
+                if not self.loop:
+                    break
+                frame %= n_frames
+            frames.append(frame)
+        return frames
+
+    def nextJob(self):
+        """
+        (frame, Surface to render it on), or None if the ring is full
+        """
+        window = self.window()
+        for frame in window:
+            if frame in self.ready:
+                continue
+            if self.free:
+                surface = self.free.pop()
+            elif self.allocated < self.n_slots:
+                surface = pg.Surface(self.view.rect.size)
+                self.allocated += 1
+            else:
+                stale = next((f for f in self.ready if f not in window), None)
+                if stale is None:
+                    return None
+                surface = self.ready.pop(stale)
+            if surface.get_size() != self.view.rect.size:
+                surface = pg.Surface(self.view.rect.size)
+            return frame, surface
+        return None
+
+    def run(self):
+        while True:
+            with self.lock:
+                job = None
+                while self.running:
+                    job = self.nextJob()
+                    if job is not None:
+                        break
+                    self.lock.wait()
+                if not self.running:
+                    return
+                frame, surface = job
+                view, epoch = self.view, self.epoch
+
+            try:
+                self.render(surface, frame, view, self.worker_lod, self.worker_background)
+            except IndexError:
+                # a frame being added or removed right now; its listener
+                # call is on the way
+                with self.lock:
+                    self.free.append(surface)
+                    self.lock.wait(0.01)
+                continue
+
+            with self.lock:
+                if epoch == self.epoch:
+                    self.ready[frame] = surface
+                    self.rendered += 1
+                else:
+                    self.free.append(surface)
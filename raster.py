@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+NumPy rasterizer: anti-aliased rendering of timelines, an alternative to
+drawing with pygame.
+
+Every bone becomes a few shapes, matching drawBoneShape: a line bone a
+capsule (its thickness wide) and a circle bone a ring, each with a disc
+capping both joints. A shape's signed distance is evaluated only over its
+bounding box, for all shapes of all frames of a batch at once, and turns
+into one pixel of anti-aliased coverage at the edge.
+
+Compositing needs no sorting and no pass per shape: each pixel starts
+from the topmost shape covering it fully (or the background), and the
+anti-aliased edges above that are blended in at once, through per-pixel
+sums (see Rasterizer.render).
+
+Output is frames of (w, h) uint32 0x00RRGGBB pixels, the layout of
+framebuffer.FrameBuffer.pixels(), ready for export.FrameEncoder.
+
+It isn't a faster path: the work is per covered pixel, and pygame's C
+drawing beats it at every crowd size bench_raster measures. What it
+offers is smooth edges; about one pixel in a hundred (edge pixels, where
+pygame draws aliased) differs from the editor's rendering.
+"""
+import numpy as np
+import const
+import kinematics
+from skeleton import BoneType, CAP_RADIUS
+
+RING_WIDTH = 15         # of circle bones, as drawn by drawBoneShape
+
+# shape parameters: segment a-b, then ring radius (0 for capsules), half width
+AX, AY, BX, BY, RING, RADIUS = range(6)
+
+
+def rigShapes(rig, positions, offset=(0, 0), scale=1.0):
+    """
+    Shapes of a posed rig in drawing order
+    positions: (frames, bones, 4) as from kinematics.batchPositions
+    offset, scale: map positions to output pixels, p * scale + offset; the
+                   rig's sizes (thickness, caps, rings) scale along
+    Returns ((frames, shapes, 6) parameters, (shapes, 3) colours)
+    """
+    n_frames, n_bones = positions.shape[:2]
+    p = positions * scale + np.tile(offset, 2)
+    shapes = np.zeros((n_frames, n_bones, 3, 6))
+
+    circle = np.array([t == BoneType.CIRCLE for t in rig.types])
+    ring_radius = (np.asarray(rig.lengths, dtype=np.float64) / 2 - RING_WIDTH / 2) * scale
+    body = shapes[:, :, 0]
+    body[..., :4] = p
+    # a circle spans its two end points (see kinematics.circleShapes)
+    centre = (p[..., :2] + p[..., 2:]) / 2
+    body[:, circle, AX:BY + 1] = np.tile(centre[:, circle], 2)
+    body[:, circle, RING] = ring_radius[circle]
+    body[..., RADIUS] = np.where(circle, RING_WIDTH / 2,
+                                 np.asarray(rig.thicknesses, dtype=np.float64) / 2) * scale
+
+    for cap, end in ((1, p[..., :2]), (2, p[..., 2:])):
+        shapes[:, :, cap, AX:AY + 1] = end
+        shapes[:, :, cap, BX:BY + 1] = end
+        shapes[:, :, cap, RADIUS] = CAP_RADIUS * scale
+
+    keep = np.ones((n_bones, 3), dtype=bool)
+    keep[:, 1:] = visibleCaps(rig)
+    colors = np.repeat(np.array([c[:3] for c in rig.colors], dtype=np.float32), 3, axis=0)
+    keep = keep.ravel()
+    return shapes.reshape(n_frames, n_bones * 3, 6)[:, keep], colors[keep]
+
+
+def visibleCaps(rig):
+    """
+    (bones, 2) bools: whether the caps at each bone's start and end show.
+    A cap is painted over by the cap of a child starting there (same place,
+    same size, drawn later), so it needn't be drawn.
+    """
+    visible = np.ones((len(rig.parents), 2), dtype=bool)
+    for i, parent in enumerate(rig.parents):
+        if parent >= 0:
+            visible[parent, 0 if rig.other_end[i] else 1] = False
+    return visible
+
+
+def ramp(starts, counts):
+    """
+    start, start + 1, ..., start + count - 1 for every (start, count) with
+    count > 0, concatenated; one cumulative sum, no per-run work
+    """
+    if not np.all(counts > 0):
+        starts, counts = starts[counts > 0], counts[counts > 0]
+    if not len(counts):
+        return np.empty(0, dtype=np.int32)
+    ends = np.cumsum(counts)
+    steps = np.ones(ends[-1], dtype=np.int32)
+    firsts = ends[:-1]
+    steps[0] = starts[0]
+    # jump from the previous run's last value to this run's start
+    steps[firsts] = starts[1:] - (starts[:-1] + counts[:-1] - 1)
+    return np.cumsum(steps, dtype=np.int32)
+
+
+class Rasterizer:
+
+    def __init__(self, size, background=const.BGCOLOR):
+        self.size = tuple(size)
+        self.background = np.array(background[:3], dtype=np.float32)
+        r, g, b = background[:3]
+        self.packed_background = (r << 16) | (g << 8) | b
+
+    def coverage(self, shapes):
+        """
+        (pixel, shape, coverage) triples of the pixels each shape touches;
+        pixel indices run over (frame, x, y) of the output
+        """
+        w, h = self.size
+        n_frames, n_shapes = shapes.shape[:2]
+        s = shapes.reshape(-1, 6).astype(np.float32)
+        # coverage reaches half a pixel beyond the edge
+        reach = s[:, RING] + s[:, RADIUS] + 0.5
+        y0 = np.clip(np.floor(np.minimum(s[:, AY], s[:, BY]) - reach), 0, h).astype(np.int32)
+        y1 = np.clip(np.ceil(np.maximum(s[:, AY], s[:, BY]) + reach) + 1, 0, h).astype(np.int32)
+
+        # one row per shape and pixel row; most of the work is per row
+        on = np.flatnonzero(y1 > y0)
+        owner = np.repeat(on.astype(np.int32), (y1 - y0)[on])
+        rs = s[owner]
+        ax, ay, dx, dy = rs[:, AX], rs[:, AY], rs[:, BX] - rs[:, AX], rs[:, BY] - rs[:, AY]
+        y = ramp(y0[on], (y1 - y0)[on])
+        ry = y.astype(np.float32) - ay
+        r = reach[owner]
+
+        # the part of the segment within _reach_ of the row bounds the span
+        # of pixels worth looking at
+        flat = np.abs(dy) < 1e-6
+        ta = np.where(flat, 0, (ry - r) / np.where(flat, 1, dy))
+        tb = np.where(flat, 1, (ry + r) / np.where(flat, 1, dy))
+        xa = ax + np.clip(np.minimum(ta, tb), 0, 1) * dx
+        xb = ax + np.clip(np.maximum(ta, tb), 0, 1) * dx
+        x0 = np.clip(np.floor(np.minimum(xa, xb) - r), 0, w).astype(np.int32)
+        x1 = np.clip(np.ceil(np.maximum(xa, xb) + r) + 1, 0, w).astype(np.int32)
+        counts = x1 - x0
+        if (counts <= 0).any():
+            on = np.flatnonzero(counts > 0)
+            owner, rs, ax, ay, dx, dy, y, ry, x0, counts = \
+                (a[on] for a in (owner, rs, ax, ay, dx, dy, y, ry, x0, counts))
+
+        # per pixel: distance to the segment, then to the ring (0 for
+        # capsules) and the edge; t = rx * k1 + k0 is the closest point
+        inv = 1 / np.maximum(dx * dx + dy * dy, np.float32(1e-12))
+        x = ramp(x0, counts)
+        rx = x.astype(np.float32) - np.repeat(ax, counts)
+        t = rx * np.repeat(dx * inv, counts)
+        t += np.repeat(ry * dy * inv, counts)
+        np.clip(t, 0, 1, out=t)
+        ex = rx - t * np.repeat(dx, counts)
+        ey = np.repeat(ry, counts) - t * np.repeat(dy, counts)
+        dist = np.sqrt(ex * ex + ey * ey)
+        dist -= np.repeat(rs[:, RING], counts)
+        np.abs(dist, out=dist)
+        alpha = np.repeat(rs[:, RADIUS] + np.float32(0.5), counts) - dist
+        np.clip(alpha, 0, 1, out=alpha)
+
+        hit = np.flatnonzero(alpha)
+        row = np.repeat(np.arange(len(counts), dtype=np.int32), counts)[hit]
+        # (frame * w + x) * h + y
+        row_base = (owner // n_shapes).astype(np.int64) * (w * h) + y
+        pixel = row_base[row] + x[hit].astype(np.int64) * h
+        return pixel, (owner % n_shapes)[row], alpha[hit]
+
+    def render(self, shapes, colors, out=None):
+        """
+        shapes, colors: as from rigShapes; concatenate along the shape
+                        axis to draw several rigs (later ones on top)
+        out: optional (frames, w, h) uint32 array to fill
+        Returns the (frames, w, h) pixels
+        """
+        w, h = self.size
+        n_frames = len(shapes)
+        pixel, shape, alpha = self.coverage(shapes)
+
+        # compact indices of the touched pixels
+        touched = np.zeros(n_frames * w * h, dtype=bool)
+        touched[pixel] = True
+        pixels = np.flatnonzero(touched)
+        compact = np.zeros(len(touched), dtype=np.int32)
+        compact[pixels] = np.arange(len(pixels), dtype=np.int32)
+        target = compact[pixel]
+
+        # nothing under the topmost shape covering a pixel fully shows
+        top = np.full(len(pixels), -1, dtype=np.int32)
+        opaque = alpha >= 1
+        np.maximum.at(top, target[opaque], shape[opaque])
+        rgb = np.empty((len(pixels), 3), dtype=np.float32)
+        rgb[:] = self.background
+        covered = top >= 0
+        rgb[covered] = colors[top[covered]]
+
+        # the partly covering shapes above it (anti-aliased edges) let
+        # through the product of their (1 - alpha), and add the alpha
+        # weighted mean of their colours; exact unless edges of different
+        # colours overlap
+        above = shape > top[target]
+        shape, alpha, target = shape[above], alpha[above], target[above]
+        n = len(pixels)
+        through = np.exp(np.bincount(target, np.log1p(-alpha), n))[:, None]
+        weight = np.maximum(np.bincount(target, alpha, n), 1e-12)[:, None]
+        mean = np.stack([np.bincount(target, colors[shape, k] * alpha, n)
+                         for k in range(3)], axis=1) / weight
+        rgb = rgb * through + mean * (1 - through)
+
+        if out is None:
+            out = np.empty((n_frames, w, h), dtype=np.uint32)
+        out.fill(self.packed_background)
+        packed = np.rint(rgb).astype(np.uint32)
+        out.reshape(-1)[pixels] = (packed[:, 0] << 16) | (packed[:, 1] << 8) | packed[:, 2]
+        return out
+
+
+def renderTimeline(figure, frames, rect=const.EXPORT_RECT, batch=const.RASTER_BATCH):
+    """
+    Yields (w, h) pixel arrays of _frames_ of a Bone-tree figure's stored
+    timeline, cropped to _rect_, rendering _batch_ frames at a time. Each
+    array stays valid after the next one is yielded.
+    """
+    x, y, w, h = rect
+    rig = figure.getSkeleton()
+    raster = Rasterizer((w, h))
+    frames = np.asarray(frames, dtype=np.int64)
+    angles, translations = kinematics.timelineArrays(figure)
+    for start in range(0, len(frames), batch):
+        chunk = frames[start:start + batch]
+        positions = kinematics.batchPositions(rig, angles[chunk], translations[chunk])
+        yield from raster.render(*rigShapes(rig, positions, (-x, -y)))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+Recording of editing sessions and deterministic headless replay.
+
+A recording is a JSON-lines file: a header with the figure file, its
+starting timeline/pose and the stage view (zoom and pan decide where the
+recorded mouse positions land), one line per main loop tick (mouse position and
+the pygame events of that tick) and a footer with the final state.
+
+    python replay.py session.jsonl [--repeat N] [--budget-ms MS]
+
+replays it through a headless MainApplication on a virtual clock, prints
+per-tick timings and checks that the final pose and timeline match.
+Undo history from before the recording started is not part of it, so
+sessions that undo past their start won't verify.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import const
+import framecodec
+
+VERSION = 1
+
+# event attributes that are worth recording; the rest (window ids etc.)
+# are session specific
+EVENT_ATTRS = ("pos", "rel", "button", "buttons", "key", "mod", "unicode",
+               "scancode", "x", "y", "text")
+TUPLE_ATTRS = ("pos", "rel", "buttons")
+
+
+def figureState(figure):
+    angles, translation = figure.getPose()
+    return {"pose": [angles, list(translation)],
+            "timeline": framecodec.figureChannels(figure)}
+
+
+def eventToDict(event):
+    out = {"type": event.type}
+    for attr in EVENT_ATTRS:
+        if attr in event.dict:
+            value = event.dict[attr]
+            out[attr] = list(value) if isinstance(value, tuple) else value
+    return out
+
+
+def eventFromDict(d):
+    import pygame as pg
+
+    attrs = {k: (tuple(v) if k in TUPLE_ATTRS else v) for k, v in d.items() if k != "type"}
+    return pg.event.Event(d["type"], **attrs)
+
+
+class Recorder:
+
+    def __init__(self, fname, figure_file, figure, viewport=None):
+        self.fname = fname
+        self.file = open(fname, "w")
+        self.ticks = 0
+        header = {"version": VERSION, "fps": const.FPS,
+                  "figure": figure_file, "start": figureState(figure)}
+        if viewport is not None:
+            header["viewport"] = {"x": viewport.x, "y": viewport.y, "zoom": viewport.zoom}
+        self.writeLine(header)
+
+    def writeLine(self, obj):
+        self.file.write(json.dumps(obj, separators=(",", ":")))
+        self.file.write("\n")
+
+    def recordTick(self, mouse_pos, events):
+        self.writeLine({"mouse": list(mouse_pos),
+                        "events": [eventToDict(e) for e in events]})
+        self.ticks += 1
+
+    def stop(self, figure):
+        self.writeLine({"final": figureState(figure)})
+        self.file.close()
+
+
+class VirtualClock:
+    """
+    Stands in for pg.time.Clock: advances by exactly one frame per tick
+    and never sleeps
+    """
+
+    def __init__(self):
+        self.time_ms = 0.0
+        self.frames = 0
+        self.fps = const.FPS
+
+    def tick(self, framerate=0):
+        if framerate:
+            self.fps = framerate
+        step = 1000 / self.fps
+        self.time_ms += step
+        self.frames += 1
+        return int(step)
+
+    def get_time(self):
+        return int(1000 / self.fps)
+
+    def get_fps(self):
+        return float(self.fps)
+
+
+class ReplayReport:
+
+    def __init__(self, timings_ms, mismatches):
+        self.timings_ms = sorted(timings_ms)
+        self.mismatches = mismatches
+
+    def percentile(self, p):
+        if not self.timings_ms:
+            return 0.0
+        return self.timings_ms[min(len(self.timings_ms) - 1, int(p * len(self.timings_ms)))]
+
+    @property
+    def ok(self):
+        return not self.mismatches
+
+    def __str__(self):
+        t = self.timings_ms
+        mean = sum(t) / len(t) if t else 0.0
+        lines = [f"{len(t)} ticks: mean {mean:.3f} ms, p50 {self.percentile(0.5):.3f} ms, "
+                 f"p95 {self.percentile(0.95):.3f} ms, max {max(t, default=0):.3f} ms",
+                 "final state: " + ("OK" if self.ok else "MISMATCH")]
+        lines += ["  " + m for m in self.mismatches[:10]]
+        return "\n".join(lines)
+
+
+def compareStates(expected, actual, tol=1e-6):
+    mismatches = []
+
+    (exp_angles, exp_pos), (act_angles, act_pos) = expected["pose"], actual["pose"]
+    for i, (a, b) in enumerate(zip(exp_angles + exp_pos, act_angles + act_pos)):
+        if abs(a - b) > tol:
+            mismatches.append(f"pose value {i}: expected {a}, got {b}")
+
+    exp_tl, act_tl = expected["timeline"], actual["timeline"]
+    for c, (exp_ch, act_ch) in enumerate(zip(exp_tl, act_tl)):
+        if len(exp_ch) != len(act_ch):
+            mismatches.append(f"channel {c}: expected {len(exp_ch)} frames, got {len(act_ch)}")
+            continue
+        for f, (a, b) in enumerate(zip(exp_ch, act_ch)):
+            if abs(a - b) > tol:
+                mismatches.append(f"channel {c} frame {f}: expected {a}, got {b}")
+                break
+    return mismatches
+
+
+def loadRecording(fname):
+    with open(fname) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+
+    header, ticks, final = lines[0], lines[1:], None
+    if ticks and "final" in ticks[-1]:
+        final = ticks.pop()["final"]
+    if header.get("version") != VERSION:
+        raise ValueError(f"replay: unsupported recording version {header.get('version')}")
+    return header, ticks, final
+
+
+def replay(fname):
+    """
+    Replays a recording headlessly; returns a ReplayReport
+    """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame as pg
+    from main import MainApplication
+
+    header, ticks, final = loadRecording(fname)
+
+    app = MainApplication([header["figure"]], library=False, autosave=False)
+    app.clock = VirtualClock()
+    while app.figure_def is None:
+        if app.loader.failed:
+            raise RuntimeError(f"replay: could not load {header['figure']}")
+        app.loader.drain()
+        time.sleep(0.001)
+
+    figure = app.figure_def
+    framecodec.setFigureChannels(figure, header["start"]["timeline"])
+    angles, translation = header["start"]["pose"]
+    figure.setPose((angles, tuple(translation)))
+    # recordings from before zoom and pan were made at the default view
+    view = header.get("viewport", {})
+    app.viewport.x, app.viewport.y = view.get("x", 0.0), view.get("y", 0.0)
+    app.viewport.zoom = view.get("zoom", 1.0)
+
+    timings = []
+    for tick in ticks:
+        events = [eventFromDict(e) for e in tick["events"]]
+        start = time.perf_counter()
+        app.tick(events, tuple(tick["mouse"]))
+        timings.append((time.perf_counter() - start) * 1000)
+        app.clock.tick(header["fps"])
+
+    mismatches = compareStates(final, figureState(figure)) if final else \
+                 ["recording has no final state"]
+    app.shutdown()
+    pg.quit()
+    return ReplayReport(timings, mismatches)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded editing session")
+    parser.add_argument("recording")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="fail if the p95 tick time exceeds this")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for _ in range(args.repeat):
+        report = replay(args.recording)
+        print(report)
+        failed |= not report.ok
+        if args.budget_ms is not None and report.percentile(0.95) > args.budget_ms:
+            print(f"p95 over budget ({args.budget_ms} ms)")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+"""
+Retargeting timelines onto figures with different rigs.
+
+Each bone of the target skeleton is paired with a bone of the source, or
+none: explicitly, by bone name (see Skeleton.bone_names), or by structure.
+Named bones are paired first. The rest are then paired below already
+paired parents, starting from the roots, each with the bone pointing the
+closest way in the rest pose.
+
+Angles are carried over as world angles relative to each rig's rest pose:
+a target bone turns away from its rest direction as far as its source
+bone turns away from its own. They are turned back into Bone.angle values
+along the target's parents and other_end flags, so rigs that differ in
+what hangs off the root's far end still point the same ways. Unpaired
+bones keep their rest angle relative to their parent.
+
+Root motion is scaled by the ratio of the rigs' rest heights, and the root
+is raised or lowered so both rest poses stand on the same ground line.
+Everything is vectorized over the frames of a timeline block.
+
+    python retarget.py [-s source.xml] [-o outdir] [-j jobs] motion target [...]
+
+retargets a motion (an encoded timeline recorded with source.xml, a BVH
+capture, or a directory of them) onto every target figure XML (or every
+figure XML below a directory), in parallel processes.
+"""
+import argparse
+import functools
+import multiprocessing as mp
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import framecodec
+import kinematics
+from skeleton import Skeleton
+
+MOTION_EXTENSIONS = (".btl", ".bvh")
+PAIR_MAX_TURN = 90      # degrees between the rest directions of structurally paired bones
+
+
+def boneIndex(skeleton, bone):
+    """
+    bone: index or name
+    """
+    if isinstance(bone, str):
+        if skeleton.bone_names.count(bone) != 1:
+            raise ValueError(f"retarget: no single bone named '{bone}' in {skeleton.name or 'skeleton'}")
+        return skeleton.bone_names.index(bone)
+    return bone
+
+
+def mapBones(source, target, mapping=None):
+    """
+    Returns, per target bone, the index of its source bone, or -1
+    mapping: optional {target bone: source bone}, by name or index; when
+             given, it's the whole mapping
+    """
+    pairs = [-1] * len(target)
+    if mapping is not None:
+        for t, s in mapping.items():
+            pairs[boneIndex(target, t)] = boneIndex(source, s)
+        return pairs
+
+    names = source.bone_names
+    for t, name in enumerate(target.bone_names):
+        if name and names.count(name) == 1:
+            pairs[t] = names.index(name)
+
+    used = {s for s in pairs if s >= 0}
+    if pairs[0] < 0 and 0 not in used:
+        pairs[0] = 0
+        used.add(0)
+
+    source_rest = kinematics.worldAngles(source, [source.rest_angles])[0]
+    target_rest = kinematics.worldAngles(target, [target.rest_angles])[0]
+    # pre-order: a parent is paired (or not) before its children come up
+    for t, s in enumerate(pairs):
+        if s < 0:
+            continue
+        # rigs disagree on where limbs attach (chest or hips), so bones one
+        # level up are candidates as well
+        candidates = list(source.children[s])
+        if source.parents[s] >= 0:
+            candidates += source.children[source.parents[s]]
+        for child in target.children[t]:
+            if pairs[child] >= 0:
+                continue
+            turns = {c: turnBetween(source_rest[c], target_rest[child]) for c in candidates
+                     if c not in used}
+            best = min(turns, key=lambda c: (turns[c], source.other_end[c] != target.other_end[child]),
+                       default=None)
+            if best is not None and turns[best] <= PAIR_MAX_TURN:
+                pairs[child] = best
+                used.add(best)
+    return pairs
+
+
+def turnBetween(a, b):
+    """
+    Smallest angle between two directions, degrees
+    """
+    return abs((a - b + 180) % 360 - 180)
+
+
+def restExtent(skeleton):
+    """
+    (height, drop) of the rest pose: its vertical extent, and how far its
+    lowest point is below the root
+    """
+    points = np.array(kinematics.posePositions(skeleton, skeleton.rest_angles, 0.0, 0.0))
+    ys = np.concatenate(([0.0], points[:, 1], points[:, 3]))
+    return ys.max() - ys.min(), ys.max()
+
+
+class Retargeter:
+
+    def __init__(self, source, target, mapping=None):
+        """
+        source, target: Skeletons; mapping: see mapBones
+        """
+        if len(source) == 0 or len(target) == 0:
+            raise ValueError("retarget: empty skeleton")
+        self.source = source
+        self.target = target
+        self.pairs = mapBones(source, target, mapping)
+
+        source_rest = kinematics.worldAngles(source, [source.rest_angles])[0]
+        target_rest = kinematics.worldAngles(target, [target.rest_angles])[0]
+        self.offsets = [target_rest[t] - source_rest[s] if s >= 0 else 0.0
+                        for t, s in enumerate(self.pairs)]
+
+        source_height, source_drop = restExtent(source)
+        target_height, target_drop = restExtent(target)
+        self.scale = target_height / source_height if source_height > 0 else 1.0
+        self.lift = source_drop - target_drop
+        self.first = None   # source root at the first frame retargeted
+
+    @property
+    def n_paired(self):
+        return sum(s >= 0 for s in self.pairs)
+
+    def angles(self, angles):
+        """
+        (frames, source bones) Bone.angle values to (frames, target bones)
+        """
+        world = kinematics.worldAngles(self.source, angles)
+        target = self.target
+        out_world = np.empty((len(world), len(target)))
+        out = np.empty_like(out_world)
+        for t, parent in enumerate(target.parents):
+            relative = parent >= 0 and not target.other_end[t]
+            s = self.pairs[t]
+            if s >= 0:
+                out_world[:, t] = world[:, s] + self.offsets[t]
+            else:
+                out_world[:, t] = target.rest_angles[t]
+                if relative:
+                    out_world[:, t] += out_world[:, parent]
+            out[:, t] = out_world[:, t] - out_world[:, parent] if relative else out_world[:, t]
+        # keep them in (-180, 180]
+        return 180 - np.mod(180 - out, 360)
+
+    def translations(self, translations):
+        """
+        (frames, 2) source root positions to target ones; motion is taken
+        relative to the first frame ever passed in
+        """
+        translations = np.asarray(translations, dtype=np.float64).reshape(-1, 2)
+        if len(translations) == 0:
+            return translations
+        if self.first is None:
+            self.first = translations[0].copy()
+        out = self.first + (translations - self.first) * self.scale
+        out[:, 1] += self.lift
+        return out
+
+    def retarget(self, angles, translations):
+        return self.angles(angles), self.translations(translations)
+
+
+def retargetTimeline(retargeter, timeline, codec=None):
+    """
+    Retargets a framecodec.EncodedTimeline of the source skeleton a block
+    at a time. Returns the target's EncodedTimeline.
+    """
+    if timeline.n_channels != len(retargeter.source) + 2 or timeline.pos_channels != 2:
+        raise ValueError(f"retarget: timeline has {timeline.n_channels} channels, "
+                         f"source skeleton needs {len(retargeter.source) + 2}")
+    writer = framecodec.TimelineWriter(codec or framecodec.FrameCodec(), len(retargeter.target) + 2)
+    for index in range(len(timeline.blocks)):
+        channels = np.array(timeline.decodeBlock(index), dtype=np.float64)
+        angles, translations = retargeter.retarget(channels[:-2].T, channels[-2:].T)
+        writer.append(np.concatenate((angles, translations), axis=1).T)
+    return writer.finish()
+
+
+def retargetFigure(figure, target, mapping=None):
+    """
+    A new editable Figure of the _target_ Skeleton, playing the stored
+    timeline of Bone-tree _figure_
+    """
+    import Bone
+
+    retargeter = Retargeter(figure.getSkeleton(), target, mapping)
+    angles, translations = retargeter.retarget(*kinematics.timelineArrays(figure))
+    out = Bone.Figure.fromSkeleton(target)
+    framecodec.setFigureChannels(out, np.concatenate((angles, translations), axis=1).T.tolist())
+    if out.frameCount():
+        out.setFrame(0)
+    return out
+
+
+## command line
+
+@functools.lru_cache(maxsize=4)
+def loadMotion(fname, source_fname):
+    """
+    (source Skeleton, EncodedTimeline); cached, as every worker process
+    retargets the same few motions onto many figures
+    """
+    if fname.lower().endswith(".bvh"):
+        import bvh
+        skeleton, timeline, _ = bvh.importBVH(fname)
+        return skeleton, timeline
+    if source_fname is None:
+        raise ValueError(f"retarget: {fname} needs the figure it was recorded with (--source)")
+    return Skeleton.load(source_fname), framecodec.EncodedTimeline.load(fname)
+
+
+def retargetFile(job):
+    """
+    One (motion, source XML or None, target XML, output) job, run in a
+    worker process. Returns (output, frames, paired bones, seconds).
+    """
+    motion, source_fname, target_fname, out = job
+    start = time.perf_counter()
+    source, timeline = loadMotion(motion, source_fname)
+    retargeter = Retargeter(source, Skeleton.load(target_fname))
+    retargetTimeline(retargeter, timeline).save(out)
+    return out, timeline.n_frames, retargeter.n_paired, time.perf_counter() - start
+
+
+def retargetBatch(jobs):
+    """
+    Runs jobs in one worker; failures are returned rather than raised, so
+    one bad file doesn't lose the rest of the batch
+    """
+    results = []
+    for job in jobs:
+        try:
+            results.append((job, retargetFile(job)))
+        except (OSError, ValueError, ET.ParseError) as e:
+            results.append((job, e))
+    return results
+
+
+def findFiles(path, extensions):
+    if not os.path.isdir(path):
+        return [path]
+    found = []
+    for dirpath, _, fnames in os.walk(path):
+        found.extend(os.path.join(dirpath, fname) for fname in fnames
+                     if fname.lower().endswith(extensions))
+    return sorted(found)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Retarget timelines onto other figures")
+    parser.add_argument("motion", help="encoded timeline (.btl), BVH capture, or a directory of them")
+    parser.add_argument("targets", nargs="+", help="figure XMLs, or directories of them")
+    parser.add_argument("-s", "--source", help="figure the .btl timelines were recorded with")
+    parser.add_argument("-o", "--out", help="output directory (default: next to each target)")
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    motions = findFiles(args.motion, MOTION_EXTENSIONS)
+    targets = [t for path in args.targets for t in findFiles(path, (".xml",))]
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    jobs = []
+    for motion in motions:
+        motion_name = os.path.splitext(os.path.basename(motion))[0]
+        for target in targets:
+            stem = os.path.splitext(target)[0]
+            out = f"{stem}-{motion_name}.btl"
+            if args.out:
+                out = os.path.join(args.out, os.path.basename(out))
+            jobs.append((motion, args.source, target, out))
+
+    start = time.perf_counter()
+    failed = 0
+    workers = args.jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn")) as pool:
+        # consecutive jobs share a motion; batches keep its cached decode busy
+        chunk = max(1, min(16, len(jobs) // (workers * 4)))
+        futures = [pool.submit(retargetBatch, jobs[i:i + chunk]) for i in range(0, len(jobs), chunk)]
+        for future in futures:
+            for job, result in future.result():
+                if isinstance(result, Exception):
+                    failed += 1
+                    print(f"{job[2]}: {result}")
+                else:
+                    out, n_frames, n_paired, seconds = result
+                    print(f"{job[2]}: {n_frames} frames, {n_paired} bones paired, "
+                          f"{seconds:.2f} s -> {out}")
+    print(f"{len(jobs) - failed}/{len(jobs)} retargeted in {time.perf_counter() - start:.1f} s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
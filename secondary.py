@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""
+Secondary motion: follow-through of loose bones, baked into timelines.
+
+The far end of every loose bone is a particle, integrated with verlet
+steps under gravity and damping, and pulled towards where the animation
+puts it (stiffness). A distance constraint then puts it back at the bone's
+length from the bone's start point, which is where the animation (or, for
+a chain of loose bones, the loose parent) leaves it. Going through the
+loose bones parents first, one pass satisfies every constraint, as each
+bone only moves its own end.
+
+All figures sharing a skeleton are simulated together: every step is a
+handful of array operations over the figures, per loose bone. Steps are a
+fixed 1/fps long and there's no randomness, so bakes are repeatable.
+
+In the editor, B bakes the edited figure (one undo step); run as a script
+to bake encoded timelines (.btl) of a figure.
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import const
+import framecodec
+import kinematics
+from skeleton import BoneType
+
+
+def looseBones(rig):
+    """
+    Default loose bones: the line bones without children (hands, feet)
+    """
+    return [i for i, children in enumerate(rig.children)
+            if not children and rig.types[i] == BoneType.LINE and rig.parents[i] >= 0]
+
+
+class SecondaryMotion:
+
+    def __init__(self, rig, n_figures, loose=None, gravity=const.SECONDARY_GRAVITY,
+                 damping=const.SECONDARY_DAMPING, stiffness=const.SECONDARY_STIFFNESS,
+                 fps=const.FPS):
+        """
+        rig: skeleton shared by the simulated figures (see kinematics)
+        loose: indices of the simulated bones (default: looseBones)
+        gravity: pixels/s^2, downwards
+        damping: fraction of the velocity lost per step
+        stiffness: fraction of the way to the animated position per step
+        """
+        self.rig = rig
+        self.n_figures = n_figures
+        self.loose = sorted(looseBones(rig) if loose is None else loose)
+        self.slot = {bone: k for k, bone in enumerate(self.loose)}
+        self.gravity = np.array([0.0, gravity / fps ** 2])
+        self.damping = damping
+        self.stiffness = stiffness
+        self.pos = None     # (figures, loose bones, 2) particle positions
+        self.prev = None
+
+    def reset(self):
+        """
+        The next step starts at rest, on the animated pose
+        """
+        self.pos = self.prev = None
+
+    def step(self, angles, translations):
+        """
+        Advances one frame.
+        angles: (figures, bones) animated Bone.angle values
+        translations: (figures, 2) root positions
+        Returns the angles with the loose bones' replaced by simulated ones
+        """
+        rig = self.rig
+        animated = kinematics.batchPositions(rig, angles, translations)
+        target = animated[:, self.loose, 2:]
+        if self.pos is None:
+            self.pos, self.prev = target.copy(), target.copy()
+
+        pos = self.pos
+        velocity = (pos - self.prev) * (1 - self.damping)
+        self.prev = pos.copy()
+        pos += velocity + self.gravity
+
+        positions = animated.copy()
+        for k, bone in enumerate(self.loose):
+            parent = rig.parents[bone]
+            if parent < 0:
+                start = positions[:, bone, :2]
+            elif rig.other_end[bone]:
+                start = positions[:, parent, :2]
+            else:
+                start = positions[:, parent, 2:]
+            positions[:, bone, :2] = start
+
+            # pull towards the animated shape, hanging off the actual start
+            aim = start + animated[:, bone, 2:] - animated[:, bone, :2]
+            pos[:, k] += (aim - pos[:, k]) * self.stiffness
+
+            offset = pos[:, k] - start
+            dist = np.hypot(offset[:, 0], offset[:, 1])[:, None]
+            fallback = aim - start
+            offset = np.where(dist > 1e-9, offset / np.maximum(dist, 1e-9),
+                              fallback / max(rig.lengths[bone], 1e-9))
+            pos[:, k] = start + offset * rig.lengths[bone]
+            positions[:, bone, 2:] = pos[:, k]
+
+            # non-loose descendants ride along rigidly
+            self.carry(positions, animated, bone)
+
+        return self.anglesFrom(positions, angles)
+
+    def carry(self, positions, animated, bone):
+        """
+        Moves the non-loose descendants of _bone_ with it, keeping their
+        angles relative to it (other_end ones keep their absolute angles
+        and stay where the animation puts them)
+        """
+        rig = self.rig
+        turn = np.arctan2(-(positions[:, bone, 3] - positions[:, bone, 1]),
+                          positions[:, bone, 2] - positions[:, bone, 0]) \
+            - np.arctan2(-(animated[:, bone, 3] - animated[:, bone, 1]),
+                         animated[:, bone, 2] - animated[:, bone, 0])
+        cos, sin = np.cos(turn)[:, None], np.sin(turn)[:, None]
+        pivot, origin = positions[:, bone, 2:], animated[:, bone, 2:]
+
+        stack = [c for c in rig.children[bone] if c not in self.slot and not rig.other_end[c]]
+        while stack:
+            child = stack.pop()
+            for a, b in ((0, 2), (2, 4)):
+                d = animated[:, child, a:b] - origin
+                # y axis down: a turn by +angle (y up) is (cos, sin; -sin, cos)
+                positions[:, child, a] = pivot[:, 0] + d[:, 0] * cos[:, 0] + d[:, 1] * sin[:, 0]
+                positions[:, child, a + 1] = pivot[:, 1] - d[:, 0] * sin[:, 0] + d[:, 1] * cos[:, 0]
+            stack.extend(c for c in rig.children[child]
+                         if c not in self.slot and not rig.other_end[c])
+
+    def anglesFrom(self, positions, angles):
+        """
+        Bone.angle values of the loose bones from their simulated positions,
+        kept within 180 degrees of the animated ones
+        """
+        rig = self.rig
+        world = np.degrees(np.arctan2(-(positions[..., 3] - positions[..., 1]),
+                                      positions[..., 2] - positions[..., 0]))
+        out = np.array(angles, dtype=np.float64)
+        for bone in self.loose:
+            parent = rig.parents[bone]
+            local = world[:, bone]
+            if parent >= 0 and not rig.other_end[bone]:
+                local = local - world[:, parent]
+            out[:, bone] += (local - out[:, bone] + 180) % 360 - 180
+        return out
+
+
+def bake(figures, loose=None, history=None, **params):
+    """
+    Simulates the stored timelines of Bone-tree figures and writes the loose
+    bones' angles back into them; figures sharing a skeleton are simulated
+    together. The figure _history_ (see history.History) belongs to gets
+    them through it, as one undoable entry. params: see SecondaryMotion.
+    Returns the number of frames simulated
+    """
+    groups = {}
+    for figure in figures:
+        groups.setdefault(id(figure.getSkeleton()), []).append(figure)
+
+    total = 0
+    for group in groups.values():
+        rig = group[0].getSkeleton()
+        counts = [figure.frameCount() for figure in group]
+        n_frames = max(counts)
+        # shorter timelines hold their last frame
+        angles = np.empty((n_frames, len(group), len(rig)))
+        translations = np.empty((n_frames, len(group), 2))
+        for i, figure in enumerate(group):
+            a, t = kinematics.timelineArrays(figure)
+            angles[:, i] = a[np.minimum(np.arange(n_frames), len(a) - 1)]
+            translations[:, i] = t[np.minimum(np.arange(n_frames), len(t) - 1)]
+
+        sim = SecondaryMotion(rig, len(group), loose, **params)
+        for frame in range(n_frames):
+            angles[frame] = sim.step(angles[frame], translations[frame])
+
+        for i, figure in enumerate(group):
+            channels = {bone: angles[:counts[i], i, bone].tolist() for bone in sim.loose}
+            if history is not None and history.figure is figure:
+                history.replaceChannels(channels)
+                continue
+            for bone, values in channels.items():
+                figure.bones[bone].frame_angles = values
+            figure.framesChanged(0)
+        total += n_frames * len(group)
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bake secondary motion into timelines")
+    parser.add_argument("figure", help="figure XML the timelines were recorded with")
+    parser.add_argument("timelines", nargs="+", help="encoded timelines (.btl)")
+    parser.add_argument("-o", "--out", help="output directory (default: next to each timeline)")
+    args = parser.parse_args(argv)
+    import Bone
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    codec = framecodec.FrameCodec()
+    for fname in args.timelines:
+        figure = Bone.Figure.fromFile(args.figure)
+        framecodec.EncodedTimeline.load(fname).applyToFigure(figure)
+        start = time.perf_counter()
+        n_frames = bake([figure])
+        elapsed = time.perf_counter() - start
+
+        out = os.path.splitext(fname)[0] + "-baked.btl"
+        if args.out:
+            out = os.path.join(args.out, os.path.basename(out))
+        codec.encodeFigure(figure).save(out)
+        print(f"{fname}: {n_frames} frames, {elapsed:.2f} s -> {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+Shared, immutable figure definitions.
+
+A Skeleton is the part of a figure XML that never changes while animating:
+topology, lengths, colours and bone types. It is parsed once per file and
+shared by every instance loaded from that file; an instance (Pose) only
+carries its own angles and root position.
+
+This module deliberately doesn't import pygame.
+"""
+import os
+import xml.etree.ElementTree as ET
+from array import array
+from enum import Enum
+import kinematics
+
+
+class BoneType(Enum):
+    UNDEF = 0
+    LINE = 1
+    CIRCLE = 2
+
+
+DEFAULT_COLOR = (0, 0, 0)
+DEFAULT_THICKNESS = 16
+DEFAULT_ROOT_POS = (200, 240)
+CAP_RADIUS = 10     # joint circles drawn at both ends of a bone
+
+
+class Skeleton:
+    """
+    Bones are stored flat, in pre-order (a parent always comes before its
+    children), as parallel tuples indexed by bone.
+    """
+    __slots__ = ("name", "source", "parents", "children", "lengths", "rest_angles",
+                 "colors", "types", "thicknesses", "other_end", "bone_names", "reach")
+
+    # abspath -> (mtime, Skeleton); see load()
+    _cache = {}
+
+    def __init__(self, name, parents, lengths, rest_angles, colors, types,
+                 thicknesses, other_end, source=None, bone_names=None):
+        """
+        bone_names: optional per-bone names ("" for unnamed bones), used to
+                    match bones between skeletons (see retarget.py)
+        """
+        self.name = name
+        self.source = source
+        self.parents = tuple(parents)
+        self.lengths = tuple(lengths)
+        self.rest_angles = tuple(rest_angles)
+        self.colors = tuple(colors)
+        self.types = tuple(types)
+        self.thicknesses = tuple(thicknesses)
+        self.other_end = tuple(other_end)
+        self.bone_names = tuple(bone_names) if bone_names is not None else ("",) * len(self.parents)
+
+        children = [[] for _ in self.parents]
+        for i, parent in enumerate(self.parents):
+            if parent >= 0:
+                children[parent].append(i)
+        self.children = tuple(map(tuple, children))
+
+        # upper bound on how far anything drawn can be from the root's start
+        # point, whatever the pose; used for culling without kinematics
+        starts, ends = [], []
+        for i, parent in enumerate(self.parents):
+            start = 0.0 if parent < 0 else (starts if self.other_end[i] else ends)[parent]
+            starts.append(start)
+            ends.append(start + abs(self.lengths[i]))
+        self.reach = max(ends, default=0.0) + max(self.thicknesses, default=0) / 2 + CAP_RADIUS
+
+    def __len__(self):
+        return len(self.parents)
+
+    @classmethod
+    def load(cls, xml_fname):
+        """
+        Parses _xml_fname_, or returns the Skeleton already parsed from it
+        (as long as the file hasn't changed since)
+        """
+        path = os.path.abspath(xml_fname)
+        mtime = os.path.getmtime(path)
+        cached = cls._cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        skeleton = cls.fromXML(ET.parse(path).getroot(), path)
+        cls._cache[path] = (mtime, skeleton)
+        return skeleton
+
+    @classmethod
+    def fromXML(cls, figure_node, source=None):
+        """
+        Raises ValueError if _figure_node_ isn't a <figure> of bones
+        """
+        where = source or "figure"
+        root_node = figure_node.find("bone")
+        if figure_node.tag != "figure" or root_node is None:
+            raise ValueError(f"{where}: not a figure (<{figure_node.tag}> without a <bone>)")
+        fields = ([], [], [], [], [], [], [])
+        names = []
+
+        def visit(bone_node, parent):
+            parents, lengths, angles, colors, types, thicknesses, other_end = fields
+            index = len(parents)
+            attrib = bone_node.attrib
+
+            names.append(attrib.get("name", ""))
+            parents.append(parent)
+            lengths.append(float(attrib["len"]))
+            angles.append(float(attrib["angle"]))
+            other_end.append("w" in attrib)
+
+            color = DEFAULT_COLOR
+            if "color" in attrib:
+                color = tuple(int(c) for c in attrib["color"].split("|"))
+            colors.append(color)
+
+            types.append(BoneType.CIRCLE if attrib["type"] == "circle" else BoneType.LINE)
+            thicknesses.append(DEFAULT_THICKNESS)
+
+            for child_node in bone_node:
+                visit(child_node, index)
+
+        try:
+            visit(root_node, -1)
+        except KeyError as e:
+            raise ValueError(f"{where}: bone without a {e} attribute") from None
+        return cls(figure_node.get("name", ""), *fields, source=source, bone_names=names)
+
+    @classmethod
+    def fromBones(cls, bones, name=""):
+        """
+        bones: pre-order list of Bone objects with .index set
+        """
+        parents = [bone.parent.index if bone.parent else -1 for bone in bones]
+        return cls(name, parents,
+                   [bone.length for bone in bones],
+                   [bone.angle for bone in bones],
+                   [bone.color for bone in bones],
+                   [bone.type for bone in bones],
+                   [bone.thickness for bone in bones],
+                   [bone.other_end for bone in bones])
+
+    @classmethod
+    def clearCache(cls):
+        cls._cache.clear()
+
+    def newPose(self, x=DEFAULT_ROOT_POS[0], y=DEFAULT_ROOT_POS[1]):
+        """
+        A new instance of this skeleton in its rest pose
+        """
+        return Pose(self, array("d", self.rest_angles), x, y)
+
+
+class Pose:
+    """
+    Per-instance state of a figure: one angle per bone (same meaning as
+    Bone.angle) and the root position.
+    """
+    __slots__ = ("skeleton", "angles", "x", "y")
+
+    def __init__(self, skeleton, angles, x, y):
+        self.skeleton = skeleton
+        self.angles = angles
+        self.x = x
+        self.y = y
+
+    def positions(self):
+        """
+        [(x1, y1, x2, y2)] per bone, in skeleton order
+        """
+        return kinematics.posePositions(self.skeleton, self.angles, self.x, self.y)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+SVG export of stored timelines, straight from the kinematics arrays.
+
+Bones become what drawBoneShape draws: a line bone a line of its
+thickness with butt ends, a circle bone a ring through its two end
+points, each with a disc capping both joints (minus the caps a child's
+cap covers, see raster.visibleCaps). Styles are presentation attributes,
+which every SVG reader understands. They are fixed per rig, so a frame
+is only coordinates: one %-format string per rig, filled from a row of
+an array that is computed for a chunk of frames at once.
+
+Two outputs:
+
+    - an SVG file per frame, written by several processes at once
+    - a single animated SVG: each frame is a group, shown in turn by a
+      discrete SMIL animation of its visibility
+
+Both are written a frame at a time, so memory doesn't grow with the
+length of the timeline.
+
+    python svgexport.py figure.xml capture.btl [out.svg | outdir/]
+
+exports an encoded timeline (see framecodec.py) recorded with figure.xml.
+"""
+import multiprocessing as mp
+import os
+import sys
+from collections import deque
+import numpy as np
+import const
+import framecodec
+import kinematics
+from raster import visibleCaps, RING_WIDTH
+from skeleton import BoneType, CAP_RADIUS, Skeleton
+
+FRAME_PATTERN = "frame_%05d.svg"
+
+
+def hexColor(color):
+    return "#%02x%02x%02x" % tuple(color[:3])
+
+
+class SVGFrames:
+    """
+    Markup of a rig's frames
+    """
+
+    def __init__(self, rig, rect=const.EXPORT_RECT, background=const.BGCOLOR, precision=1):
+        """
+        rect: part of the stage shown, (x, y, w, h)
+        background: fill colour, or None for a transparent background
+        precision: decimals of coordinates
+        """
+        self.rig = rig
+        self.rect = tuple(rect)
+        self.background = background
+
+        coord = f"%.{precision}f"
+        caps = visibleCaps(rig)
+        n_bones = len(rig.parents)
+        parts = []
+        columns = []    # into positions (bones * 4), then ring centres (bones * 2)
+        for i, bone_type in enumerate(rig.types):
+            color = hexColor(rig.colors[i])
+            x1, y1, x2, y2 = 4 * i, 4 * i + 1, 4 * i + 2, 4 * i + 3
+            if bone_type == BoneType.CIRCLE:
+                radius = max(rig.lengths[i] / 2 - RING_WIDTH / 2, 0)
+                parts.append(f'<circle cx="{coord}" cy="{coord}" r="{radius:g}" fill="none" '
+                             f'stroke="{color}" stroke-width="{RING_WIDTH}"/>')
+                columns += [4 * n_bones + 2 * i, 4 * n_bones + 2 * i + 1]
+            else:
+                parts.append(f'<line x1="{coord}" y1="{coord}" x2="{coord}" y2="{coord}" '
+                             f'stroke="{color}" stroke-width="{rig.thicknesses[i]}"/>')
+                columns += [x1, y1, x2, y2]
+            for (x, y), visible in zip(((x1, y1), (x2, y2)), caps[i]):
+                if visible:
+                    parts.append(f'<circle cx="{coord}" cy="{coord}" r="{CAP_RADIUS}" fill="{color}"/>')
+                    columns += [x, y]
+        self.template = "".join(parts)
+        self.columns = np.array(columns, dtype=np.intp)
+
+    def header(self):
+        x, y, w, h = self.rect
+        out = f'<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}" ' \
+              f'viewBox="{x} {y} {w} {h}">\n'
+        if self.background is not None:
+            out += f'<rect x="{x}" y="{y}" width="{w}" height="{h}" fill="{hexColor(self.background)}"/>\n'
+        return out
+
+    def frames(self, positions):
+        """
+        Yields the markup of each frame of (frames, bones, 4) positions
+        """
+        centres = (positions[..., :2] + positions[..., 2:]) / 2
+        values = np.concatenate((positions.reshape(len(positions), -1),
+                                 centres.reshape(len(positions), -1)), axis=1)[:, self.columns]
+        template = self.template
+        for row in values.tolist():
+            yield template % tuple(row)
+
+
+def figureChunks(figure, frames, chunk=const.SVG_CHUNK):
+    """
+    (angles, translations) of _frames_ of a Bone-tree figure, _chunk_ at a time
+    """
+    angles, translations = kinematics.timelineArrays(figure)
+    frames = np.asarray(frames, dtype=np.intp)
+    for start in range(0, len(frames), chunk):
+        part = frames[start:start + chunk]
+        yield angles[part], translations[part]
+
+
+def timelineChunks(timeline):
+    """
+    (angles, translations) of an EncodedTimeline, a block at a time
+    """
+    for index in range(len(timeline.blocks)):
+        channels = np.array(timeline.decodeBlock(index), dtype=np.float64)
+        yield channels[:-2].T, channels[-2:].T
+
+
+def writeAnimatedSVG(rig, chunks, n_frames, fname, rect=const.EXPORT_RECT, fps=const.FPS,
+                     background=const.BGCOLOR, progress=None):
+    """
+    chunks: iterable of (angles, translations) arrays covering n_frames
+            frames; consumed as the file is written
+    progress: optional callable (frames done, n_frames), called per chunk
+    """
+    svg = SVGFrames(rig, rect, background)
+    duration = n_frames / fps
+    with open(fname, "w") as f:
+        f.write(svg.header())
+        k = 0
+        for angles, translations in chunks:
+            positions = kinematics.batchPositions(rig, angles, translations)
+            for markup in svg.frames(positions):
+                f.write(frameGroup(markup, k, n_frames, duration))
+                k += 1
+            if progress:
+                progress(k, n_frames)
+        f.write("</svg>\n")
+    if k != n_frames:
+        raise ValueError(f"svgexport: got {k} frames, expected {n_frames}")
+
+
+def frameGroup(markup, k, n_frames, duration):
+    """
+    Frame _k_ as a group that is visible during its slot of the loop
+    """
+    if n_frames == 1:
+        return f"<g>{markup}</g>\n"
+    start, end = k / n_frames, (k + 1) / n_frames
+    if k == 0:
+        values, times = "visible;hidden", f"0;{end:.6g}"
+    elif k == n_frames - 1:
+        values, times = "hidden;visible", f"0;{start:.6g}"
+    else:
+        values, times = "hidden;visible;hidden", f"0;{start:.6g};{end:.6g}"
+    return f'<g visibility="{"visible" if k == 0 else "hidden"}">' \
+           f'<animate attributeName="visibility" values="{values}" keyTimes="{times}" ' \
+           f'dur="{duration:.6g}s" calcMode="discrete" repeatCount="indefinite"/>{markup}</g>\n'
+
+
+def writeFrameFiles(rig, angles, translations, dirname, first=0, rect=const.EXPORT_RECT,
+                    background=const.BGCOLOR, pattern=FRAME_PATTERN):
+    """
+    Writes frames first, first + 1, ... as separate SVG files
+    """
+    svg = SVGFrames(rig, rect, background)
+    header = svg.header()
+    positions = kinematics.batchPositions(rig, angles, translations)
+    for k, markup in enumerate(svg.frames(positions), first):
+        with open(os.path.join(dirname, pattern % k), "w") as f:
+            f.write(header + markup + "\n</svg>\n")
+
+
+def writeFrameFilesParallel(rig, chunks, dirname, rect=const.EXPORT_RECT,
+                            background=const.BGCOLOR, workers=None):
+    """
+    writeFrameFiles for every (angles, translations) chunk, in _workers_
+    processes; at most two chunks per worker are waiting at any time.
+    Returns the number of frames written.
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(dirname, exist_ok=True)
+    first = 0
+    if workers == 1:
+        for angles, translations in chunks:
+            writeFrameFiles(rig, angles, translations, dirname, first, rect, background)
+            first += len(angles)
+        return first
+
+    with mp.get_context("spawn").Pool(workers) as pool:
+        pending = deque()
+        for angles, translations in chunks:
+            pending.append(pool.apply_async(writeFrameFiles, (rig, angles, translations, dirname,
+                                                              first, tuple(rect), background)))
+            first += len(angles)
+            if len(pending) >= 2 * workers:
+                pending.popleft().get()
+        for result in pending:
+            result.get()
+    return first
+
+
+def exportSVGFrames(figure, dirname, frames=None, rect=const.EXPORT_RECT,
+                    background=const.BGCOLOR, workers=None):
+    """
+    Writes _frames_ (default: the whole timeline) of a Bone-tree figure as
+    dirname/frame_00000.svg, ..., numbered by their position in _frames_.
+    Returns the file names.
+    """
+    if frames is None:
+        frames = range(figure.frameCount())
+    frames = list(frames)
+    writeFrameFilesParallel(figure.getSkeleton(), figureChunks(figure, frames), dirname,
+                            rect, background, workers)
+    return [os.path.join(dirname, FRAME_PATTERN % k) for k in range(len(frames))]
+
+
+def exportAnimatedSVG(figure, fname, frames=None, rect=const.EXPORT_RECT, fps=const.FPS,
+                      background=const.BGCOLOR, progress=None):
+    """
+    Writes _frames_ (default: the whole timeline) of a Bone-tree figure as
+    one looping animated SVG
+    """
+    if frames is None:
+        frames = range(figure.frameCount())
+    frames = list(frames)
+    writeAnimatedSVG(figure.getSkeleton(), figureChunks(figure, frames), len(frames),
+                     fname, rect, fps, background, progress)
+
+
+def main(argv=None):
+    argv = argv if argv is not None else sys.argv[1:]
+    if len(argv) != 3:
+        print("usage: svgexport.py figure.xml capture.btl (out.svg | outdir/)")
+        return 2
+
+    xml_fname, timeline_fname, out = argv
+    rig = Skeleton.load(xml_fname)
+    timeline = framecodec.EncodedTimeline.load(timeline_fname)
+    if timeline.n_channels != len(rig) + 2:
+        print(f"{timeline_fname}: {timeline.n_channels} channels, {xml_fname} needs {len(rig) + 2}")
+        return 1
+
+    if out.endswith(os.sep) or os.path.isdir(out):
+        writeFrameFilesParallel(rig, timelineChunks(timeline), out)
+        print(f"{timeline.n_frames} frames -> {os.path.join(out, FRAME_PATTERN)}")
+    else:
+        writeAnimatedSVG(rig, timelineChunks(timeline), timeline.n_frames, out)
+        print(f"{timeline.n_frames} frames -> {out} ({os.path.getsize(out)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,13 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import catalog
+
+
+def test_index_skips_files_gone_since_the_scan_listed_them(tmp_path):
+    index = catalog.Catalog(str(tmp_path / "catalog.sqlite"))
+    try:
+        assert index.index(str(tmp_path / "deleted.xml"), 0.0) is False
+        assert len(index) == 0
+    finally:
+        index.close()
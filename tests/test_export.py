@@ -0,0 +1,27 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame as pg
+from PIL import Image
+import Bone
+import export
+
+FIGURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "man_figure.xml")
+
+
+def offRectFigure(n_frames=3):
+    figure = Bone.Figure.fromFile(FIGURE)
+    for bone in figure.bones:
+        bone.frame_angles = [bone.angle] * n_frames
+    # well right of EXPORT_RECT
+    figure.root.frame_translations = [(5000.0, 5000.0)] * n_frames
+    figure.setFrame(0)
+    return figure
+
+
+def test_numpy_export_of_off_rect_figure(tmp_path):
+    pg.init()
+    fname = str(tmp_path / "off.gif")
+    export.exportAnimation(offRectFigure(), fname, backend="numpy")
+    with Image.open(fname) as image:
+        assert image.n_frames == 3
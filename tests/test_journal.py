@@ -0,0 +1,28 @@
+import os
+
+import Bone
+import journal
+from history import History
+
+FIGURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "man_figure.xml")
+
+
+def test_recovers_frames_changed_in_place(tmp_path):
+    figure = Bone.Figure.fromFile(FIGURE)
+    history = History(figure)
+    path = str(tmp_path / "figure.journal")
+    recorder = journal.Journal(path, figure, history)
+    for i in range(20):
+        figure.bones[1].angle = i
+        figure.addFrame()
+        history.recordFrameAdded()
+    # whole channels replaced, as a bake does; read off the figure by the writer
+    history.replaceChannels({2: [float(i) for i in range(figure.frameCount())]})
+    history.undo()
+    history.redo()
+    recorder.close()
+
+    recovered = Bone.Figure.fromFile(FIGURE)
+    assert journal.Journal.recover(path, recovered) == figure.frameCount()
+    for a, b in zip(figure.bones, recovered.bones):
+        assert list(a.frame_angles) == list(b.frame_angles)
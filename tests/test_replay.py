@@ -0,0 +1,39 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import time
+import pygame as pg
+import replay
+from main import MainApplication
+
+FIGURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "man_figure.xml")
+
+
+def test_replays_drags_made_zoomed_and_panned(tmp_path):
+    app = MainApplication([FIGURE], library=False, autosave=False)
+    app.clock = replay.VirtualClock()
+    while app.figure_def is None:
+        app.loader.drain()
+        time.sleep(0.001)
+    app.viewport.zoom = 2.0
+    app.viewport.x, app.viewport.y = 80.0, 40.0
+
+    fname = str(tmp_path / "session.jsonl")
+    app.recorder = replay.Recorder(fname, FIGURE, app.figure_def, app.viewport)
+    root = app.figure_def.root
+    start = (root.pos_x1, root.pos_y1)
+    sx, sy = app.viewport.toScreen(root.pos_x1, root.pos_y1)
+    ticks = [((sx, sy), [pg.event.Event(pg.MOUSEBUTTONDOWN, pos=(sx, sy), button=1)]),
+             ((sx + 30, sy + 20), [pg.event.Event(pg.MOUSEMOTION, pos=(sx + 30, sy + 20),
+                                                  rel=(30, 20), buttons=(1, 0, 0))]),
+             ((sx + 30, sy + 20), [pg.event.Event(pg.MOUSEBUTTONUP, pos=(sx + 30, sy + 20), button=1)])]
+    for mouse_pos, events in ticks:
+        app.tick(events, mouse_pos)
+        app.clock.tick()
+    moved = (root.pos_x1, root.pos_y1)
+    app.shutdown()
+    pg.quit()
+
+    report = replay.replay(fname)
+    assert moved != start
+    assert report.ok, str(report)
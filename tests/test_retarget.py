@@ -0,0 +1,42 @@
+import os
+import shutil
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import framecodec
+import retarget
+from skeleton import Skeleton
+
+FIGURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "man_figure.xml")
+
+
+def test_batch_reports_non_figure_xml(tmp_path):
+    n_bones = len(Skeleton.load(FIGURE))
+    motion = str(tmp_path / "m.btl")
+    framecodec.FrameCodec().encode(np.zeros((n_bones + 2, 4)).tolist()).save(motion)
+
+    figs = tmp_path / "figs"
+    figs.mkdir()
+    shutil.copy(FIGURE, figs / "a.xml")
+    (figs / "b.xml").write_text("<config><option name='x'/></config>")
+    (figs / "c.xml").write_text("<figure><bone")
+
+    jobs = [(motion, FIGURE, str(figs / name), str(tmp_path / (name + ".btl")))
+            for name in ("a.xml", "b.xml", "c.xml")]
+    results = retarget.retargetBatch(jobs)
+    assert not isinstance(results[0][1], Exception)
+    assert isinstance(results[1][1], ValueError)
+    assert isinstance(results[2][1], ET.ParseError)
+
+
+def test_cli_finishes_with_non_figure_xml(tmp_path, capsys):
+    n_bones = len(Skeleton.load(FIGURE))
+    motion = str(tmp_path / "m.btl")
+    framecodec.FrameCodec().encode(np.zeros((n_bones + 2, 4)).tolist()).save(motion)
+    figs = tmp_path / "figs"
+    figs.mkdir()
+    shutil.copy(FIGURE, figs / "a.xml")
+    (figs / "b.xml").write_text("<config/>")
+
+    assert retarget.main(["-s", FIGURE, "-j", "1", motion, str(figs)]) == 1
+    assert "1/2 retargeted" in capsys.readouterr().out
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Double-buffered pose updates on a worker thread.
+
+Figures that aren't being edited only need forward kinematics each tick.
+After handling input, the main loop submits them; the worker snapshots
+their live poses and computes their bones (batched per skeleton, see
+kinematics.batchPositions) into the back buffer while the main loop draws
+the front one and flips the display. The next tick's swap() makes the
+back buffer the front one, so what's drawn lags the live poses by a tick.
+
+Only swap() waits for the worker; the main loop calls it first thing in
+a tick, before handling input can change any figure, so the worker's
+snapshot never overlaps with edits.
+
+Only forward kinematics moves here. The edited figure is still updated
+on the main thread, since its gimbals follow the mouse; playback poses and renders
+its stored frames on its own thread (see playback.py), and secondary
+motion is baked into frames (see secondary.py) rather than run per tick,
+so neither has a per-tick step to move. There is no frame interpolation
+in the editor loop to move either.
+
+Figures drawn from these snapshots never run Figure.update, so their
+bones' pos_x1/pos_y1/pos_x2/pos_y2 keep whatever was computed last
+(only the root's position, which is stored rather than derived, is
+current). Code reading bone positions of a figure other than the edited
+one must use the segments here, or call figure.update() first.
+"""
+import threading
+import kinematics
+from lod import poseSegments
+from skeleton import Pose
+
+
+class PoseState:
+    """
+    One buffer: the poses of a tick with their segments (see lod.LODRenderer.draw)
+    """
+
+    def __init__(self):
+        self.tick = 0
+        self.posed = []     # (Pose, segments) pairs
+
+
+class PoseUpdater:
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        # guarded by lock
+        self.front = PoseState()
+        self.back = PoseState()
+        self.pending = None     # figures to compute, if the worker hasn't started on them
+        self.submitted = 0      # tick of the latest submission
+        self.running = True
+
+        self.thread = threading.Thread(target=self.run, name="pose update", daemon=True)
+        self.thread.start()
+
+    ## main thread
+
+    def submit(self, figures):
+        """
+        Queues the live poses of Bone-tree _figures_ for the next tick
+        """
+        with self.lock:
+            self.submitted += 1
+            self.pending = list(figures)
+            self.lock.notify()
+
+    def swap(self):
+        """
+        Waits for the last submission to be computed, then makes it the
+        front buffer. Returns the front PoseState.
+        """
+        with self.lock:
+            while self.submitted not in (self.front.tick, self.back.tick) and self.running:
+                self.lock.wait()
+            if self.back.tick > self.front.tick:
+                self.front, self.back = self.back, self.front
+            return self.front
+
+    def close(self):
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+        self.thread.join()
+
+    ## worker thread
+
+    def run(self):
+        while True:
+            with self.lock:
+                while self.pending is None and self.running:
+                    self.lock.wait()
+                if not self.running:
+                    return
+                figures, self.pending = self.pending, None
+                tick, state = self.submitted, self.back
+
+            # the main thread doesn't read the back buffer until swap()
+            # sees it done
+            state.posed = computePoses(figures)
+            with self.lock:
+                state.tick = tick
+                self.lock.notify_all()
+
+
+def computePoses(figures):
+    """
+    Snapshots of Bone-tree figures' live poses as (Pose, segments) pairs,
+    in the order given
+    """
+    poses = [Pose(figure.getSkeleton(), [bone.angle for bone in figure.bones],
+                  figure.root.pos_x1, figure.root.pos_y1) for figure in figures]
+    groups = {}
+    for i, pose in enumerate(poses):
+        groups.setdefault(id(pose.skeleton), []).append(i)
+
+    posed = [None] * len(poses)
+    for indices in groups.values():
+        group = [poses[i] for i in indices]
+        positions = kinematics.batchPositions(group[0].skeleton, [pose.angles for pose in group],
+                                              [(pose.x, pose.y) for pose in group])
+        for i, pose, p in zip(indices, group, positions.tolist()):
+            posed[i] = (pose, poseSegments(pose, p))
+    return posed
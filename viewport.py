@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Zoom and pan over a stage larger than the canvas.
+
+Figures live in stage coordinates; a Viewport maps them onto the canvas
+rect of the window. Everything outside the visible part of the stage is
+culled before it is transformed or drawn: whole figures by their
+skeleton's reach around the root, single bones by their bounding box.
+
+Backgrounds are split into square tiles that are produced on demand (by a
+tile source) and kept in LRU caches, both as produced and scaled to the
+current zoom.
+"""
+import math
+import os
+from collections import OrderedDict
+import numpy as np
+import pygame as pg
+import const
+
+
+class Viewport:
+
+    def __init__(self, rect=None, zoom=1.0):
+        """
+        rect: screen area showing the stage (default: the canvas)
+        """
+        self.rect = pg.Rect(rect or ((0, 0), const.CANVAS_DIM))
+        self.x = 0.0    # stage coordinates shown at rect.topleft
+        self.y = 0.0
+        self.zoom = zoom
+
+    def state(self):
+        """
+        Hashable summary; changes whenever the mapping does
+        """
+        return (self.x, self.y, self.zoom, tuple(self.rect))
+
+    def copy(self, rect=None):
+        """
+        Same mapping onto another screen rect (default: the same one)
+        """
+        view = Viewport(rect or self.rect, self.zoom)
+        view.x, view.y = self.x, self.y
+        return view
+
+    def reset(self):
+        self.x = self.y = 0.0
+        self.zoom = 1.0
+
+    ## transforms
+
+    def toScreen(self, x, y):
+        return ((x - self.x) * self.zoom + self.rect.x,
+                (y - self.y) * self.zoom + self.rect.y)
+
+    def toWorld(self, sx, sy):
+        return ((sx - self.rect.x) / self.zoom + self.x,
+                (sy - self.rect.y) / self.zoom + self.y)
+
+    def toScreenArray(self, points):
+        """
+        points: (..., 2) array of stage coordinates
+        """
+        out = (np.asarray(points, dtype=np.float64) - (self.x, self.y)) * self.zoom
+        out += self.rect.topleft
+        return out
+
+    def worldRect(self):
+        """
+        Visible part of the stage as (x0, y0, x1, y1)
+        """
+        return (self.x, self.y,
+                self.x + self.rect.width / self.zoom,
+                self.y + self.rect.height / self.zoom)
+
+    ## navigation
+
+    def pan(self, dx, dy):
+        """
+        Moves the stage by (dx, dy) screen pixels
+        """
+        self.x -= dx / self.zoom
+        self.y -= dy / self.zoom
+
+    def zoomAt(self, screen_pos, factor):
+        """
+        Zooms by _factor_ keeping the stage point under screen_pos in place
+        """
+        wx, wy = self.toWorld(*screen_pos)
+        self.zoom = min(max(self.zoom * factor, const.VIEW_ZOOM_MIN), const.VIEW_ZOOM_MAX)
+        self.x = wx - (screen_pos[0] - self.rect.x) / self.zoom
+        self.y = wy - (screen_pos[1] - self.rect.y) / self.zoom
+
+    ## culling
+
+    def sees(self, x, y, radius):
+        """
+        True if a circle around stage point (x, y) overlaps the view
+        """
+        x0, y0, x1, y1 = self.worldRect()
+        return x + radius >= x0 and x - radius <= x1 and y + radius >= y0 and y - radius <= y1
+
+    def cullFigures(self, figures):
+        return [figure for figure in figures
+                if self.sees(figure.root.pos_x1, figure.root.pos_y1, figure.getSkeleton().reach)]
+
+    def cullPoses(self, poses):
+        return [pose for pose in poses if self.sees(pose.x, pose.y, pose.skeleton.reach)]
+
+    def transformSegments(self, segments):
+        """
+        Stage segments (see lod.figureSegments) to screen ones, dropping
+        bones that fall outside the view
+        """
+        zoom, ox, oy = self.zoom, self.x, self.y
+        left, top, right, bottom = self.rect.left, self.rect.top, self.rect.right, self.rect.bottom
+        out = []
+        for bone_type, color, thickness, length, x1, y1, x2, y2 in segments:
+            sx1, sy1 = (x1 - ox) * zoom + left, (y1 - oy) * zoom + top
+            sx2, sy2 = (x2 - ox) * zoom + left, (y2 - oy) * zoom + top
+            pad = (thickness / 2 + const.VIEW_CULL_PAD) * zoom
+            if max(sx1, sx2) + pad < left or min(sx1, sx2) - pad > right \
+                    or max(sy1, sy2) + pad < top or min(sy1, sy2) - pad > bottom:
+                continue
+            out.append((bone_type, color, max(1, round(thickness * zoom)), length * zoom,
+                        sx1, sy1, sx2, sy2))
+        return out
+
+
+def gridTile(tx, ty, size):
+    """
+    Default tile source: plain background with the tile edges drawn in,
+    so position and scale stay readable on an empty stage
+    """
+    tile = pg.Surface((size, size))
+    tile.fill(const.BGCOLOR)
+    pg.draw.line(tile, const.COL_STAGE_GRID, (0, 0), (size - 1, 0))
+    pg.draw.line(tile, const.COL_STAGE_GRID, (0, 0), (0, size - 1))
+    return tile
+
+
+class DirectoryTiles:
+    """
+    Tile source reading <dirname>/<tx>_<ty>.png; missing tiles fall back
+    to _fallback_ (None leaves them empty)
+    """
+
+    def __init__(self, dirname, fallback=gridTile):
+        self.dirname = dirname
+        self.fallback = fallback
+
+    def __call__(self, tx, ty, size):
+        path = os.path.join(self.dirname, f"{tx}_{ty}.png")
+        if not os.path.exists(path):
+            return self.fallback(tx, ty, size) if self.fallback else None
+
+        tile = pg.image.load(path)
+        if pg.display.get_surface() is not None:
+            tile = tile.convert()
+        if tile.get_size() != (size, size):
+            tile = pg.transform.smoothscale(tile, (size, size))
+        return tile
+
+
+class TiledBackground:
+
+    def __init__(self, source=gridTile, tile_size=const.TILE_SIZE,
+                 capacity=const.TILE_CACHE):
+        """
+        source: callable (tx, ty, size) -> Surface or None, called at most
+                once per tile until the tile is evicted
+        capacity: tiles kept per cache; must exceed the tiles visible at
+                  const.VIEW_ZOOM_MIN, or a full view evicts itself each frame
+        """
+        self.source = source
+        self.tile_size = tile_size
+        self.capacity = capacity
+        self.source_tiles = OrderedDict()   # (tx, ty) -> Surface or None
+        self.scaled_tiles = OrderedDict()   # (tx, ty, zoom) -> Surface or None
+        self.loads = 0
+
+    def cached(self, cache, key, make):
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+        tile = cache[key] = make()
+        if len(cache) > self.capacity:
+            cache.popitem(last=False)
+        return tile
+
+    def sourceTile(self, tx, ty):
+        def load():
+            self.loads += 1
+            return self.source(tx, ty, self.tile_size)
+        return self.cached(self.source_tiles, (tx, ty), load)
+
+    def scaledTile(self, tx, ty, zoom):
+        if zoom == 1.0:
+            return self.sourceTile(tx, ty)
+
+        def scale():
+            tile = self.sourceTile(tx, ty)
+            if tile is None:
+                return None
+            # one extra pixel hides seams from rounding tile positions
+            size = math.ceil(self.tile_size * zoom) + 1
+            return pg.transform.scale(tile, (size, size))
+        return self.cached(self.scaled_tiles, (tx, ty, zoom), scale)
+
+    def draw(self, screen, viewport):
+        x0, y0, x1, y1 = viewport.worldRect()
+        size = self.tile_size
+        for ty in range(math.floor(y0 / size), math.floor(y1 / size) + 1):
+            for tx in range(math.floor(x0 / size), math.floor(x1 / size) + 1):
+                tile = self.scaledTile(tx, ty, viewport.zoom)
+                if tile is not None:
+                    sx, sy = viewport.toScreen(tx * size, ty * size)
+                    screen.blit(tile, (math.floor(sx), math.floor(sy)))